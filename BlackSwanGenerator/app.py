@@ -1,39 +1,160 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from collections import defaultdict
-from pymongo import MongoClient
-from bson import ObjectId
-from openai import OpenAI
-import json, re, os
+import llm
+import os, json, gzip, time, uuid, hashlib, threading
 from dotenv import load_dotenv
-import requests
-from mongolib import read_mongo_database
-from monte_carlo.monte_carlo_portfolio import PortfolioMonteCarlo
-from recommend.quant_modeling import analyze_portfolio
+import service
+from service import MONGO_URI
+from result_cache import result_cache
+from monte_carlo.charts import pack_chart_data
+from mongolib import warm_up
+from jobs import JobManager, SharedJob
+from state_store import StateStore
+import metrics
 
 load_dotenv()
-api_key = os.getenv("API_KEY")
-claude_api_key = os.getenv("CLAUDE_API_KEY")
-
-# MongoDB connection details
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("DB_NAME")
-COLLECTION_NAME = os.getenv("COLLECTION_NAME")
-USER_ID = os.getenv("USER_ID")
 
 app = Flask(__name__)
-CORS(app)
+# Origins of the frontend, comma-separated. Credentials are allowed so that the session cookie (see session_id)
+# reaches a frontend on another origin, so no other site may read or drive a visitor's session
+FRONTEND_ORIGINS = [origin.strip() for origin in os.getenv("FRONTEND_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(',') if origin.strip()]
+CORS(app, origins=FRONTEND_ORIGINS, supports_credentials=True)
+
+# Open the pooled MongoDB connection off the request path
+if MONGO_URI:
+    threading.Thread(target=warm_up, args=(MONGO_URI,), daemon=True).start()
+
+
+def dump_job_result(job):
+    """
+    JSON form of a finished job's result for the other worker processes: its answer and, for a stress test,
+    the result_cache key of the run and the fake event.
+    """
+    shared = {'answer': json.loads(json.dumps(job_answer(job), default=float))}
+    if job.kind != 'scenarios':
+        shared.update(key=job.result[1].key, fake_event=job.result[2])
+    return shared
+
+
+def load_job_result(kind, shared):
+    """
+    A job result in the shape the job endpoints expect, from dump_job_result; None once the run has expired.
+    """
+    if kind == 'scenarios':
+        return shared['answer']
+    result = result_cache.get(shared['key'], ttl=result_cache.keep)
+    return None if result is None else (shared['answer'], result, shared['fake_event'])
+
+
+# Background stress tests started through /jobs/stress_test. With STATE_DB_PATH, their status and results are
+# shared with the other worker processes; their event streams and cancellation need the worker running them
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 60 * 60))
+job_manager = JobManager(
+    max_workers=int(os.getenv("JOB_WORKERS", 4)),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", 32)),
+    retention=JOB_RETENTION,
+    store=StateStore(max_sessions=1024, ttl=JOB_RETENTION, shared_path=os.getenv("STATE_DB_PATH"), table='jobs') if os.getenv("STATE_DB_PATH") else None,
+    dump_result=dump_job_result,
+    load_result=load_job_result,
+)
+STRESS_TEST_STAGES = ['resolving dates', 'generating fake event', 'mapping ETFs', 'calibrating', 'simulating', 'recommending', 'summarizing']
+SCENARIO_STAGES = ['resolving dates', 'mapping ETFs', 'calibrating', 'simulating']
+
+# Always send the per-request Server-Timing breakdown (otherwise only when asked with an X-Timing header)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+def job_samples():
+    with job_manager.lock:
+        states = [job.state for job in job_manager.jobs.values()]
+    return [('blackswan_jobs', 'gauge', 'Background jobs by state', {'state': state}, states.count(state))
+            for state in ('queued', 'running', 'done', 'failed', 'cancelled')]
+
+
+metrics.register_collector(job_samples)
+
+# Seconds between keep-alive comments on idle event streams; a write is also how a disconnect is noticed
+SSE_KEEPALIVE = 10
+
+# Cookie that identifies clients sending neither an X-Session-Id header nor a session query parameter
+SESSION_COOKIE = 'blackswan_session'
+# SameSite of the session cookie; 'None' (sent as Secure) when the frontend is served from another site
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "Lax")
+
+
+def session_id():
+    """
+    The caller's session: the X-Session-Id header or session query parameter, otherwise the client's session
+    cookie, which is created on its first request.
+    """
+    session = request.headers.get('X-Session-Id') or request.args.get('session') or request.cookies.get(SESSION_COOKIE)
+    if not session:
+        session = g.setdefault('new_session', uuid.uuid4().hex)
+    return session
+
+
+def defer_summary():
+    """
+    ?summary=defer: answer as soon as the numbers are ready, the summary shows up in /get_actions later.
+    """
+    return request.args.get('summary') == 'defer'
+
+
+def simulation_engine(data=None):
+    """
+    ?engine=bootstrap (or 'engine' in the JSON body): resample the event's history instead of simulating the
+    calibrated model. Returns None for an unknown engine.
+    """
+    engine = (data or {}).get('engine') or request.args.get('engine') or 'jump_diffusion'
+    return engine if engine in service.ENGINES else None
+
+
+def unknown_engine():
+    return jsonify({"error": f"Unknown engine, expected one of {list(service.ENGINES)}"}), 400
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.timings_token = metrics.start_timings()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Request latency and status counts per endpoint, and the Server-Timing header with the stage breakdown.
+    """
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('blackswan_request_seconds', elapsed, 'HTTP request latency', endpoint=endpoint)
+    metrics.inc('blackswan_requests_total', 1, 'HTTP requests by endpoint and status', endpoint=endpoint, status=response.status_code)
+    if 'new_session' in g:
+        response.set_cookie(SESSION_COOKIE, g.new_session, max_age=30 * 24 * 60 * 60, httponly=True,
+                            samesite=SESSION_COOKIE_SAMESITE, secure=SESSION_COOKIE_SAMESITE == 'None')
+    totals = metrics.stop_timings(g.pop('timings_token'))
+    if SERVER_TIMING or request.headers.get('X-Timing'):
+        totals['total'] = elapsed
+        response.headers['Server-Timing'] = metrics.server_timing(totals)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the stage, upstream, cache and simulation metrics."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.errorhandler(service.MissingState)
+def missing_state(e):
+    return jsonify({"error": str(e)}), 404
+
 
 @app.route('/')
 def home():
     return jsonify({'message': 'Flask API is running!'})
 
-# In-memory storage for portfolio ID (not persistent)
-portfolio_data = {}
-# In-memory storage for the fake event (not persistent)
-global fake_event_string
-global JackStatsClass
-
 @app.route('/add_portfolio', methods=['POST'])
 def add_portfolio():
     data = request.get_json()
@@ -42,52 +163,29 @@ def add_portfolio():
     if not portfolio_id:
         return jsonify({"error": "Missing portfolio ID"}), 400
 
-    portfolio_data["id"] = portfolio_id  # Store in memory
+    service.set_portfolio(session_id(), portfolio_id)
 
     return jsonify({"message": "Portfolio ID stored", "id": portfolio_id}), 201
 
 @app.route('/clear_portfolio', methods=['DELETE'])
 def clear_portfolio():
     """Clears the stored portfolio ID."""
-    portfolio_data.clear()
+    service.clear_portfolio(session_id())
     return jsonify({"message": "Portfolio ID cleared"}), 200
 
 @app.route('/get_portfolio', methods=['GET'])
 def get_portfolio():
     """Retrieves the stored portfolio ID."""
-    if "id" not in portfolio_data:
-        return jsonify({"error": "No portfolio ID found"}), 404
-
-    return jsonify({"portfolio_id": portfolio_data["id"]}), 200
+    return jsonify({"portfolio_id": service.get_portfolio_id(session_id())}), 200
 
 @app.route('/post_swans', methods=['GET'])  # Change to GET
 def post_swans():
-    # Call the /get_portfolio route
-    response = requests.get("http://127.0.0.1:5000/get_portfolio")
-
-    if response.status_code != 200:
-        return jsonify({"error": "Failed to fetch portfolio"}), 500
-    
-    portfolio_data = response.json()
-
-    # Extract user_id from the response
-    user_id = portfolio_data.get('portfolio_id')
-    if not user_id:
-        return jsonify({"error": "user_id not found in portfolio data"}), 400
-
-    # Fetch industry weights using the extracted user_id
-    industry_weights = getWeights(MONGO_URI, DB_NAME, COLLECTION_NAME, user_id)
-
-    # Generate message
-    message = getMessage(industry_weights)
-
+    message = service.black_swans(session_id())
     return jsonify(message), 200  # Change status code to 200 for GET requests
 
 
 @app.route('/post_string', methods=['POST'])
 def post_string():
-    global stored_string  # Ensure we modify the global variable
-    
     data = request.get_json()  # Get the incoming JSON data
 
     # Ensure the data contains a 'string' key
@@ -95,222 +193,264 @@ def post_string():
         return jsonify({"error": "Missing 'string' in request data"}), 400
 
     user_string = data['string']
-    
-    # Store the string
-    stored_string = user_string
+    service.set_card(session_id(), user_string)
 
     return jsonify({"message": "String received", "string": user_string}), 200
 
 @app.route('/get_string', methods=['GET'])
 def get_string():
     """Retrieve the stored string."""
-    if stored_string is None:
-        return jsonify({"error": "No string found"}), 404
-
-    return jsonify({"selected-card": stored_string}), 200
+    return jsonify({"selected-card": service.get_card(session_id())}), 200
 
 
 @app.route('/get_jack', methods=['GET'])
 def get_jack():
-    response = requests.get("http://127.0.0.1:5000/get_string")
-    if response.status_code != 200:
-        return jsonify({"error": "Failed to fetch string"}), 500
+    engine = simulation_engine()
+    if engine is None:
+        return unknown_engine()
+    answer_dict, portfolio, fake_event = service.stress_test(session_id(), defer_summary=defer_summary(), engine=engine)
+    return answer_dict, 200
 
-    response_data = response.json()
-    if 'selected-card' not in response_data:
-        return jsonify({"error": "No string found in response"}), 400
 
-    string_data = response_data['selected-card']
-    start, end = get_dates(string_data)
+@app.route('/jobs/stress_test', methods=['POST'])
+def submit_stress_test():
+    """
+    Start the /get_jack pipeline in the background. The JSON body may carry the card ('string') and portfolio
+    ('id'); otherwise the ones stored through /post_string and /add_portfolio are used.
+    """
+    data = request.get_json(silent=True) or {}
+    session = session_id()
+    string_data = data.get('string') or service.get_card(session)
+    portfolio_id = data.get('id') or service.get_portfolio_id(session)
 
-    fake_event = generate_fake_event(string_data)
-    global fake_event_string
-    fake_event_string = str(fake_event)
+    defer = bool(data.get('defer_summary')) or defer_summary()
+    engine = simulation_engine(data)
+    if engine is None:
+        return unknown_engine()
 
-    try:
-        portfolio_id = portfolio_data["id"]
-    except KeyError:
-        return jsonify({"error": "No portfolio ID found"}), 404
-    
-    portfolio_dict = read_mongo_database(MONGO_URI, DB_NAME, COLLECTION_NAME, portfolio_id, start)
+    job = job_manager.submit('stress_test', service.stress_test, session, string_data, portfolio_id, defer, engine, stages=STRESS_TEST_STAGES)
+    if job is None:
+        return jsonify({"error": "Too many stress tests running, try again later"}), 503
+    return jsonify({"job_id": job.id, "status": f"/jobs/{job.id}"}), 202
+
+
+def event_stream(job, start=0, cancel_on_disconnect=False):
+    """
+    Server-sent events of job from event number start on: its stages and progress events, then 'result'
+    (the /get_jack answer) or the 'failed'/'cancelled' event that ended it.
+    cancel_on_disconnect: cancel the job when the client goes away before it is over.
+    """
+    def message(index, event, data):
+        return f"id: {index}\nevent: {event}\ndata: {json.dumps(data, default=float)}\n\n"
+
+    def generate():
+        index = start
+        try:
+            yield message(index, 'job', {"job_id": job.id, "status": f"/jobs/{job.id}"})
+            while True:
+                events = job.wait_events(index, timeout=SSE_KEEPALIVE)
+                if not events:
+                    if job.done and index >= len(job.events):
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                for event, data in events:
+                    index += 1
+                    if event == 'done':
+                        yield message(index, 'result', job_answer(job))
+                    else:
+                        yield message(index, event, data)
+        finally:
+            if cancel_on_disconnect and not job.done:
+                job.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/stress_test/stream', methods=['GET'])
+def stream_stress_test():
+    """
+    Run the /get_jack pipeline and stream its progress as server-sent events. The card and portfolio come
+    from the string and id query parameters, or the session. The run is cancelled if the client disconnects.
+    """
+    session = session_id()
+    string_data = request.args.get('string') or service.get_card(session)
+    portfolio_id = request.args.get('id') or service.get_portfolio_id(session)
+    engine = simulation_engine()
+    if engine is None:
+        return unknown_engine()
+
+    job = job_manager.submit('stress_test', service.stress_test, session, string_data, portfolio_id, defer_summary(), engine, stages=STRESS_TEST_STAGES)
+    if job is None:
+        return jsonify({"error": "Too many stress tests running, try again later"}), 503
+    return event_stream(job, cancel_on_disconnect=True)
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Follow a background job as server-sent events, resuming after Last-Event-ID when given."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if isinstance(job, SharedJob):
+        return other_worker(job)
+    return event_stream(job, start=int(request.headers.get('Last-Event-ID', 0)))
+
+
+def other_worker(job):
+    """
+    Answer for requests that need the process running job (its events, cancelling it) but reached another one.
+    """
+    return jsonify(dict(job.to_dict(), error="Job runs in another worker process; use a single worker or sticky routing to follow or cancel it")), 409
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if isinstance(job, SharedJob) and not job.done:
+        return other_worker(job)
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/stress_test/scenarios', methods=['POST'])
+def scenario_stress_test():
+    """
+    Stress test the portfolio against several events at once and compare them side by side.
+    JSON body (all optional): 'scenarios' (list of {'name', 'start', 'end'} or {'name'}; defaults to the
+    events of the last /post_swans), 'id' (portfolio), 'seed', and 'async' to run it as a background job.
+    """
+    data = request.get_json(silent=True) or {}
+    session = session_id()
+    args = (session, data.get('scenarios'), data.get('id'), data.get('seed'))
+    if data.get('async'):
+        job = job_manager.submit('scenarios', service.scenario_test, *args, stages=SCENARIO_STAGES)
+        if job is None:
+            return jsonify({"error": "Too many stress tests running, try again later"}), 503
+        return jsonify({"job_id": job.id, "status": f"/jobs/{job.id}", "result": f"/jobs/{job.id}/result"}), 202
+    return jsonify(service.scenario_test(*args)), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+def job_answer(job):
+    """
+    The JSON answer of a finished job: the /get_jack answer of a stress test, the comparison of a scenario run.
+    """
+    return job.result if job.kind == 'scenarios' else job.result[0]
+
+
+def finished_job(job_id):
+    """
+    Look up a finished job. Returns (job, None), or (None, error response) when it is unknown, pending or failed.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return None, (jsonify({"error": "Job not found"}), 404)
+    if job.state == 'failed':
+        return None, (jsonify(job.to_dict()), 500)
+    if job.state != 'done':
+        return None, (jsonify(job.to_dict()), 202)
+    if job.result is None:
+        return None, (jsonify({"error": "Job result expired"}), 404)
+    return job, None
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job, error = finished_job(job_id)
+    if error:
+        return error
+    return jsonify(job_answer(job)), 200
+
+
+@app.route('/jobs/<job_id>/images', methods=['GET'])
+def get_job_images(job_id):
+    job, error = finished_job(job_id)
+    if error:
+        return error
+    return jsonify({"images": service.result_images(job.result[1])}), 200
+
+
+@app.route('/jobs/<job_id>/data', methods=['GET'])
+def get_job_data(job_id):
+    job, error = finished_job(job_id)
+    if error:
+        return error
+    return chart_data_response(job.result[1])
+
+
+@app.route('/jobs/<job_id>/actions', methods=['GET'])
+def get_job_actions(job_id):
+    job, error = finished_job(job_id)
+    if error:
+        return error
+    return jsonify(job.result[1].recommendations), 200
+
+
+@app.route('/jobs/<job_id>/fake_event', methods=['GET'])
+def get_job_fake_event(job_id):
+    job, error = finished_job(job_id)
+    if error:
+        return error
+    return jsonify({"fake_event": job.result[2]}), 200
 
-    global JackStatsClass
-    JackStatsClass = PortfolioMonteCarlo(portfolio_dict, start, end)
-    
-    answer_dict = {}
-    answer_dict['portfolio_stats'] = JackStatsClass.monteCarlo(1000, 252)
-
-    for stock in JackStatsClass.stocks:
-        answer_dict[stock.ticker] = {
-            "beta": stock.beta, 
-            "sig_s": stock.sig_S, 
-            "sig_etf": stock.sig_ETF, 
-            "sig_idio": stock.sig_idio, 
-            "lambda_jump": stock.lambda_jump,
-            "start_value": stock.start_value,
-            "stock_stats": stock.statistics
-        }
-    actions, words = analyze_portfolio(answer_dict)
-    recommendations = {'actions': actions, 'summary': words}
-    JackStatsClass.recommendations = recommendations
-    return answer_dict, 200
-    
 @app.route('/get_fake_event', methods=['GET'])
 def get_fake_event():
     """Retrieve the generated fake event string."""
-    if fake_event_string is None:
-        return jsonify({"error": "No fake event found"}), 404
-
-    return jsonify({"fake_event": fake_event_string}), 200
+    return jsonify({"fake_event": service.get_fake_event(session_id())}), 200
 
 
 @app.route('/get_jack_images', methods=['GET'])
 def get_jack_images():
-    try:
-        portfolio_id = portfolio_data["id"]
-    except KeyError:
-        return jsonify({"error": "No portfolio ID found"}), 404
-
-    # Assuming JackStatsClass has methods to generate images
-    monte_image = JackStatsClass.generate_monte()
-    returns_annualized_image = JackStatsClass.generate_returns_annualized()
-    no_jump_image = JackStatsClass.generate_no_jump()
-
-    if not monte_image or not returns_annualized_image:
-        return jsonify({"error": "No images generated"}), 500
-    
-    # Convert images to a format suitable for JSON response
-    image_data = [
-        {
-            "name": "monte_image",
-            "data": monte_image  # Assuming monte_image is base64 encoded or similar
-        },
-        {
-            "name": "returns_annualized_image",
-            "data": returns_annualized_image  # Assuming returns_annualized_image is base64 encoded or similar
-        },
-        {
-            "name": "no_jump_image",
-            "data": no_jump_image  # Assuming no_jump_image is base64 encoded or similar
-        }
-    ]
-
+    image_data = service.result_images(service.get_run(session_id()))
     return jsonify({"images": image_data}), 200
       
-@app.route('/get_actions', methods=['GET'])
-def get_actions():
-    return jsonify(JackStatsClass.recommendations), 200
-
-
-
-def get_dates(string_data):
-    client = OpenAI(api_key=api_key)
+def chart_data_response(result):
+    """
+    The chart summary of a stress-test result as JSON with base64 float32 buffers, for charts drawn by the
+    client. Results are content-addressed, so the ETag comes from the result key; gzip when accepted.
+    """
+    etag = hashlib.sha256(f"{result.key}:{result.created}".encode('utf-8')).hexdigest()[:32]
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    body = json.dumps(pack_chart_data(result.chart_data)).encode('utf-8')
+    response = Response(body, mimetype='application/json', headers={'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'private, max-age=0, must-revalidate'})
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
-    sys_prompt = "You are an expert in historical financial analysis and risk modeling. Given the name of a past black swan event, determine the most relevant start date when its effects began to impact financial markets or economic data. The end date should always be exactly two years after the start date. **Format your response strictly as YYYY-MM-DD,YYYY-MM-DD without any explanations or additional text.**"
 
-    prompt = f"Given the past black swan event '{string_data},' provide a date range in the format YYYY-MM-DD,YYYY-MM-DD. The start date should reflect when the event first impacted financial markets, and the end date should be exactly two years later. Output only the date range with no additional text."
-    
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        response_format={'type': 'text'},
-        messages=[
-            {'role': 'system', 'content': sys_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        temperature = 0
-    )
+@app.route('/get_jack_data', methods=['GET'])
+def get_jack_data():
+    """Compact chart data of the session's last stress test (percentile bands, representative paths, return histograms)."""
+    return chart_data_response(service.get_run(session_id()))
 
-    dates = response.choices[0].message.content.split(',')
-    return dates[0], dates[1]
 
+@app.route('/llm_stats', methods=['GET'])
+def llm_stats():
+    """Hit rates of the LLM response cache per call site."""
+    return jsonify(llm.gateway.stats()), 200
 
-def generate_fake_event(string_data):
-    client = OpenAI(api_key=api_key)
+@app.route('/result_cache_stats', methods=['GET'])
+def result_cache_stats():
+    """Hits, misses and deduplicated waits of the simulation result cache."""
+    return jsonify(result_cache.stats()), 200
 
-    prompt = "Given the name of a real black swan event from the past, generate a fictional black swan event that could plausibly occur in the future. The fictional event should be inspired by the themes or consequences of the original but should be unique and not simply a repeat. Provide a 3-4 sentence description of this new event, detailing what happens, its unexpected nature, and its broad impact. Here is the past black swan event: " + string_data
-    sys_prompt = "You are an expert in risk analysis and scenario generation. Your task is to create plausible but entirely fictional future black swan events inspired by past real-world black swan events. Given the name of a real historical black swan event, generate a unique future event that shares similar unexpected consequences but occurs under different circumstances. The event should be realistic yet unpredictable, with a clear description of what happens, why it is unforeseen, and its global impact. Avoid direct repetition of historical events and focus on novel disruptions that could emerge in the future."
-    
-    response = client.chat.completions.create(
-        model="gpt-4",
-        response_format={'type': 'text'},
-        messages=[
-            {'role': 'system', 'content': sys_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        temperature = 0.6
-    )
-
-    return response.choices[0].message.content
-        
-    
+@app.route('/get_actions', methods=['GET'])
+def get_actions():
+    return jsonify(service.get_run(session_id()).recommendations), 200
 
-def getWeights(mongo_uri, db_name, collection_name, user_id_str):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db[collection_name]
-    user_id = ObjectId(user_id_str)
-    user = collection.find_one({"_id": user_id})
-
-    if user and 'holdings' in user:
-        ip_dict = defaultdict(float)
-        for holding in user['holdings']:
-            industry = holding['industry']
-            percent = holding['percentOfPortfolio']
-            ip_dict[industry] += float(percent)
-
-        return ip_dict
-    else:
-        return None
-    
-def getMessage(user_industries):
-    prompt = "Generate 3 historical categorized Black Swan events that occurred between 1975 and the present, which would have impacted the following portfolio of (industry, weight) pairs:" + str(user_industries) + """
-    ### Categorization of Events by Rarity:
-    1. **Very Uncommon**: Extremely rare (once in 25+ years), highly unpredictable, such as major financial collapses or unprecedented geopolitical conflicts.
-    2. **Uncommon**: Rare (once in 15-25 years), but with historical precedent, such as major recessions or global financial crises.
-    3. **Common**: Recurring (every 1-15 years), systemic risks with predictable cycles, such as interest rate hikes, tariffs, or regional market shocks.
-
-    ### For Each Event, Provide:
-    - **Name** (e.g., "Global Financial Crisis")
-    - **Start Date** (e.g., "2008-09-15")
-    - **Description** (A concise description with key triggers and scale of disruption)
-    - **Rarity** (very_uncommon, uncommon, common)
-
-    Format your response as a JSON object:
-    {
-        "events": [
-            {
-                "name": "Event Name",
-                "start_date": "YYYY-MM",
-                "description": "Brief explanation of what happened and market impact",
-                "rarity": "very_uncommon/uncommon/common"
-            },
-            ...
-        ]
-    }
 
-    """
-    
-    system_prompt = "You are a financial crisis expert. Ensure that the response follows the format described above, with each event clearly separated. Make sure you have **one event of each rarity** category (very uncommon, uncommon, common)."
-
-    client = OpenAI(api_key=api_key)
-
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        response_format={'type': 'json_object'},
-        messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        temperature = 0.75
-    )
-    
-    try:
-        ugly = response.choices[0].message.content
-        pretty = re.sub(r'(\w+):', r'"\1":', ugly)
-        return json.loads(pretty)
-    
-    except (json.JSONDecodeError, AttributeError):
-        raise ValueError("Invalid JSON response received from OpenAI")
 
     
 if __name__ == '__main__':
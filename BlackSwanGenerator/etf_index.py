@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from datetime import datetime, timezone
+import yfinance as yf
+from monte_carlo.price_store import yahoo
+
+ETF_INDEX_PATH = os.getenv("ETF_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "etf_index.json"))
+
+# ETF used when a ticker has no usable sector ETF
+DEFAULT_ETF = "SPY"
+
+
+class ETFIndex:
+    """
+    Persistent ticker -> sector ETF index, with the inception date of every ETF stored alongside it.
+    Saved as one JSON file; lookups never touch the network once a ticker and its ETF are known.
+    """
+
+    def __init__(self, path=ETF_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tickers = {}
+        # ETF -> inception date as YYYY-MM-DD, None when yfinance does not know it
+        self.inception_dates = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.tickers = data.get('tickers', {})
+            # Older versions also saved None for lookups that failed; look those up again
+            self.inception_dates = {etf: date for etf, date in data.get('inception_dates', {}).items() if date is not None}
+
+    def save(self):
+        # Called with self.lock held
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'tickers': self.tickers, 'inception_dates': self.inception_dates}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def missing(self, tickers):
+        with self.lock:
+            return [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.tickers]
+
+    def update(self, etfs):
+        """
+        Write ticker -> ETF answers into the index, looking up the inception date of every new ETF.
+        """
+        with self.lock:
+            self.tickers.update(etfs)
+            self.save()
+        for etf in set(etfs.values()):
+            self.inception_date(etf)
+
+    def inception_date(self, etf):
+        """
+        Inception date of etf, looked up and saved the first time it is needed. A lookup that fails is not
+        saved, so it is tried again the next time; None is only saved when yfinance knows no date for etf.
+        """
+        with self.lock:
+            if etf in self.inception_dates:
+                return self.inception_dates[etf]
+        try:
+            inception_date = fetch_inception_date(etf)
+        except Exception as e:
+            print(f"Could not look up {etf}: {e}")
+            return None
+        with self.lock:
+            self.inception_dates[etf] = inception_date
+            self.save()
+        return inception_date
+
+    def lookup(self, ticker, start):
+        """
+        Sector ETF of ticker that already existed on start (YYYY-MM-DD), DEFAULT_ETF otherwise.
+        """
+        with self.lock:
+            etf = self.tickers.get(ticker)
+        inception_date = self.inception_date(etf) if etf else None
+        if etf and inception_date and inception_date < start:
+            return etf
+        return DEFAULT_ETF
+
+
+def fetch_inception_date(etf):
+    """
+    Inception date of etf as YYYY-MM-DD, falling back to its first trading day, or None when unknown.
+    Raises when yfinance could not be reached or answered nothing.
+    """
+    info = yahoo.call(lambda: yf.Ticker(etf).info)
+    if not info:
+        raise ValueError(f"No information returned for {etf}")
+    timestamp = info.get("fundInceptionDate") or info.get("firstTradeDateEpochUtc")
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+etf_index = ETFIndex()
@@ -1,8 +1,6 @@
 from flask import Flask, request, jsonify
-from collections import defaultdict
-from pymongo import MongoClient
-from bson import ObjectId
-from openai import OpenAI
+from mongolib import getWeights
+import llm
 import json, re, os
 from dotenv import load_dotenv
 
@@ -28,24 +26,13 @@ def post_swans():
         return jsonify(message), 201
 
 
-def getWeights(mongo_uri, db_name, collection_name, user_id_str):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db[collection_name]
-    user_id = ObjectId(user_id_str)
-    user = collection.find_one({"_id": user_id})
-
-    if user and 'holdings' in user:
-        ip_dict = defaultdict(float)
-        for holding in user['holdings']:
-            industry = holding['industry']
-            percent = holding['percentOfPortfolio']
-            ip_dict[industry] += float(percent)
+def parse_events(ugly):
+    try:
+        pretty = re.sub(r'(\w+):', r'"\1":', ugly)
+        return json.loads(pretty)
+    except (json.JSONDecodeError, AttributeError):
+        raise ValueError("Invalid JSON response received from OpenAI")
 
-        return ip_dict
-    else:
-        return None
-    
 
 def getMessage(user_industries):
     prompt = "Generate 3 historical categorized Black Swan events that occurred between 1975 and the present, which would have impacted the following portfolio of (industry, weight) pairs:" + str(user_industries) + """
@@ -74,23 +61,17 @@ def getMessage(user_industries):
     """
     system_prompt = "You are a financial crisis expert. Output ONLY VALID JSON. **Ensure** you include ***ONE OF EACH*** rarity and that the events are **relevant** to the industries provided."
 
-    client = OpenAI(api_key=api_key)
-
-    response = client.chat.completions.create(
+    return llm.chat(
+        'getMessage',
         model="gpt-3.5-turbo-0125",
         response_format={'type': 'json_object'},
         messages=[
             {'role': 'system', 'content': system_prompt},
             {'role': 'user', 'content': prompt}
         ],
-        temperature = 0.3
-    )   
-    try:
-        ugly = response.choices[0].message.content
-        pretty = re.sub(r'(\w+):', r'"\1":', ugly)
-        return json.loads(pretty)
-    except (json.JSONDecodeError, AttributeError):
-        raise ValueError("Invalid JSON response received from OpenAI")
+        temperature = 0.3,
+        parse=parse_events
+    )
 
 
 weights = getWeights(MONGO_URI, DB_NAME, COLLECTION_NAME, USER_ID)
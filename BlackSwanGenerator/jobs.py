@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+class JobCancelled(CancelledError):
+    """
+    Raised inside a job's work function, at its next stage or event, once the job has been cancelled.
+    """
+
+
+class Job:
+    """
+    One background run. The work function receives the job as its job keyword argument and reports its
+    progress with job.set_stage and job.emit; both raise JobCancelled once the job is cancelled.
+    Every stage change and event is appended to self.events, which wait_events follows (e.g. for a
+    server-sent events stream).
+    """
+
+    def __init__(self, kind, stages):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.stages = list(stages)
+        self.state = 'queued'
+        self.stage = None
+        self.completed_stages = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        # (event, data) pairs in the order they happened
+        self.events = []
+        self.condition = threading.Condition()
+        # Called on every stage and state change, see JobManager.save
+        self.on_change = None
+
+    def set_stage(self, stage):
+        """
+        Mark the current stage as completed and move on to stage.
+        """
+        if self.stage is not None:
+            self.completed_stages.append(self.stage)
+        self.stage = stage
+        if self.on_change is not None:
+            self.on_change(self)
+        if stage is not None:
+            self.emit('stage', stage=stage, progress=self.to_dict()['progress'])
+
+    def emit(self, event, **data):
+        """
+        Publish an event to the job's listeners.
+        """
+        self.check_cancelled()
+        self.publish(event, data)
+
+    def publish(self, event, data):
+        with self.condition:
+            self.events.append((event, data))
+            self.condition.notify_all()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def cancel(self):
+        """
+        Ask the job to stop; it does so at its next stage or event.
+        """
+        self.cancelled = True
+
+    @property
+    def done(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def wait_events(self, start=0, timeout=None):
+        """
+        Events from index start on, waiting up to timeout seconds for one when there are none yet.
+        Returns an empty list on timeout and once the job is over and all events have been read.
+        """
+        with self.condition:
+            if len(self.events) <= start and not self.done:
+                self.condition.wait(timeout)
+            return self.events[start:]
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'stage': self.stage,
+            'completed_stages': self.completed_stages,
+            'stages': self.stages,
+            'progress': len(self.completed_stages) / len(self.stages) if self.stages else None,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class SharedJob:
+    """
+    Read-only view of a job run by another worker process, rebuilt from the snapshot it saved in the shared
+    store (see JobManager.save): its status and, once done, its result. Its events cannot be followed and it
+    cannot be cancelled from here.
+    """
+
+    def __init__(self, snapshot, result):
+        self.snapshot = snapshot
+        self.id = snapshot['job_id']
+        self.kind = snapshot['kind']
+        self.state = snapshot['state']
+        self.error = snapshot['error']
+        self.result = result
+
+    @property
+    def done(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {key: value for key, value in self.snapshot.items() if key not in ('owner', 'result')}
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool and keeps their results for retention seconds after they finish.
+    At most max_pending jobs may be queued or running at once; submit returns None beyond that.
+    Jobs run in the process that accepted them. With a shared store (a StateStore with a shared_path), every
+    job also saves a snapshot of its status and, through dump_result, a JSON form of its result, so that
+    other worker processes can answer status and result requests (get returns a SharedJob, whose result
+    load_result rebuilds). Following a job's events or cancelling it still needs the owning process: run a
+    single worker or route /jobs/<id>/events and DELETE /jobs/<id> to it (sticky sessions).
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, retention=60 * 60, store=None, dump_result=None, load_result=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.max_pending = max_pending
+        self.retention = retention
+        self.store = store
+        self.dump_result = dump_result
+        self.load_result = load_result
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, stages=()):
+        """
+        Queue fn(*args, job=job). Its return value becomes the job result.
+        """
+        self.purge()
+        job = Job(kind, stages)
+        with self.lock:
+            pending = sum(1 for j in self.jobs.values() if not j.done)
+            if pending >= self.max_pending:
+                return None
+            self.jobs[job.id] = job
+        if self.store is not None:
+            job.on_change = self.save
+            self.save(job)
+        self.executor.submit(self.run, job, fn, args)
+        return job
+
+    def save(self, job):
+        """
+        Write job's status (and its result once it is done) to the shared store.
+        """
+        snapshot = dict(job.to_dict(), owner=os.getpid())
+        if job.state == 'done' and self.dump_result is not None:
+            try:
+                snapshot['result'] = self.dump_result(job)
+            except Exception as e:
+                print(f"Could not share the result of job {job.id}: {e}")
+        self.store.set(job.id, 'job', snapshot)
+
+    def run(self, job, fn, args):
+        job.state = 'running'
+        job.started = time.time()
+        try:
+            job.check_cancelled()
+            job.result = fn(*args, job=job)
+            job.set_stage(None)
+            job.state = 'done'
+        except JobCancelled as e:
+            job.error = str(e)
+            job.state = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+        job.finished = time.time()
+        if job.on_change is not None:
+            job.on_change(job)
+        job.publish(job.state, {'error': job.error})
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job of this process. Returns the job (a SharedJob, left alone, when another
+        process runs it), or None when it is unknown.
+        """
+        job = self.get(job_id)
+        if isinstance(job, Job) and not job.done:
+            job.cancel()
+        return job
+
+    def get(self, job_id):
+        """
+        The job, a SharedJob when another worker process runs it, or None when it is unknown.
+        """
+        self.purge()
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        snapshot = self.store.get(job_id, 'job', cached=False)
+        if snapshot is None:
+            return None
+        result = None
+        if 'result' in snapshot and self.load_result is not None:
+            result = self.load_result(snapshot['kind'], snapshot['result'])
+        return SharedJob(snapshot, result)
+
+    def purge(self):
+        """
+        Drop finished jobs older than the retention period.
+        """
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if job.finished is not None and now - job.finished > self.retention]
+            for job_id in expired:
+                del self.jobs[job_id]
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple, defaultdict
+from dotenv import load_dotenv
+from openai import OpenAI
+from upstream import Upstream
+import metrics
+
+load_dotenv()
+
+api_key = os.getenv("API_KEY")
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite"))
+
+# ttl: seconds a cached response stays valid (None: forever)
+# variants: responses kept per prompt; until the pool is full every call asks the model for a new one,
+# afterwards a random variant is served
+# max_entries: cached responses kept for the call site, least recently used are evicted first
+CachePolicy = namedtuple('CachePolicy', ['ttl', 'variants', 'max_entries'])
+
+DAY = 24 * 60 * 60
+CALL_SITES = {
+    # Deterministic (temperature 0) lookups are cached indefinitely
+    'get_dates': CachePolicy(ttl=None, variants=1, max_entries=10000),
+    'getETFs': CachePolicy(ttl=None, variants=1, max_entries=50000),
+    # Creative calls
+    'generate_fake_event': CachePolicy(ttl=7 * DAY, variants=int(os.getenv("LLM_FAKE_EVENT_VARIANTS", 1)), max_entries=5000),
+    'getMessage': CachePolicy(ttl=DAY, variants=int(os.getenv("LLM_SWAN_VARIANTS", 1)), max_entries=5000),
+    'portfolio_summary': CachePolicy(ttl=DAY, variants=1, max_entries=5000),
+}
+DEFAULT_POLICY = CachePolicy(ttl=DAY, variants=1, max_entries=1000)
+
+# Concurrency bound, request timeout (seconds) and retries of the OpenAI calls
+openai_upstream = Upstream(
+    'openai',
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+    timeout=int(os.getenv("LLM_TIMEOUT", 60)),
+    retries=int(os.getenv("LLM_RETRIES", 2)),
+)
+
+
+class LLMGateway:
+    """
+    Single entry point for chat completions: one shared OpenAI client (and its connection pool), a persistent
+    SQLite cache keyed by model, prompts, temperature and response format, per-call-site cache policies and
+    hit/miss counters. Calls to the model go through upstream (concurrency bound, timeout and retries).
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, policies=CALL_SITES, upstream=openai_upstream):
+        self.path = path
+        self.policies = policies
+        self.upstream = upstream
+        self.lock = threading.Lock()
+        self.client = None
+        self.db = None
+        self.counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'errors': 0})
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                # Retries are left to the upstream, which also bounds concurrency
+                self.client = OpenAI(api_key=api_key, timeout=self.upstream.timeout, max_retries=0)
+            return self.client
+
+    def get_db(self):
+        # Called with self.lock held
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT, call_site TEXT, variant INTEGER, content TEXT, created REAL, accessed REAL, "
+                "PRIMARY KEY (key, variant))"
+            )
+            self.db.commit()
+        return self.db
+
+    @staticmethod
+    def cache_key(model, messages, temperature, response_format):
+        payload = json.dumps([model, messages, temperature, response_format], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, call_site, key, policy):
+        """
+        A cached response for key, or None when the model should be asked (nothing cached, or the variant
+        pool is not full yet).
+        """
+        now = time.time()
+        with self.lock:
+            db = self.get_db()
+            if policy.ttl is not None:
+                db.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, now - policy.ttl))
+            rows = db.execute("SELECT variant, content FROM responses WHERE key = ?", (key,)).fetchall()
+            if len(rows) < policy.variants:
+                db.commit()
+                return None
+            variant, content = random.choice(rows)
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ? AND variant = ?", (now, key, variant))
+            db.commit()
+            return content
+
+    def store(self, call_site, key, content, policy):
+        now = time.time()
+        with self.lock:
+            db = self.get_db()
+            variant = db.execute("SELECT COALESCE(MAX(variant) + 1, 0) FROM responses WHERE key = ?", (key,)).fetchone()[0]
+            db.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, call_site, variant, content, now, now))
+            db.execute(
+                "DELETE FROM responses WHERE call_site = ? AND rowid NOT IN "
+                "(SELECT rowid FROM responses WHERE call_site = ? ORDER BY accessed DESC LIMIT ?)",
+                (call_site, call_site, policy.max_entries),
+            )
+            db.commit()
+
+    def evict(self, key, content):
+        with self.lock:
+            db = self.get_db()
+            db.execute("DELETE FROM responses WHERE key = ? AND content = ?", (key, content))
+            db.commit()
+
+    def chat(self, call_site, model, messages, temperature, response_format=None, parse=None):
+        """
+        Content of a chat completion, served from the cache when the call site's policy allows it.
+        parse: optional callable turning the content into the returned value. A completion it raises on is
+        never cached (a cached one is evicted and the model asked again), so a malformed answer is not served
+        to every later request.
+        """
+        policy = self.policies.get(call_site, DEFAULT_POLICY)
+        key = self.cache_key(model, messages, temperature, response_format)
+        content = self.lookup(call_site, key, policy)
+        if content is not None:
+            try:
+                value = parse(content) if parse is not None else content
+                self.count(call_site, 'hits')
+                return value
+            except Exception as e:
+                print(f"Evicting unparsable cached {call_site} response: {e}")
+                self.evict(key, content)
+
+        self.count(call_site, 'misses')
+        kwargs = {'response_format': response_format} if response_format is not None else {}
+        try:
+            response = self.upstream.call(
+                self.get_client().chat.completions.create,
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                **kwargs
+            )
+        except Exception:
+            self.count(call_site, 'errors')
+            raise
+        content = response.choices[0].message.content
+        value = parse(content) if parse is not None else content
+        self.store(call_site, key, content, policy)
+        return value
+
+    def count(self, call_site, counter):
+        with self.lock:
+            self.counters[call_site][counter] += 1
+
+    def stats(self):
+        """
+        Hit/miss/error counters and hit rate per call site.
+        """
+        stats = {}
+        with self.lock:
+            counters = {call_site: dict(counter) for call_site, counter in self.counters.items()}
+        for call_site, counter in counters.items():
+            calls = counter['hits'] + counter['misses']
+            stats[call_site] = dict(counter, hit_rate=counter['hits'] / calls if calls else None)
+        return stats
+
+
+gateway = LLMGateway()
+
+
+def cache_samples():
+    return [('blackswan_llm_cache_requests_total', 'counter', 'LLM gateway cache lookups by call site and result', {'call_site': call_site, 'result': result}, stats[result])
+            for call_site, stats in gateway.stats().items() for result in ('hits', 'misses', 'errors')]
+
+
+metrics.register_collector(cache_samples)
+
+
+def chat(call_site, model, messages, temperature, response_format=None, parse=None):
+    return gateway.chat(call_site, model, messages, temperature, response_format, parse)
@@ -0,0 +1,184 @@
+"""
+Process-wide metrics in the Prometheus text format, without a client library: histograms of stage and
+upstream latencies, counters, gauges, and collectors that read the counters other modules already keep
+(LLM cache, result cache, upstreams) when /metrics is scraped.
+
+A request can also collect its own timings: inside start_timings()/stop_timings(), every timed() block of
+the request (including work submitted with copy_context) is added to a per-request breakdown, which the app
+returns as a Server-Timing header.
+"""
+import time
+import math
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+lock = threading.Lock()
+# name -> (type, help)
+descriptions = {}
+# name -> {labels tuple: value}
+counters = defaultdict(lambda: defaultdict(float))
+gauges = defaultdict(dict)
+# name -> {labels tuple: [bucket counts..., sum, count]}
+histograms = defaultdict(dict)
+# Functions returning [(name, type, help, labels dict, value)] at scrape time
+collectors = []
+
+# Timings of the current request: list of (name, seconds), or None outside of one
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def describe(name, kind, help_text):
+    descriptions.setdefault(name, (kind, help_text))
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, help_text='', **labels):
+    describe(name, 'counter', help_text)
+    with lock:
+        counters[name][label_key(labels)] += value
+
+
+def set_gauge(name, value, help_text='', **labels):
+    describe(name, 'gauge', help_text)
+    with lock:
+        gauges[name][label_key(labels)] = value
+
+
+def max_gauge(name, value, help_text='', **labels):
+    """
+    Raise gauge name to value if it is higher, e.g. for peak memory.
+    """
+    describe(name, 'gauge', help_text)
+    with lock:
+        key = label_key(labels)
+        gauges[name][key] = max(gauges[name].get(key, 0), value)
+
+
+def observe(name, value, help_text='', **labels):
+    describe(name, 'histogram', help_text)
+    with lock:
+        buckets = histograms[name].setdefault(label_key(labels), [0] * (len(LATENCY_BUCKETS) + 2))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+        buckets[-2] += value
+        buckets[-1] += 1
+
+
+@contextmanager
+def timed(stage, metric='blackswan_stage_seconds', help_text='Duration of pipeline stages', **labels):
+    """
+    Time the block into histogram metric (labelled with stage) and the current request's timings.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        labels = dict(labels, stage=stage) if metric == 'blackswan_stage_seconds' else labels
+        observe(metric, elapsed, help_text, **labels)
+        record_timing(stage, elapsed)
+
+
+def record_timing(name, seconds):
+    timings = request_timings.get()
+    if timings is not None:
+        with lock:
+            timings.append((name, seconds))
+
+
+def start_timings():
+    return request_timings.set([])
+
+
+def stop_timings(token):
+    """
+    End the current request's timing collection and return {name: total seconds} in first-seen order.
+    """
+    timings = request_timings.get() or []
+    request_timings.reset(token)
+    totals = {}
+    with lock:
+        for name, seconds in timings:
+            totals[name] = totals.get(name, 0) + seconds
+    return totals
+
+
+def server_timing(totals):
+    """
+    Server-Timing header value for a timings breakdown.
+    """
+    return ', '.join(f"{name.replace(' ', '_')};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def copy_context(fn):
+    """
+    Wrap fn to run in a copy of the caller's context, so that thread pool work counts towards the
+    request that submitted it.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def register_collector(collector):
+    collectors.append(collector)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+
+def format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    return repr(float(value))
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format. Samples are grouped by metric name, so a family
+    fed from several places (e.g. one upstream collector per upstream) comes out as one block.
+    """
+    # name -> (type, help, sample lines)
+    families = {}
+
+    def family(name, kind, help_text):
+        return families.setdefault(name, (kind, help_text, []))[2]
+
+    with lock:
+        for name, values in list(counters.items()) + list(gauges.items()):
+            kind, help_text = descriptions[name]
+            family(name, kind, help_text).extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in sorted(values.items()))
+        for name, values in histograms.items():
+            kind, help_text = descriptions[name]
+            samples = family(name, 'histogram', help_text)
+            for labels, buckets in sorted(values.items()):
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    samples.append(f"{name}_bucket{format_labels(labels + (('le', repr(float(bound))),))} {count}")
+                samples.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {buckets[-1]}")
+                samples.append(f"{name}_sum{format_labels(labels)} {format_value(buckets[-2])}")
+                samples.append(f"{name}_count{format_labels(labels)} {buckets[-1]}")
+
+    for collector in collectors:
+        try:
+            collected = collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, help_text, labels, value in collected:
+            family(name, kind, help_text).append(f"{name}{format_labels(label_key(labels))} {format_value(value)}")
+
+    lines = []
+    for name, (kind, help_text, samples) in sorted(families.items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples
+    return '\n'.join(lines) + '\n'
@@ -1,60 +1,174 @@
 from pymongo import MongoClient
 import os
+import time
+import threading
 from dotenv import load_dotenv
 from bson import ObjectId
-from collections import defaultdict
-from openai import OpenAI
-import yfinance as yf
-from datetime import datetime
+from collections import defaultdict, OrderedDict
+import json
+import llm
+import metrics
+from etf_index import etf_index
 
 load_dotenv()
 
 api_key = os.getenv("API_KEY")
 
+# Only the holding fields the backend reads
+HOLDINGS_PROJECTION = {'holdings.ticker': 1, 'holdings.shares': 1, 'holdings.industry': 1, 'holdings.percentOfPortfolio': 1}
+HOLDINGS_TTL = int(os.getenv("HOLDINGS_TTL", 60))
+HOLDINGS_CACHE_SIZE = int(os.getenv("HOLDINGS_CACHE_SIZE", 1024))
+
+# One pooled MongoClient per URI for the whole process
+clients = {}
+clients_lock = threading.Lock()
+# (mongo_uri, db_name, collection_name, user_id) -> (fetched at, holdings or None), least recently used first
+holdings_cache = OrderedDict()
+holdings_lock = threading.Lock()
+
+
+def get_client(mongo_uri):
+    with clients_lock:
+        if mongo_uri not in clients:
+            clients[mongo_uri] = MongoClient(mongo_uri)
+        return clients[mongo_uri]
+
+
+def warm_up(mongo_uri):
+    """
+    Open the pooled connection (including the TLS handshake) ahead of the first request.
+    """
+    try:
+        get_client(mongo_uri).admin.command('ping')
+    except Exception as e:
+        print(f"MongoDB warm-up failed: {e}")
+
+
+def get_holdings_bulk(mongo_uri, db_name, collection_name, user_id_strs):
+    """
+    Holdings of many users with a single projected query, served from the short-lived holdings cache when
+    possible (at most HOLDINGS_CACHE_SIZE users, expired entries are dropped when looked up). Returns
+    {user_id_str: holdings list or None}.
+    """
+    now = time.time()
+    result, missing = {}, []
+    with holdings_lock:
+        for user_id_str in dict.fromkeys(user_id_strs):
+            key = (mongo_uri, db_name, collection_name, user_id_str)
+            cached = holdings_cache.get(key)
+            if cached is not None and now - cached[0] < HOLDINGS_TTL:
+                holdings_cache.move_to_end(key)
+                result[user_id_str] = cached[1]
+            else:
+                if cached is not None:
+                    del holdings_cache[key]
+                missing.append(user_id_str)
+    metrics.inc('blackswan_holdings_cache_requests_total', len(result), 'Holdings lookups by cache result', result='hits')
+    metrics.inc('blackswan_holdings_cache_requests_total', len(missing), 'Holdings lookups by cache result', result='misses')
+    if missing:
+        with metrics.timed('mongo', metric='blackswan_upstream_seconds', upstream='mongo'):
+            collection = get_client(mongo_uri)[db_name][collection_name]
+            users = collection.find({"_id": {"$in": [ObjectId(user_id_str) for user_id_str in missing]}}, HOLDINGS_PROJECTION)
+            found = {str(user['_id']): user.get('holdings') for user in users}
+        with holdings_lock:
+            for user_id_str in missing:
+                result[user_id_str] = found.get(user_id_str)
+                holdings_cache[(mongo_uri, db_name, collection_name, user_id_str)] = (now, result[user_id_str])
+                holdings_cache.move_to_end((mongo_uri, db_name, collection_name, user_id_str))
+            while len(holdings_cache) > HOLDINGS_CACHE_SIZE:
+                holdings_cache.popitem(last=False)
+    return result
+
+
+def get_holdings(mongo_uri, db_name, collection_name, user_id_str):
+    return get_holdings_bulk(mongo_uri, db_name, collection_name, [user_id_str])[user_id_str]
+
+
+def getWeights(mongo_uri, db_name, collection_name, user_id_str):
+    holdings = get_holdings(mongo_uri, db_name, collection_name, user_id_str)
+
+    if holdings:
+        ip_dict = defaultdict(float)
+        for holding in holdings:
+            industry = holding['industry']
+            percent = holding['percentOfPortfolio']
+            ip_dict[industry] += float(percent)
+
+        return ip_dict
+    else:
+        return None
+
+
 ## I need to write a function that reads in  the mongodb database and returns a dictionary including the following keys: 'stocks' and 'shares'
 def read_mongo_database(mongo_uri, db_name, collection_name, user_id_str, start):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db[collection_name]
-    user_id = ObjectId(user_id_str)
-    user = collection.find_one({"_id": user_id})
+    holdings = get_holdings(mongo_uri, db_name, collection_name, user_id_str)
     
-    if user and 'holdings' in user:
+    if holdings:
+        etfs = getETFs([holding['ticker'] for holding in holdings], start)
         ip_dict = defaultdict(float)
-        for holding in user['holdings']:
+        for holding in holdings:
             ticker = holding['ticker']
             shares = holding['shares']
-            etf = getETF(ticker, start)
-            ip_dict[ticker] = (etf, shares)
+            ip_dict[ticker] = (etfs[ticker], shares)
         return ip_dict
     else:
         return None
 
 
+def prefetch_portfolio(mongo_uri, db_name, collection_name, user_id_str):
+    """
+    Load a portfolio's holdings and resolve the ETFs of tickers the index does not know yet. Neither needs the
+    event dates, so this can run alongside get_dates; read_mongo_database then finds everything cached.
+    """
+    holdings = get_holdings(mongo_uri, db_name, collection_name, user_id_str)
+    if holdings:
+        missing = etf_index.missing([holding['ticker'] for holding in holdings])
+        if missing:
+            etf_index.update(resolveETFs(missing))
+
+
 def getETF(ticker, start):
-    client = OpenAI(api_key=api_key)
+    return getETFs([ticker], start)[ticker]
+
+
+def getETFs(tickers, start):
+    """
+    Map every ticker to its most related ETF (SPY when the ETF did not exist yet on start).
+    Answers come from the local ETF index; tickers it does not know are resolved with one batched prompt
+    and written back into it.
+    """
+    missing = etf_index.missing(tickers)
+    if missing:
+        etf_index.update(resolveETFs(missing))
+    return {ticker: etf_index.lookup(ticker, start) for ticker in tickers}
 
-    prompt = f"Given the stock ticker {ticker}, return only the most related **ETF's** ticker. Do not include any explanations or additional text—**only output the ETF ticker**."
 
-    sys_prompt = "You are a financial data expert specializing in ETFs and stock relationships. Your task is to identify the most related ETF to a given stock ticker based on sector, correlation, or holdings overlap. You must strictly return only the ETF's ticker symbol without any explanations, descriptions, or extra text."
+def parse_etf_answer(content):
+    try:
+        answer = json.loads(content)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON response received from OpenAI")
+    if not isinstance(answer, dict):
+        raise ValueError("Invalid JSON response received from OpenAI")
+    return answer
 
-    response = client.chat.completions.create(
+
+def resolveETFs(tickers):
+    prompt = f"For each of the stock tickers {', '.join(tickers)}, return only the most related **ETF's** ticker. Respond with a JSON object mapping each stock ticker to its ETF ticker, for example {{\"AAPL\": \"XLK\"}}. Do not include any explanations or additional text."
+
+    sys_prompt = "You are a financial data expert specializing in ETFs and stock relationships. Your task is to identify the most related ETF to each given stock ticker based on sector, correlation, or holdings overlap. You must strictly return only a JSON object of stock ticker to ETF ticker symbol without any explanations, descriptions, or extra text."
+
+    answer = llm.chat(
+        'getETFs',
         model="gpt-4-turbo",
+        response_format={'type': 'json_object'},
         messages=[
             {"role": "system", "content": sys_prompt},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.0
+        temperature=0.0,
+        parse=parse_etf_answer
     )
-    suggested_etf = response.choices[0].message.content
-
-    etf_data = yf.Ticker(suggested_etf)
-    inception_date = etf_data.info.get("fundInceptionDate")
-    inception_date = str(datetime.utcfromtimestamp(inception_date))
-    
-    if inception_date and inception_date < start:
-        return suggested_etf
-    else:
-        return "SPY"
-
 
+    # Tickers the model skipped stay out of the index so that they are asked for again next time
+    return {ticker: str(answer[ticker]).strip().upper() for ticker in tickers if answer.get(ticker)}
@@ -0,0 +1,181 @@
+"""
+Offline benchmarks of the Monte Carlo and calibration hot paths. Prices come from synthetic histories written
+into a temporary price store, so no yfinance or OpenAI access is needed. Run from BlackSwanGenerator:
+
+    python -m monte_carlo.benchmark [--quick] [--output bench.json]
+
+Every benchmark reports wall time (best and mean over the repeats), paths per second where it applies,
+and peak traced memory, as JSON.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from .price_store import price_store
+from .stats import StockStats, CALIBRATION_START, CALIBRATION_END
+from .monte_carlo_portfolio import PortfolioMonteCarlo
+from .charts import render_cache
+
+EVENT_START = "2008-01-01"
+EVENT_END = "2010-01-01"
+HISTORY_START = "2005-01-01"
+HISTORY_END = "2024-06-01"
+NUM_ETFS = 5
+
+
+def stock_ticker(i):
+    return f"SYN{i:03d}"
+
+
+def etf_ticker(i):
+    return f"SYNETF{i}"
+
+
+def seed_price_store(num_stocks, directory, seed=0):
+    """
+    Point the shared price store at directory and fill it with synthetic daily closes: ETFs follow a GBM with
+    occasional crash days, stocks load on their ETF with a random beta plus idiosyncratic noise.
+    """
+    rng = np.random.default_rng(seed)
+    price_store.directory = directory
+    price_store.memory.clear()
+    price_store.quotes.clear()
+    dates = pd.bdate_range(HISTORY_START, HISTORY_END, inclusive='left')
+    etf_returns = []
+    for i in range(NUM_ETFS):
+        returns = rng.normal(0.0003, 0.012, len(dates))
+        crashes = rng.random(len(dates)) < 0.01
+        returns[crashes] += rng.normal(-0.04, 0.02, crashes.sum())
+        etf_returns.append(returns)
+        store_series(etf_ticker(i), dates, returns)
+    for i in range(num_stocks):
+        beta = rng.uniform(0.5, 1.8)
+        returns = beta * etf_returns[i % NUM_ETFS] + rng.normal(0, 0.015, len(dates))
+        store_series(stock_ticker(i), dates, returns)
+
+
+def store_series(ticker, dates, log_returns):
+    close = pd.Series(100 * np.exp(np.cumsum(log_returns)), index=dates, name='Close')
+    price_store.store(ticker, close, HISTORY_START, HISTORY_END)
+    price_store.store_last_close(ticker, close.iloc[-1])
+
+
+def stock_dict(num_stocks):
+    return {stock_ticker(i): (etf_ticker(i % NUM_ETFS), 10) for i in range(num_stocks)}
+
+
+def measure(name, fn, repeats=3, paths=None, **params):
+    """
+    Time fn() repeats times and trace its peak memory on one extra run.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        'name': name,
+        'params': params,
+        'repeats': repeats,
+        'wall_time_best': min(times),
+        'wall_time_mean': sum(times) / len(times),
+        'peak_memory_bytes': peak_memory,
+    }
+    if paths is not None:
+        result['paths_per_second'] = paths / min(times)
+    return result
+
+
+def run(quick=False, seed=0):
+    repeats = 1 if quick else 3
+    holdings = [1, 10] if quick else [1, 10, 50, 200]
+    stock_sizes = [(1000, 252)] if quick else [(1000, 252), (10000, 252), (1000, 1260)]
+    num_simulations, num_days = (200, 252) if quick else (1000, 252)
+    np.random.seed(seed)
+
+    results = []
+    # The benchmarks read the shared price store, so point it at the synthetic prices only for the run
+    saved_store = (price_store.directory, price_store.memory.copy(), price_store.quotes.copy(), price_store.failed_fetches.copy())
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            seed_price_store(max(holdings), directory, seed)
+
+            stock = StockStats(stock_ticker(0), etf_ticker(0), EVENT_START, EVENT_END, 10)
+            results.append(measure('calculate_statistics', stock.calculate_statistics, repeats,
+                                   window=[CALIBRATION_START, CALIBRATION_END]))
+            results.append(measure('estimate_jump_params', stock.estimate_jump_params, repeats,
+                                   window=[EVENT_START, EVENT_END]))
+            for holding_count in holdings:
+                results.append(measure('portfolio_calibration', lambda: PortfolioMonteCarlo(stock_dict(holding_count), EVENT_START, EVENT_END),
+                                       repeats, holdings=holding_count))
+
+            for sims, days in stock_sizes:
+                results.append(measure('stock_monteCarlo', lambda: stock.monteCarlo(sims, days), repeats, paths=sims,
+                                       num_simulations=sims, num_days=days))
+
+            portfolios = {}
+            for holding_count in holdings:
+                portfolio = portfolios[holding_count] = PortfolioMonteCarlo(stock_dict(holding_count), EVENT_START, EVENT_END)
+                results.append(measure('portfolio_simulate', lambda: portfolio.simulate(num_simulations, num_days), repeats,
+                                       paths=num_simulations, holdings=holding_count, num_simulations=num_simulations, num_days=num_days))
+
+            largest = max(holdings)
+            portfolio = portfolios[largest]
+            simulations = portfolio.simulate(num_simulations, num_days, with_no_jump=True)
+            results.append(measure('portfolio_getStatistics', lambda: portfolio.getStatistics(simulations), repeats,
+                                   paths=num_simulations, holdings=largest, num_simulations=num_simulations, num_days=num_days))
+            results.append(measure('stock_getStatistics', stock.getStatistics, repeats, paths=len(stock.simulations),
+                                   num_simulations=len(stock.simulations)))
+
+            for generator in (portfolio.generate_monte, portfolio.generate_returns_annualized, portfolio.generate_no_jump):
+                def render():
+                    # Measure the rendering itself, not the render cache
+                    render_cache.clear()
+                    generator()
+                results.append(measure(generator.__name__, render, repeats, num_simulations=num_simulations, num_days=num_days))
+    finally:
+        price_store.directory, memory, quotes, failed_fetches = saved_store
+        with price_store.lock:
+            price_store.memory.clear()
+            price_store.memory.update(memory)
+            price_store.quotes.clear()
+            price_store.quotes.update(quotes)
+            price_store.failed_fetches.clear()
+            price_store.failed_fetches.update(failed_fetches)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'quick': quick,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='small sizes and a single repeat, for a smoke run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args.quick, args.seed), indent=2, default=float)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from .price_store import price_store
+from .risk_metrics import path_risk_metrics
+
+# Resampling schemes of bootstrap_indices
+BOOTSTRAP_METHODS = ('stationary', 'moving')
+# Mean (stationary) or fixed (moving) block length in trading days
+DEFAULT_BLOCK_SIZE = 10
+
+
+def log_returns(ticker, start, end):
+    close = price_store.get_history(ticker, start, end)['Close']
+    return np.log(close / close.shift(1)).dropna()
+
+
+def window_returns(stock_dict, start, end):
+    """
+    Aligned daily log-returns of every holding between start and end, as a (days x stocks) DataFrame in
+    stock_dict order, on the trading days shared by their ETFs. A holding that did not trade on some of those
+    days (e.g. it was listed after the event) takes its ETF's return on them, so that every row is a complete
+    joint move of the portfolio. Also returns the (days x ETFs) returns of the ETFs.
+    """
+    etfs = list(dict.fromkeys(etf for etf, _ in stock_dict.values()))
+    etf_returns = pd.concat({etf: log_returns(etf, start, end) for etf in etfs}, axis=1).dropna()
+    if len(etf_returns) < 2:
+        raise ValueError(f"Not enough price history between {start} and {end} to bootstrap")
+
+    columns = {}
+    for ticker, (etf, _) in stock_dict.items():
+        try:
+            returns = log_returns(ticker, start, end).reindex(etf_returns.index)
+        except Exception as e:
+            print(f"No history for {ticker} between {start} and {end}, using {etf}: {e}")
+            returns = pd.Series(np.nan, index=etf_returns.index)
+        columns[ticker] = returns.fillna(etf_returns[etf])
+    return pd.DataFrame(columns, index=etf_returns.index), etf_returns
+
+
+def bootstrap_indices(num_returns, num_simulations, num_steps, block_size=DEFAULT_BLOCK_SIZE, method='stationary', rng=None):
+    """
+    (num_simulations, num_steps) row indices into a matrix of num_returns daily returns, drawn in blocks of
+    consecutive days so that volatility clustering and cross-asset co-movement within a block are kept.
+    stationary: blocks start at uniform random days and have geometric lengths of mean block_size
+    (Politis-Romano); moving: blocks of exactly block_size days. Blocks wrap around the end of the window.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if method == 'moving':
+        num_blocks = -(-num_steps // block_size)
+        # Circular blocks: every day is equally likely, including the last block_size days of the window
+        starts = rng.integers(0, num_returns, size=(num_simulations, num_blocks, 1))
+        indices = (starts + np.arange(block_size)).reshape(num_simulations, -1)[:, :num_steps]
+        return indices % num_returns
+    if method != 'stationary':
+        raise ValueError(f"Unknown bootstrap method {method}, expected one of {BOOTSTRAP_METHODS}")
+
+    steps = np.arange(num_steps)
+    new_block = rng.random((num_simulations, num_steps)) < 1 / block_size
+    new_block[:, 0] = True
+    starts = rng.integers(0, num_returns, size=(num_simulations, num_steps))
+    # Step at which the block containing each step began
+    block_start = np.maximum.accumulate(np.where(new_block, steps, 0), axis=1)
+    return (np.take_along_axis(starts, block_start, axis=1) + steps - block_start) % num_returns
+
+
+def bootstrap_paths(returns, start_values, num_simulations, num_days, block_size=DEFAULT_BLOCK_SIZE, method='stationary', rng=None, path_metrics=False):
+    """
+    Portfolio paths resampled from a (days x stocks) matrix of joint log-returns: every path draws one
+    sequence of days (see bootstrap_indices) shared by all holdings, and each holding's path is its start
+    value times the exponential of the cumulative sum of its gathered returns.
+    Returns the (num_simulations, num_days) portfolio paths and the (stocks, num_simulations) final values,
+    plus the path_risk_metrics of every holding's paths with path_metrics.
+    """
+    returns = np.asarray(returns, dtype=float)
+    indices = bootstrap_indices(len(returns), num_simulations, num_days - 1, block_size, method, rng)
+    portfolio_paths = np.zeros((num_simulations, num_days))
+    final_values = np.empty((returns.shape[1], num_simulations))
+    log_path = np.zeros((num_simulations, num_days))
+    stock_path_metrics = []
+    for i, start_value in enumerate(start_values):
+        np.cumsum(returns[indices, i], axis=1, out=log_path[:, 1:])
+        stock_paths = start_value * np.exp(log_path)
+        portfolio_paths += stock_paths
+        final_values[i] = stock_paths[:, -1]
+        if path_metrics:
+            stock_path_metrics.append(path_risk_metrics(stock_paths))
+    if path_metrics:
+        return portfolio_paths, final_values, stock_path_metrics
+    return portfolio_paths, final_values
+
+
+def window_factors(stock_returns, etf_returns):
+    """
+    The factor model parameters of a holding measured on a window of returns, in closed form: annualized
+    ETF drift and volatility, total volatility, beta (the least-squares slope on the ETF) and idiosyncratic
+    volatility.
+    """
+    stock_returns = np.asarray(stock_returns, dtype=float)
+    etf_returns = np.asarray(etf_returns, dtype=float)
+    sig_S = np.std(stock_returns) * (252 ** 0.5)
+    sig_ETF = np.std(etf_returns) * (252 ** 0.5)
+    etf_variance = np.var(etf_returns)
+    beta = np.mean((stock_returns - stock_returns.mean()) * (etf_returns - etf_returns.mean())) / etf_variance if etf_variance > 0 else 0.0
+    return {
+        'mu_ETF': np.mean(etf_returns) * 252,
+        'sig_ETF': sig_ETF,
+        'sig_S': sig_S,
+        'beta': beta,
+        'sig_idio': np.sqrt(max(sig_S ** 2 - beta ** 2 * sig_ETF ** 2, 0)),
+    }
@@ -0,0 +1,156 @@
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .price_store import price_store
+
+# Window used to fit beta and the volatilities of every stock
+CALIBRATION_START = "2018-01-01"
+CALIBRATION_END = "2024-01-01"
+
+
+def log_return_matrix(tickers, start, end, max_workers=8):
+    """
+    Daily log-returns of tickers between start and end, aligned on their dates as one (dates x tickers)
+    DataFrame (NaN where a ticker has no price), with the number of prices of each ticker and
+    {ticker: error message} for the tickers whose history could not be loaded. Histories are read from the
+    price store max_workers at a time.
+    """
+    tickers = list(dict.fromkeys(tickers))
+
+    def load(ticker):
+        close = price_store.get_closes(ticker, start, end)
+        values = close.to_numpy(dtype=float)
+        return close.index[1:].values.astype('datetime64[ns]'), np.log(values[1:] / values[:-1]), len(values)
+
+    loaded, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tickers)))) as executor:
+        futures = {ticker: executor.submit(load, ticker) for ticker in tickers}
+    for ticker, future in futures.items():
+        try:
+            loaded[ticker] = future.result()
+        except Exception as e:
+            failed[ticker] = str(e)
+    dates = np.unique(np.concatenate([ticker_dates for ticker_dates, _, _ in loaded.values()])) if loaded else np.array([], dtype='datetime64[ns]')
+    matrix = np.full((len(dates), len(loaded)), np.nan)
+    for column, (ticker_dates, values, _) in enumerate(loaded.values()):
+        matrix[np.searchsorted(dates, ticker_dates), column] = values
+    returns = pd.DataFrame(matrix, index=pd.DatetimeIndex(dates), columns=list(loaded))
+    price_counts = pd.Series({ticker: count for ticker, (_, _, count) in loaded.items()}, dtype=int)
+    return returns, price_counts, failed
+
+
+def factor_params(stock_returns, etf_returns, etf_of):
+    """
+    Factor model parameters of every stock of etf_of ({stock: ETF}) in one vectorized pass, from
+    (dates x tickers) log-returns that hold the stocks (stock_returns) and their ETFs (etf_returns):
+    mu_ETF and sig_ETF (annualized mean and volatility of the ETF, computed once per ETF), sig_S (annualized
+    volatility of the stock), beta (least-squares slope of the stock on its ETF over the dates where both have
+    a return) and sig_idio. Returns a DataFrame indexed by stock; parameters without enough data are NaN.
+    """
+    stocks = list(etf_of)
+    etfs = list(dict.fromkeys(etf_of.values()))
+    S = stock_returns[stocks].to_numpy(dtype=float)
+    E = etf_returns[[etf_of[stock] for stock in stocks]].to_numpy(dtype=float)
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        # Columns without data give NaN parameters, flagged by the caller
+        warnings.simplefilter('ignore', RuntimeWarning)
+        etf_values = etf_returns[etfs].to_numpy(dtype=float)
+        mu_ETF = pd.Series(np.nanmean(etf_values, axis=0) * 252, index=etfs)
+        sig_ETF = pd.Series(np.nanstd(etf_values, axis=0) * np.sqrt(252), index=etfs)
+        sig_S = np.nanstd(S, axis=0) * np.sqrt(252)
+
+        both = ~np.isnan(S) & ~np.isnan(E)
+        count = both.sum(axis=0)
+        stock_deviations = np.where(both, S - np.where(both, S, 0).sum(axis=0) / count, 0)
+        etf_deviations = np.where(both, E - np.where(both, E, 0).sum(axis=0) / count, 0)
+        beta = (stock_deviations * etf_deviations).sum(axis=0) / (etf_deviations ** 2).sum(axis=0)
+
+        stock_sig_ETF = sig_ETF[[etf_of[stock] for stock in stocks]].to_numpy()
+        sig_idio = np.sqrt(sig_S ** 2 - beta ** 2 * stock_sig_ETF ** 2)
+    return pd.DataFrame({
+        'beta': beta,
+        'mu_ETF': mu_ETF[[etf_of[stock] for stock in stocks]].to_numpy(),
+        'sig_ETF': stock_sig_ETF,
+        'sig_S': sig_S,
+        'sig_idio': sig_idio,
+    }, index=stocks)
+
+
+def jump_params(etf_returns, price_counts):
+    """
+    Jump intensity (per year), mean and standard deviation of the jumps of every column of (dates x ETFs)
+    log-returns at once: the returns more than two standard deviations below the mean count as jumps.
+    price_counts: number of prices of each ETF over the window. Returns a DataFrame indexed by ETF.
+    """
+    jump_thresholds = 2  # 1% quantile for a normal distribution
+    values = etf_returns.to_numpy(dtype=float)
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        jump_cutoff = np.nanmean(values, axis=0) - jump_thresholds * np.nanstd(values, axis=0, ddof=1)
+        jump_values = np.where(values < jump_cutoff, values, np.nan)
+        count = (~np.isnan(jump_values)).sum(axis=0)
+        period_years = price_counts[etf_returns.columns].to_numpy() / 200
+        return pd.DataFrame({
+            'lambda_jump': count / period_years,
+            'mu_J': np.nanmean(jump_values, axis=0),
+            'sigma_J': np.nanstd(jump_values, axis=0, ddof=1),
+        }, index=etf_returns.columns)
+
+
+def rolling_betas(stock_returns, etf_returns, etf_of, window):
+    """
+    Betas of every stock of etf_of on its ETF over a rolling window of days, as a (dates x stocks) DataFrame.
+    """
+    stocks = list(etf_of)
+    etf_columns = etf_returns[[etf_of[stock] for stock in stocks]].set_axis(stocks, axis=1)
+    rolling_etf = etf_columns.rolling(window)
+    return stock_returns[stocks].rolling(window).cov(etf_columns) / rolling_etf.var()
+
+
+def calibrate_portfolio(stock_dict, history_start_date, history_end_date, rolling_window=None, max_workers=8):
+    """
+    Calibrate every holding of stock_dict ({ticker: (ETF_ticker, shares)}) at once: the log-returns of all
+    holdings and ETFs over the calibration window are aligned into one matrix and every parameter comes from
+    vectorized moment formulas (see factor_params), and the jump parameters of every distinct ETF from the
+    event window between history_start_date and history_end_date (see jump_params).
+    Returns {ticker: parameters} (the StockStats PARAM_NAMES), {ticker: error message} for the holdings that
+    could not be calibrated and, when rolling_window is given, the rolling betas (see rolling_betas).
+    """
+    etf_of = {ticker: etf_ticker for ticker, (etf_ticker, _) in stock_dict.items()}
+    etfs = list(dict.fromkeys(etf_of.values()))
+    returns, _, failed = log_return_matrix(list(etf_of) + etfs, CALIBRATION_START, CALIBRATION_END, max_workers)
+    event_returns, price_counts, event_failed = log_return_matrix(etfs, history_start_date, history_end_date, max_workers)
+    for etf_ticker, count in price_counts.items():
+        if count < 2:
+            event_failed[etf_ticker] = f"No price history for {etf_ticker} between {history_start_date} and {history_end_date}"
+
+    errors = {}
+    for ticker, etf_ticker in etf_of.items():
+        if ticker in failed:
+            errors[ticker] = failed[ticker]
+        elif etf_ticker in failed or etf_ticker in event_failed:
+            errors[ticker] = f"{etf_ticker}: {failed.get(etf_ticker) or event_failed[etf_ticker]}"
+    usable = {ticker: etf_ticker for ticker, etf_ticker in etf_of.items() if ticker not in errors}
+    if not usable:
+        return {}, errors, None
+
+    factors = factor_params(returns, returns, usable)
+    usable_etfs = list(dict.fromkeys(usable.values()))
+    jumps = jump_params(event_returns[usable_etfs], price_counts)
+    factors = factors.to_dict('index')
+    jumps = jumps.to_dict('index')
+    params = {}
+    for ticker, etf_ticker in usable.items():
+        row = factors[ticker]
+        if not np.isfinite(row['beta']):
+            errors[ticker] = f"Not enough price history between {CALIBRATION_START} and {CALIBRATION_END}"
+            continue
+        try:
+            start_value = price_store.get_last_close(ticker) * stock_dict[ticker][1]
+        except Exception as e:
+            errors[ticker] = str(e)
+            continue
+        params[ticker] = dict(row, **jumps[etf_ticker], start_value=start_value)
+    betas = rolling_betas(returns, returns, {ticker: usable[ticker] for ticker in params}, rolling_window) if rolling_window and params else None
+    return params, errors, betas
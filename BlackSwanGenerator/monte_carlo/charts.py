@@ -0,0 +1,170 @@
+import base64
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import metrics
+
+# Percentile bands of the fan charts, outermost first, with the median drawn as a line
+BAND_PERCENTILES = (5, 25, 75, 95)
+SAMPLE_PATHS = 20
+HISTOGRAM_BINS = 50
+
+# Final-value quantiles of the representative paths kept by chart_data
+PATH_QUANTILES = (1, 5, 10, 25, 40, 50, 60, 75, 90, 95, 99)
+# Most points per representative path in chart_data
+MAX_PATH_POINTS = 128
+
+# (run_id, chart name) -> {'image': base64 PNG}, most recently used last
+render_cache = OrderedDict()
+render_cache_lock = threading.Lock()
+RENDER_CACHE_SIZE = 64
+
+
+def percentile_bands(simulations, percentiles=BAND_PERCENTILES + (50,)):
+    """
+    Per-day percentiles of a (num_simulations, num_days) matrix in one vectorized pass.
+    Returns a dict of percentile -> array of num_days values.
+    """
+    values = np.percentile(simulations, percentiles, axis=0)
+    return dict(zip(percentiles, values))
+
+
+def figure_to_json(fig):
+    """
+    Render a Figure to PNG and wrap it as {'image': base64}, the format the image endpoints return.
+    """
+    buf = BytesIO()
+    FigureCanvasAgg(fig).print_png(buf)
+    img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+    buf.close()
+    return {'image': img_base64}
+
+
+def render_fan_chart(simulations, title):
+    """
+    Fan chart of simulated paths: shaded 5-95 and 25-75 percentile bands, the median, and a few sample paths.
+    Uses its own Figure rather than the global pyplot state, so it is safe to call from several threads.
+    """
+    days = np.arange(simulations.shape[1])
+    return render_bands(days, percentile_bands(simulations), days, simulations[:SAMPLE_PATHS], title)
+
+
+def render_bands(days, bands, path_days, paths, title):
+    """
+    Fan chart from precomputed percentile bands (percentile -> values on days) and sample paths (on path_days).
+    """
+    fig = Figure(figsize=(14, 7))
+    ax = fig.add_subplot()
+    ax.plot(path_days, np.asarray(paths).T, color='blue', alpha=0.08, linewidth=0.8)
+    ax.fill_between(days, bands[5], bands[95], color='blue', alpha=0.15, label='5th-95th percentile')
+    ax.fill_between(days, bands[25], bands[75], color='blue', alpha=0.3, label='25th-75th percentile')
+    ax.plot(days, bands[50], color='navy', linewidth=2, label='Median')
+    ax.set_title(title)
+    ax.set_xlabel('Trading Days')
+    ax.legend(loc='upper left')
+    return figure_to_json(fig)
+
+
+def render_histogram(values, title, xlabel, ylabel='Frequency'):
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return render_histogram_counts(edges, counts, title, xlabel, ylabel)
+
+
+def render_histogram_counts(edges, counts, title, xlabel, ylabel='Frequency'):
+    fig = Figure(figsize=(14, 7))
+    ax = fig.add_subplot()
+    ax.stairs(counts, edges, fill=True, color='blue', alpha=0.7)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return figure_to_json(fig)
+
+
+def chart_data(simulations, no_jump_simulations, initial_value, years=1):
+    """
+    Everything the charts need, in a few small float32 arrays instead of the full path matrices:
+    per-day percentile bands, representative paths (the paths ending at PATH_QUANTILES of the final values,
+    sampled on at most MAX_PATH_POINTS days) and annualized return histograms on shared bin edges.
+    The no-jump entries are None when no_jump_simulations is None.
+    """
+    num_days = simulations.shape[1]
+    percentiles = BAND_PERCENTILES + (50,)
+    path_days = np.unique(np.linspace(0, num_days - 1, min(num_days, MAX_PATH_POINTS)).round().astype(int))
+
+    def representative_paths(paths):
+        order = np.argsort(paths[:, -1])
+        rows = order[np.round(np.array(PATH_QUANTILES) / 100 * (len(order) - 1)).astype(int)]
+        return paths[rows][:, path_days]
+
+    def annualized_returns(paths):
+        return (paths[:, -1] / initial_value) ** (1 / years) - 1
+
+    returns = annualized_returns(simulations)
+    no_jump_returns = annualized_returns(no_jump_simulations) if no_jump_simulations is not None else None
+    edges = np.histogram_bin_edges(returns if no_jump_returns is None else np.concatenate([returns, no_jump_returns]), bins=HISTOGRAM_BINS)
+
+    def float32(values):
+        return None if values is None else np.asarray(values, dtype=np.float32)
+
+    return {
+        'num_simulations': simulations.shape[0],
+        'num_days': num_days,
+        'initial_value': float(initial_value),
+        'percentiles': list(percentiles),
+        'bands': float32(np.percentile(simulations, percentiles, axis=0)),
+        'no_jump_bands': float32(np.percentile(no_jump_simulations, percentiles, axis=0)) if no_jump_simulations is not None else None,
+        'path_quantiles': list(PATH_QUANTILES),
+        'path_days': float32(path_days),
+        'paths': float32(representative_paths(simulations)),
+        'no_jump_paths': float32(representative_paths(no_jump_simulations)) if no_jump_simulations is not None else None,
+        'return_edges': float32(edges),
+        'return_counts': float32(np.histogram(returns, bins=edges)[0]),
+        'no_jump_return_counts': float32(np.histogram(no_jump_returns, bins=edges)[0]) if no_jump_returns is not None else None,
+    }
+
+
+def pack_chart_data(data):
+    """
+    JSON-ready chart_data: every array becomes {'shape': [...], 'data': base64 of its little-endian float32 buffer}.
+    """
+    def pack(value):
+        if isinstance(value, np.ndarray):
+            return {'shape': list(value.shape), 'data': base64.b64encode(value.astype('<f4').tobytes()).decode('ascii')}
+        return value
+
+    return dict({key: pack(value) for key, value in data.items()}, dtype='float32', encoding='base64')
+
+
+def render_chart_data(data, name):
+    """
+    Render chart name ('monte', 'returns_annualized' or 'no_jump') of a chart_data summary.
+    """
+    days = np.arange(data['num_days'])
+    if name == 'returns_annualized':
+        return render_histogram_counts(data['return_edges'], data['return_counts'], 'Distribution of Annualized Returns', 'Annualized Return')
+    if name == 'no_jump':
+        bands, paths, title = data['no_jump_bands'], data['no_jump_paths'], 'Monte Carlo Simulations of Portfolio Value (No Black Swan Events)'
+    else:
+        bands, paths, title = data['bands'], data['paths'], 'Monte Carlo Simulations of Portfolio Value'
+    return render_bands(days, dict(zip(data['percentiles'], bands)), data['path_days'], paths, title)
+
+
+def cached_render(run_id, name, render):
+    """
+    Return the chart name of simulation run run_id, calling render() only the first time it is requested.
+    """
+    key = (run_id, name)
+    with render_cache_lock:
+        if key in render_cache:
+            render_cache.move_to_end(key)
+            return render_cache[key]
+    with metrics.timed('render'):
+        image = render()
+    with render_cache_lock:
+        render_cache[key] = image
+        while len(render_cache) > RENDER_CACHE_SIZE:
+            render_cache.popitem(last=False)
+    return image
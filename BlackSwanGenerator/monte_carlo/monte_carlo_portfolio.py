@@ -2,163 +2,681 @@ import numpy as np
 import pandas as pd
 import yfinance as yf
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-from .stats import StockStats
-from scipy import stats
-import base64
-from io import BytesIO
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from .stats import StockStats, draw_jumps, draw_tilted_jumps, shock_shifts, defensive_log_weights, cumulative_paths, final_value_statistics, weighted_tail_statistics, window_jump_params, CALIBRATION_START, CALIBRATION_END
+from .price_store import price_store
+from .streaming import StreamingStatistics, ControlVariateStatistics
+from .sampling import standard_normals
+from .calibration import calibrate_portfolio
+from .bootstrap import window_returns, window_factors, bootstrap_paths, DEFAULT_BLOCK_SIZE
+from .risk_metrics import path_risk_metrics, summarize_path_metrics, PathMetricsAccumulator
+from .charts import cached_render, render_fan_chart, render_histogram
 import json
+import time
+import uuid
+import metrics
+
+# Paths per shard in simulate_sharded; fixed so that results do not depend on the worker count
+DEFAULT_SHARD_SIZE = 1000
+
+# Simulation engines of PortfolioMonteCarlo: the calibrated jump-diffusion model, or resampled event history
+ENGINES = ('jump_diffusion', 'bootstrap')
+
+# Portfolio statistics lined up side by side by monteCarloScenarios
+COMPARISON_METRICS = ('var_95', 'es_95', 'mean', 'std_dev', 'skewness', 'kurtosis', 'prob_loss')
+
+
+def stock_column(values):
+    """
+    One parameter per stock, shaped to broadcast against a (stocks, sims, days) tensor.
+    """
+    return np.array(values, dtype=float)[:, None, None]
+
+
+def draw_diffusion(stocks, num_simulations, num_days, correlated=True, rng=None, sampling='pseudo'):
+    """
+    Daily diffusion log-returns (drift, ETF factor and idiosyncratic terms) of stocks, as a
+    (stocks, sims, days - 1) tensor, and the factor shocks it was built from.
+    ETF factor shocks are drawn once per distinct ETF and reused by every stock mapped to it
+    (or once per stock when correlated=False).
+    sampling: 'pseudo', 'antithetic' or 'sobol' shocks (see standard_normals); the other methods need a
+    np.random.Generator as rng.
+    """
+    rng = np.random if rng is None else rng
+    steps = (num_simulations, num_days - 1)
+    etfs = sorted({stock.ETF for stock in stocks}) if correlated else None
+    etf_index = [etfs.index(stock.ETF) for stock in stocks] if correlated else slice(None)
+    num_factors = len(etfs) if correlated else len(stocks)
+    if sampling == 'pseudo':
+        factor_shocks = rng.normal(size=(num_factors,) + steps)[etf_index]
+        idiosyncratic_shocks = None
+    else:
+        # Factor and idiosyncratic shocks come from one draw so that Sobol points span all of them
+        shocks = standard_normals(num_factors + len(stocks), num_simulations, num_days - 1, sampling, rng)
+        factor_shocks = shocks[:num_factors][etf_index]
+        idiosyncratic_shocks = shocks[num_factors:]
+
+    dt = stock_column([stock.dt for stock in stocks])
+    drift = stock_column([stock.calculateDrift() for stock in stocks])
+    systematic = stock_column([stock.beta * stock.sig_ETF for stock in stocks]) * np.sqrt(dt)
+    idiosyncratic = stock_column([stock.sig_idio for stock in stocks]) * np.sqrt(dt)
+
+    diffusion = drift + systematic * factor_shocks
+    if idiosyncratic_shocks is None:
+        idiosyncratic_shocks = rng.normal(size=(len(stocks),) + steps)
+    diffusion += idiosyncratic * idiosyncratic_shocks
+    return diffusion, factor_shocks
+
+
+def draw_portfolio_tensor(stocks, num_simulations, num_days, correlated=True, with_no_jump=False, jumping=True, rng=None, sampling='pseudo'):
+    """
+    Draw the (stocks x sims x days) tensor of stock values from the calibrated parameters of stocks
+    (see draw_diffusion for the correlation structure and sampling). jumping=False leaves the jump term out
+    entirely; with_no_jump returns both versions from the same diffusion draws.
+    rng: a np.random.Generator, defaults to the global np.random state.
+    """
+    rng = np.random if rng is None else rng
+    diffusion, factor_shocks = draw_diffusion(stocks, num_simulations, num_days, correlated, rng, sampling)
+    dt = stock_column([stock.dt for stock in stocks])
+    start_values = stock_column([stock.start_value for stock in stocks])
+    if not jumping:
+        stock_simulations = start_values * cumulative_paths(diffusion)
+        record_matrix_bytes(factor_shocks, diffusion, stock_simulations)
+        return stock_simulations
+
+    lambda_jump = stock_column([stock.lambda_jump if stock.jumping else 0 for stock in stocks])
+    mu_J = stock_column([stock.mu_J for stock in stocks])
+    sigma_J = stock_column([stock.sigma_J for stock in stocks])
+    jumps = draw_jumps(lambda_jump, mu_J, sigma_J, dt, diffusion.shape, rng)
+    stock_simulations = start_values * cumulative_paths(diffusion + jumps)
+    if with_no_jump:
+        no_jump_simulations = start_values * cumulative_paths(diffusion)
+        record_matrix_bytes(factor_shocks, diffusion, jumps, stock_simulations, no_jump_simulations)
+        return stock_simulations, no_jump_simulations
+    record_matrix_bytes(factor_shocks, diffusion, jumps, stock_simulations)
+    return stock_simulations
+
+
+def record_matrix_bytes(*arrays):
+    metrics.max_gauge('blackswan_simulation_matrix_bytes_peak', sum(array.nbytes for array in arrays),
+                      'Largest memory held by the simulation matrices of one draw')
+
+
+def record_throughput(num_paths, seconds):
+    metrics.inc('blackswan_simulated_paths_total', num_paths, 'Simulated portfolio paths')
+    metrics.set_gauge('blackswan_simulation_paths_per_second', num_paths / seconds if seconds > 0 else 0,
+                      'Throughput of the last portfolio simulation')
+
+
+def poisson_inverse(uniforms, rates, max_count=50):
+    """
+    Poisson counts of the given rates (broadcast against uniforms) by inverting the CDF of uniform draws,
+    so that the same uniforms give comparable counts for different rates.
+    """
+    counts = np.zeros(uniforms.shape, dtype=np.int16)
+    pmf = np.exp(-rates)
+    cdf = pmf
+    for k in range(1, max_count + 1):
+        above = uniforms > cdf
+        if not above.any():
+            break
+        counts += above
+        pmf = pmf * rates / k
+        cdf = cdf + pmf
+    return counts
+
+
+def draw_scenario_paths(stocks, scenario_jumps, num_simulations, num_days, correlated=True, rng=None):
+    """
+    Simulate several jump scenarios of one calibrated portfolio with common random numbers: the diffusion is
+    drawn once and shared, and every scenario turns the same uniforms and normals into its jumps, so the
+    differences between scenarios come from their jump parameters rather than from sampling noise.
+    scenario_jumps: per scenario, a list of {'lambda_jump', 'mu_J', 'sigma_J'} in the order of stocks.
+    Returns the portfolio paths and the (stocks, sims) final stock values of every scenario, and the no-jump
+    portfolio paths they all share.
+    """
+    rng = np.random if rng is None else rng
+    diffusion, factor_shocks = draw_diffusion(stocks, num_simulations, num_days, correlated, rng)
+    dt = stock_column([stock.dt for stock in stocks])
+    start_values = stock_column([stock.start_value for stock in stocks])
+    jump_uniforms = rng.random(size=diffusion.shape)
+    jump_normals = rng.normal(size=diffusion.shape)
+    del factor_shocks
+
+    scenario_paths, scenario_final_values = [], []
+    for jumps in scenario_jumps:
+        rates = stock_column([params['lambda_jump'] if stock.jumping else 0 for stock, params in zip(stocks, jumps)]) * dt
+        mu_J = np.nan_to_num(stock_column([params['mu_J'] for params in jumps]))
+        sigma_J = np.nan_to_num(stock_column([params['sigma_J'] for params in jumps]))
+        counts = poisson_inverse(jump_uniforms, rates)
+        stock_simulations = start_values * cumulative_paths(diffusion + counts * mu_J + np.sqrt(counts) * sigma_J * jump_normals)
+        record_matrix_bytes(diffusion, jump_uniforms, jump_normals, stock_simulations)
+        scenario_paths.append(stock_simulations.sum(axis=0))
+        scenario_final_values.append(stock_simulations[:, :, -1])
+        del stock_simulations
+    no_jump_paths = (start_values * cumulative_paths(diffusion)).sum(axis=0)
+    return scenario_paths, scenario_final_values, no_jump_paths
+
+
+def simulate_shard(stock_specs, num_simulations, num_days, seed_sequence, correlated=True, with_no_jump=False, sampling='pseudo'):
+    """
+    Process pool worker of simulate_sharded. Rebuilds the stocks from their calibrated parameters and
+    returns the portfolio paths, the no-jump portfolio paths (or None), the per-stock final values and the
+    per-stock path_risk_metrics (so that the stock paths themselves need not leave the worker).
+    """
+    stocks = [StockStats(*spec) for spec in stock_specs]
+    rng = np.random.default_rng(seed_sequence)
+    stock_simulations = draw_portfolio_tensor(stocks, num_simulations, num_days, correlated, with_no_jump, rng=rng, sampling=sampling)
+    no_jump_simulations = None
+    if with_no_jump:
+        stock_simulations, no_jump_simulations = stock_simulations
+        no_jump_simulations = no_jump_simulations.sum(axis=0)
+    stock_path_metrics = [path_risk_metrics(paths) for paths in stock_simulations]
+    return stock_simulations.sum(axis=0), no_jump_simulations, stock_simulations[:, :, -1], stock_path_metrics
+
 
 class PortfolioMonteCarlo:
-    def __init__(self, stock_dict, history_start_date, history_end_date):
+    def __init__(self, stock_dict, history_start_date, history_end_date, max_workers=8, progress=None, engine='jump_diffusion', rolling_window=None):
         """
         stock_dict: Dictionary with format {ticker: (ETF_ticker, shares)}
         history_start_date, history_end_date: Historical data range for calculations
+        max_workers: Number of price histories loaded at the same time during calibration
+        progress: optional progress(event, **data) callback, told as every holding is calibrated
+        engine: 'jump_diffusion' calibrates every holding for monteCarlo; 'bootstrap' only measures them on
+        the event window for monteCarloBootstrap (see measure_stocks), which is much cheaper
+        rolling_window: optional number of days; when given, the rolling betas of every holding over the
+        calibration window are kept in self.rolling_betas
         """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
         self.stock_dict = stock_dict
         self.history_start_date = history_start_date
         self.history_end_date = history_end_date
-        self.stocks = []
-        for ticker, (etf_ticker, shares) in stock_dict.items():
-            self.stocks.append(StockStats(ticker, etf_ticker, history_start_date, history_end_date, shares))
+        self.engine = engine
+        # ticker -> error message for holdings that could not be calibrated
+        self.failed_tickers = {}
+        # (days x stocks) log-returns of the event window, for monteCarloBootstrap
+        self.returns = None
+        # (dates x stocks) rolling betas, see calibrate_stocks
+        self.rolling_betas = None
+        if engine == 'bootstrap':
+            self.stocks = self.measure_stocks(progress)
+        else:
+            self.stocks = self.calibrate_stocks(max_workers, progress, rolling_window)
         self.num_stocks = len(self.stocks)
         self.simulations = np.zeros((1000, 252))
+        self.no_jump_simulations = None
+        # Identifies the current simulations, e.g. for the render cache
+        self.run_id = uuid.uuid4().hex
+        self.seed = None
         self.portfolio_value = sum([s.start_value for s in self.stocks])
         self.max_y = 2 * self.portfolio_value
         self.recommendations = {}
 
-    def simulate(self, num_simulations, num_days):
+    def calibrate_stocks(self, max_workers=8, progress=None, rolling_window=None):
+        """
+        Calibrate every holding. The unique stock and ETF tickers of the whole portfolio are first
+        fetched with batched multi-ticker downloads, then all holdings are fitted at once on one aligned
+        matrix of log-returns (see calibrate_portfolio).
+        A holding that fails is recorded in self.failed_tickers and left out instead of aborting the run.
+        progress: optional callback, called as progress('calibrated', ticker=..., ok=..., done=..., total=...)
+        for every holding once the batch is fitted.
+        """
+        tickers = list(self.stock_dict)
+        etfs = list(dict.fromkeys(etf_ticker for etf_ticker, _ in self.stock_dict.values()))
+        try:
+            price_store.prefetch(tickers + etfs, CALIBRATION_START, CALIBRATION_END)
+            price_store.prefetch(etfs, self.history_start_date, self.history_end_date)
+            price_store.prefetch_last_close(tickers)
+        except Exception as e:
+            # The per-ticker fetches of calibrate_portfolio will retry whatever is missing
+            print(f"Bulk price prefetch failed: {e}")
+
+        with metrics.timed('portfolio_calibration'):
+            params, failed, self.rolling_betas = calibrate_portfolio(self.stock_dict, self.history_start_date, self.history_end_date, rolling_window, max_workers)
+        stocks = []
+        for done, ticker in enumerate(tickers, 1):
+            etf_ticker, shares = self.stock_dict[ticker]
+            if ticker in params:
+                stocks.append(StockStats(ticker, etf_ticker, self.history_start_date, self.history_end_date, shares, params=params[ticker]))
+            else:
+                print(f"Could not calibrate {ticker}: {failed[ticker]}")
+                self.failed_tickers[ticker] = failed[ticker]
+            if progress is not None:
+                progress('calibrated', ticker=ticker, ok=ticker in params, done=done, total=len(tickers))
+        if not stocks:
+            raise ValueError(f"No holdings could be calibrated: {self.failed_tickers}")
+        return stocks
+
+    def measure_stocks(self, progress=None):
+        """
+        Set up the holdings for the bootstrap engine without fitting anything on the calibration window: their
+        joint log-returns over the event window are loaded once into self.returns (see window_returns), and
+        beta, volatilities and jump parameters are measured on that same window in closed form, for the
+        statistics and recommendations. Holdings without a last close are recorded in self.failed_tickers.
+        """
+        tickers = list(self.stock_dict)
+        etfs = list(dict.fromkeys(etf_ticker for etf_ticker, _ in self.stock_dict.values()))
+        try:
+            price_store.prefetch(tickers + etfs, self.history_start_date, self.history_end_date)
+            price_store.prefetch_last_close(tickers)
+        except Exception as e:
+            print(f"Bulk price prefetch failed: {e}")
+
+        returns, etf_returns = window_returns(self.stock_dict, self.history_start_date, self.history_end_date)
+        jump_estimates = {etf: window_jump_params(etf, self.history_start_date, self.history_end_date) for etf in etfs}
+        stocks = []
+        for done, ticker in enumerate(tickers, 1):
+            etf_ticker, shares = self.stock_dict[ticker]
+            try:
+                params = {**window_factors(returns[ticker], etf_returns[etf_ticker]), **jump_estimates[etf_ticker],
+                          'start_value': price_store.get_last_close(ticker) * shares}
+                stocks.append(StockStats(ticker, etf_ticker, self.history_start_date, self.history_end_date, shares, params=params))
+            except Exception as e:
+                print(f"Could not measure {ticker}: {e}")
+                self.failed_tickers[ticker] = str(e)
+            if progress is not None:
+                progress('calibrated', ticker=ticker, ok=ticker not in self.failed_tickers, done=done, total=len(tickers))
+        if not stocks:
+            raise ValueError(f"No holdings could be measured: {self.failed_tickers}")
+        self.returns = returns[[stock.ticker for stock in stocks]]
+        return stocks
+
+    def simulate(self, num_simulations, num_days, correlated=True, return_tensor=False, with_no_jump=False):
         """
         Run Monte Carlo simulations for the entire portfolio.
+        correlated: simulate every stock in one (stocks x sims x days) tensor where stocks mapped to
+        the same ETF share its factor shocks. With correlated=False each stock is simulated on its own.
+        return_tensor: return the per-stock tensor instead of the aggregated portfolio paths.
+        with_no_jump: also keep the no-jump portfolio paths in self.no_jump_simulations, built from
+        the same random draws with the jump term left out.
         """
-        # Initialize portfolio simulation matrix (num_simulations x num_days)
-        portfolio_simulations = np.zeros((num_simulations, num_days))
+        no_jump_simulations = None
+        if correlated or return_tensor:
+            stock_simulations = self.simulate_tensor(num_simulations, num_days, correlated, with_no_jump)
+            if with_no_jump:
+                stock_simulations, no_jump_simulations = stock_simulations
+                no_jump_simulations = no_jump_simulations.sum(axis=0)
+            portfolio_simulations = stock_simulations.sum(axis=0)
+        else:
+            # Initialize portfolio simulation matrix (num_simulations x num_days)
+            portfolio_simulations = np.zeros((num_simulations, num_days))
+            if with_no_jump:
+                no_jump_simulations = np.zeros((num_simulations, num_days))
 
-        # Simulate each stock and add its contribution to the portfolio
-        for stock in self.stocks:
-            stock_simulations = stock.monteCarlo(num_simulations,num_days)
-            portfolio_simulations += stock_simulations  # Sum stock values for portfolio aggregation
+            # Simulate each stock and add its contribution to the portfolio
+            for stock in self.stocks:
+                stock_simulations = stock.monteCarlo(num_simulations, num_days, with_no_jump)
+                portfolio_simulations += stock_simulations  # Sum stock values for portfolio aggregation
+                if with_no_jump:
+                    no_jump_simulations += stock.no_jump_simulations
         self.simulations = portfolio_simulations
+        self.no_jump_simulations = no_jump_simulations
+        self.run_id = uuid.uuid4().hex
+        if return_tensor:
+            return stock_simulations
         return portfolio_simulations
 
-    def monteCarlo(self, num_simulations, num_days):
+    def simulate_tensor(self, num_simulations, num_days, correlated=True, with_no_jump=False):
+        """
+        Simulate every stock in one vectorized pass and return a (stocks x sims x days) tensor
+        (or a (tensor, no_jump_tensor) tuple with with_no_jump). Each stock keeps its slice and statistics.
+        """
+        stock_simulations = self.draw_tensor(num_simulations, num_days, correlated, with_no_jump)
+        jump_simulations = stock_simulations[0] if with_no_jump else stock_simulations
+        for stock, simulations in zip(self.stocks, jump_simulations):
+            stock.simulations = simulations
+            stock.statistics = stock.getStatistics()
+        return stock_simulations
+
+    def draw_tensor(self, num_simulations, num_days, correlated=True, with_no_jump=False, jumping=True, rng=None):
+        """
+        Draw the (stocks x sims x days) tensor of stock values from the calibrated parameters (see draw_portfolio_tensor).
+        """
+        return draw_portfolio_tensor(self.stocks, num_simulations, num_days, correlated, with_no_jump, jumping, rng)
+
+    def simulate_sharded(self, num_simulations, num_days, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE, correlated=True, with_no_jump=False, sampling='pseudo'):
+        """
+        Split the paths into shards of shard_size and simulate them on a process pool of workers processes
+        (in this process when workers is None or 1). Every shard draws from its own generator spawned from
+        np.random.SeedSequence(seed), and shards are merged in order, so a given seed gives bit-for-bit the
+        same paths whatever the worker count. The seed actually used is kept in self.seed.
+        sampling: how the diffusion shocks of every shard are drawn (see standard_normals).
+        """
+        seed_sequence = np.random.SeedSequence(seed)
+        self.seed = seed_sequence.entropy
+        shard_sizes = [min(shard_size, num_simulations - start) for start in range(0, num_simulations, shard_size)]
+        shard_seeds = seed_sequence.spawn(len(shard_sizes))
+        stock_specs = [(stock.ticker, stock.ETF, stock.start_date, stock.end_date, stock.shares, stock.jumping, stock.get_params()) for stock in self.stocks]
+        shard_args = [(stock_specs, size, num_days, shard_seed, correlated, with_no_jump, sampling) for size, shard_seed in zip(shard_sizes, shard_seeds)]
+
+        if workers is None or workers <= 1:
+            shards = [simulate_shard(*args) for args in shard_args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                shards = list(executor.map(simulate_shard, *zip(*shard_args)))
+
+        self.simulations = np.concatenate([shard[0] for shard in shards])
+        self.no_jump_simulations = np.concatenate([shard[1] for shard in shards]) if with_no_jump else None
+        self.run_id = uuid.uuid4().hex
+        stock_final_values = np.concatenate([shard[2] for shard in shards], axis=1)
+        for index, (stock, final_values) in enumerate(zip(self.stocks, stock_final_values)):
+            path_metrics = PathMetricsAccumulator()
+            for shard in shards:
+                path_metrics.add(shard[3][index])
+            stock.simulations = None
+            stock.statistics = final_value_statistics(final_values, stock.start_value)
+            stock.statistics['initial_value'] = stock.start_value
+            stock.statistics['path_metrics'] = path_metrics.result()
+        return self.simulations
+
+    def monteCarlo(self, num_simulations, num_days, with_no_jump=False, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE, sampling='pseudo'):
         """
         Run Monte Carlo and compute portfolio-level risk statistics.
+        with_no_jump: also build the no-jump comparison paths from the same draws (see simulate).
+        seed, workers: run reproducible seeded shards, optionally on a process pool (see simulate_sharded).
+        sampling: 'antithetic' or 'sobol' shocks instead of plain pseudo-random ones (always run as shards).
         """
-        portfolio_simulations = self.simulate(num_simulations, num_days)
+        start = time.perf_counter()
+        with metrics.timed('simulation'):
+            if seed is not None or workers is not None or sampling != 'pseudo':
+                portfolio_simulations = self.simulate_sharded(num_simulations, num_days, seed, workers, shard_size, with_no_jump=with_no_jump, sampling=sampling)
+            else:
+                portfolio_simulations = self.simulate(num_simulations, num_days, with_no_jump=with_no_jump)
+        record_throughput(num_simulations, time.perf_counter() - start)
         # Get portfolio statistics using StockStats' method
         return self.getStatistics(portfolio_simulations)
 
+    def monteCarloStreaming(self, num_simulations, num_days, chunk_size=DEFAULT_SHARD_SIZE, exact=True, sketch_size=10000, seed=None, keep_paths=1000, with_no_jump=False, progress=None,
+                            sampling='pseudo', control_variate=False, tolerance=None, max_simulations=None):
+        """
+        Bounded-memory monteCarlo for very large path counts. Paths are simulated chunk_size at a time, using
+        the same seeded chunks as simulate_sharded, and each chunk is reduced to the portfolio and per-stock
+        statistics before the next one is drawn (see StreamingStatistics; exact=False swaps the retained final
+        values for a reservoir sample of sketch_size; the per-stock path metrics always come from such a sample,
+        see PathMetricsAccumulator). Only the first keep_paths portfolio paths (and no-jump paths) are kept in
+        self.simulations for the charts.
+        progress: optional callback, called as progress('simulated', paths=..., num_simulations=..., var_95=...,
+        es_95=..., var_95_se=..., es_95_se=...) after every chunk with the interim portfolio VaR and ES.
+        sampling: 'antithetic' or 'sobol' diffusion shocks (see standard_normals).
+        control_variate: add result['control_variate'], the mean and probability of loss corrected with the
+        no-jump paths of the same draws, whose expected final value is known (see ControlVariateStatistics).
+        tolerance: adaptive mode, keep adding chunks after num_simulations paths until the standard errors of
+        VaR_95 and ES_95 are both within tolerance times the initial portfolio value, or max_simulations paths
+        (default 20 * num_simulations) have been simulated. result['num_simulations'] is the count used.
+        """
+        with metrics.timed('simulation'):
+            start = time.perf_counter()
+            result = self.simulate_streaming(num_simulations, num_days, chunk_size, exact, sketch_size, seed, keep_paths, with_no_jump, progress,
+                                             sampling, control_variate, tolerance, max_simulations)
+            record_throughput(result['num_simulations'], time.perf_counter() - start)
+        return result
+
+    def simulate_streaming(self, num_simulations, num_days, chunk_size, exact, sketch_size, seed, keep_paths, with_no_jump, progress,
+                           sampling='pseudo', control_variate=False, tolerance=None, max_simulations=None):
+        seed_sequence = np.random.SeedSequence(seed)
+        self.seed = seed_sequence.entropy
+        chunk_sizes = [min(chunk_size, num_simulations - start) for start in range(0, num_simulations, chunk_size)]
+        # One extra child seeds the reservoir samplers; adaptive chunks spawn further children as they go
+        chunk_seeds = seed_sequence.spawn(len(chunk_sizes) + 1)
+        sketch_rng = np.random.default_rng(chunk_seeds[-1])
+        stock_specs = [(stock.ticker, stock.ETF, stock.start_date, stock.end_date, stock.shares, stock.jumping, stock.get_params()) for stock in self.stocks]
+        max_simulations = max(max_simulations or 20 * num_simulations, num_simulations)
+        error_limit = None if tolerance is None else tolerance * self.portfolio_value
+
+        portfolio_statistics = StreamingStatistics(self.portfolio_value, exact, sketch_size, sketch_rng)
+        portfolio_path_metrics = PathMetricsAccumulator()
+        stock_statistics = [StreamingStatistics(stock.start_value, exact, sketch_size, sketch_rng) for stock in self.stocks]
+        # Per-stock path metrics are only sketched, or they would cost as much memory as the paths themselves
+        stock_path_metrics = [PathMetricsAccumulator(sketch_size, sketch_rng) for _ in self.stocks]
+        control_statistics = ControlVariateStatistics(self.portfolio_value, self.expected_no_jump_value(num_days)) if control_variate else None
+        kept, kept_no_jump = [], []
+        kept_count = 0
+        interim = None
+        chunk = 0
+        while True:
+            if chunk < len(chunk_sizes):
+                size, chunk_seed = chunk_sizes[chunk], chunk_seeds[chunk]
+            elif (error_limit is not None and portfolio_statistics.count < max_simulations
+                  and not (interim['var_95_se'] <= error_limit and interim['es_95_se'] <= error_limit)):
+                size, chunk_seed = min(chunk_size, max_simulations - portfolio_statistics.count), seed_sequence.spawn(1)[0]
+            else:
+                break
+            chunk += 1
+            simulations, no_jump_simulations, stock_final_values, stock_metrics = simulate_shard(stock_specs, size, num_days, chunk_seed, with_no_jump=with_no_jump or control_variate,
+                                                                                  sampling=sampling)
+            portfolio_statistics.update(simulations[:, -1])
+            portfolio_path_metrics.update(simulations)
+            for statistics, path_metrics, final_values, chunk_metrics in zip(stock_statistics, stock_path_metrics, stock_final_values, stock_metrics):
+                statistics.update(final_values)
+                path_metrics.add(chunk_metrics)
+            if control_statistics is not None:
+                control_statistics.update(simulations[:, -1], no_jump_simulations[:, -1])
+            if kept_count < keep_paths:
+                kept.append(simulations[:keep_paths - kept_count])
+                if with_no_jump:
+                    kept_no_jump.append(no_jump_simulations[:keep_paths - kept_count])
+                kept_count += len(kept[-1])
+            if progress is not None or error_limit is not None:
+                interim = portfolio_statistics.result()
+            if progress is not None:
+                progress('simulated', paths=portfolio_statistics.count, num_simulations=max(num_simulations, portfolio_statistics.count),
+                         var_95=float(interim['var_95']), es_95=float(interim['es_95']),
+                         var_95_se=float(interim['var_95_se']), es_95_se=float(interim['es_95_se']))
+
+        self.simulations = np.concatenate(kept)
+        self.no_jump_simulations = np.concatenate(kept_no_jump) if with_no_jump else None
+        self.run_id = uuid.uuid4().hex
+        for stock, statistics, path_metrics in zip(self.stocks, stock_statistics, stock_path_metrics):
+            stock.simulations = None
+            stock.statistics = statistics.result()
+            stock.statistics['initial_value'] = stock.start_value
+            stock.statistics['path_metrics'] = path_metrics.result()
+        result = portfolio_statistics.result()
+        result['inital_portfolio_value'] = self.portfolio_value
+        result['num_simulations'] = portfolio_statistics.count
+        result['path_metrics'] = portfolio_path_metrics.result()
+        if control_statistics is not None:
+            result['control_variate'] = control_statistics.result()
+        return result
+
+    def expected_no_jump_value(self, num_days):
+        """
+        Exact expected final value of the no-jump portfolio after num_days days: every stock's diffusion is a
+        GBM whose expected growth is exp(beta * mu_ETF * t), whatever the shocks' correlation.
+        """
+        return sum(stock.start_value * np.exp(stock.beta * stock.mu_ETF * stock.dt * (num_days - 1)) for stock in self.stocks)
+
+    def monteCarloBootstrap(self, num_simulations, num_days, block_size=DEFAULT_BLOCK_SIZE, method='stationary', seed=None, with_no_jump=False, progress=None):
+        """
+        Historical alternative to monteCarlo: instead of drawing from the fitted model, every path replays
+        blocks of actual joint daily moves of the holdings during the event window (see bootstrap_paths), so
+        fat tails, volatility clustering and the co-movement of the holdings come from what really happened.
+        block_size, method: mean or fixed block length and 'stationary' or 'moving' (see bootstrap_indices).
+        with_no_jump: also keep comparison paths bootstrapped the same way from the calibration window, i.e.
+        ordinary history without the event, in self.no_jump_simulations.
+        Returns the same statistics as monteCarlo and sets every stock's statistics.
+        """
+        if self.returns is None:
+            stock_dict = {stock.ticker: (stock.ETF, stock.shares) for stock in self.stocks}
+            self.returns = window_returns(stock_dict, self.history_start_date, self.history_end_date)[0]
+        seed_sequence = np.random.SeedSequence(seed)
+        self.seed = seed_sequence.entropy
+        event_seed, baseline_seed = seed_sequence.spawn(2)
+        start_values = [stock.start_value for stock in self.stocks]
+
+        with metrics.timed('simulation'):
+            start = time.perf_counter()
+            self.simulations, stock_final_values, stock_path_metrics = bootstrap_paths(self.returns, start_values, num_simulations, num_days, block_size,
+                                                                                       method, np.random.default_rng(event_seed), path_metrics=True)
+            self.no_jump_simulations = None
+            if with_no_jump:
+                stock_dict = {stock.ticker: (stock.ETF, stock.shares) for stock in self.stocks}
+                baseline_returns = window_returns(stock_dict, CALIBRATION_START, CALIBRATION_END)[0]
+                self.no_jump_simulations = bootstrap_paths(baseline_returns, start_values, num_simulations, num_days, block_size, method,
+                                                           np.random.default_rng(baseline_seed))[0]
+            record_throughput(num_simulations, time.perf_counter() - start)
+        self.run_id = uuid.uuid4().hex
+
+        for stock, final_values, path_metrics in zip(self.stocks, stock_final_values, stock_path_metrics):
+            stock.simulations = None
+            stock.statistics = final_value_statistics(final_values, stock.start_value)
+            stock.statistics['initial_value'] = stock.start_value
+            stock.statistics['path_metrics'] = summarize_path_metrics(path_metrics)
+        result = self.getStatistics(self.simulations)
+        if progress is not None:
+            progress('simulated', paths=num_simulations, num_simulations=num_simulations,
+                     var_95=float(result['var_95']), es_95=float(result['es_95']))
+        return result
+
+    def monteCarloImportance(self, num_simulations, num_days, intensity_tilt=2.0, size_shift=0.5, diffusion_shift=2.5, tail_fraction=0.5, seed=None,
+                             correlated=True, chunk_size=DEFAULT_SHARD_SIZE):
+        """
+        Deep-tail portfolio statistics by importance sampling. A tail_fraction of the paths are drawn from a
+        model tilted towards portfolio losses:
+        - jumps arrive more often and are larger (see draw_tilted_jumps); a holding's tilt scales with its
+          weight, up to intensity_tilt and size_shift for the largest one, so that small holdings, which
+          barely move the portfolio, do not add weight noise
+        - the ETF factor and idiosyncratic shocks are shifted so that the portfolio's diffusion return drops
+          by diffusion_shift standard deviations (see shock_shifts), since the factors move the holdings
+          together while their jumps are independent
+        Each path carries the likelihood ratio of its draws as its weight (see defensive_log_weights), and the
+        weighted final values give VaR/ES at 99% and 99.9% (see weighted_tail_statistics) from thousands of
+        paths instead of millions.
+        Paths are drawn chunk_size at a time and only their final values are kept. Every stock's weighted tail
+        statistics go to stock.tail_statistics and result['stocks'].
+        """
+        seed_sequence = np.random.SeedSequence(seed)
+        chunk_sizes = [min(chunk_size, num_simulations - start) for start in range(0, num_simulations, chunk_size)]
+        num_steps = num_days - 1
+        dt = stock_column([stock.dt for stock in self.stocks])
+        start_values = np.array([stock.start_value for stock in self.stocks], dtype=float)
+        holding_weights = start_values / start_values.sum()
+        drift = stock_column([stock.calculateDrift() for stock in self.stocks])
+        systematic = np.array([stock.beta * stock.sig_ETF * np.sqrt(stock.dt) for stock in self.stocks])
+        idiosyncratic = np.array([stock.sig_idio * np.sqrt(stock.dt) for stock in self.stocks])
+        lambda_jump = stock_column([stock.lambda_jump if stock.jumping else 0 for stock in self.stocks])
+        mu_J = stock_column([stock.mu_J for stock in self.stocks])
+        sigma_J = stock_column([stock.sigma_J for stock in self.stocks])
+        relative_weights = stock_column(holding_weights / holding_weights.max())
+        stock_intensity_tilt = intensity_tilt ** relative_weights
+        stock_size_shift = size_shift * relative_weights
+
+        # One factor per distinct ETF (or per stock when correlated=False), loaded by the stocks mapped to it
+        etfs = sorted({stock.ETF for stock in self.stocks}) if correlated else [stock.ticker for stock in self.stocks]
+        factor_index = [etfs.index(stock.ETF if correlated else stock.ticker) for stock in self.stocks]
+        factor_exposures = np.zeros(len(etfs))
+        np.add.at(factor_exposures, factor_index, holding_weights * systematic)
+        shifts = shock_shifts(np.concatenate([factor_exposures, holding_weights * idiosyncratic]), num_steps, diffusion_shift)
+        factor_shifts, idiosyncratic_shifts = shifts[:len(etfs)], shifts[len(etfs):]
+
+        stock_final_values, stock_log_ratios, factor_log_ratios = [], [], []
+        with metrics.timed('importance_sampling'):
+            for size, chunk_seed in zip(chunk_sizes, seed_sequence.spawn(len(chunk_sizes))):
+                rng = np.random.default_rng(chunk_seed)
+                # Every stock of a path is drawn from the same model
+                tilted = rng.random((1, size, 1)) < tail_fraction
+                factor_shocks = rng.normal(size=(len(etfs), size, num_steps)) - factor_shifts[:, None, None] * tilted
+                idiosyncratic_shocks = rng.normal(size=(len(self.stocks), size, num_steps)) - idiosyncratic_shifts[:, None, None] * tilted
+                diffusion = drift + stock_column(systematic) * factor_shocks[factor_index] + stock_column(idiosyncratic) * idiosyncratic_shocks
+                jumps, log_ratios = draw_tilted_jumps(lambda_jump, mu_J, sigma_J, dt, diffusion.shape, stock_intensity_tilt, stock_size_shift, tilted, rng)
+                record_matrix_bytes(factor_shocks, idiosyncratic_shocks, diffusion, jumps, log_ratios)
+                # Only the final values matter, so the paths are never built
+                stock_final_values.append(start_values[:, None] * np.exp((diffusion + jumps).sum(axis=-1)))
+                # Normal shocks moved down by a shift: log P/Q = shift * shock + shift^2 / 2 at the shock used
+                stock_log_ratios.append(log_ratios.sum(axis=-1) + idiosyncratic_shifts[:, None] * idiosyncratic_shocks.sum(axis=-1)
+                                        + num_steps * idiosyncratic_shifts[:, None] ** 2 / 2)
+                factor_log_ratios.append(factor_shifts[:, None] * factor_shocks.sum(axis=-1) + num_steps * factor_shifts[:, None] ** 2 / 2)
+                del factor_shocks, idiosyncratic_shocks, diffusion, jumps, log_ratios
+        stock_final_values = np.concatenate(stock_final_values, axis=1)
+        stock_log_ratios = np.concatenate(stock_log_ratios, axis=1)
+        factor_log_ratios = np.concatenate(factor_log_ratios, axis=1)
+
+        log_weights = defensive_log_weights(stock_log_ratios.sum(axis=0) + factor_log_ratios.sum(axis=0), tail_fraction)
+        result = weighted_tail_statistics(stock_final_values.sum(axis=0), log_weights, self.portfolio_value)
+        result['intensity_tilt'] = intensity_tilt
+        result['size_shift'] = size_shift
+        result['diffusion_shift'] = diffusion_shift
+        result['tail_fraction'] = tail_fraction
+        result['stocks'] = {}
+        # A stock's distribution only changed through its own shocks, factor and jumps, so its weights only need those ratios
+        for stock, final_values, log_ratios, factor in zip(self.stocks, stock_final_values, stock_log_ratios, factor_index):
+            stock.tail_statistics = weighted_tail_statistics(final_values, defensive_log_weights(log_ratios + factor_log_ratios[factor], tail_fraction), stock.start_value)
+            result['stocks'][stock.ticker] = stock.tail_statistics
+        return result
+
+    def monteCarloScenarios(self, scenarios, num_simulations, num_days, seed=None, correlated=True):
+        """
+        Stress test the calibrated portfolio against several event windows at once.
+        scenarios: list of {'name', 'start', 'end'}. The stock-level calibration (beta, volatilities, start
+        values) is shared by every scenario; only the jump parameters differ, estimated once per distinct
+        (ETF, window). All scenarios are simulated in one batch with common random numbers
+        (see draw_scenario_paths).
+        Returns the statistics of every scenario, of the shared no-jump baseline, and a comparison table
+        metric -> {scenario name: value}.
+        """
+        jump_estimates = {}
+
+        def jump_params(etf, start, end):
+            if (etf, start, end) not in jump_estimates:
+                jump_estimates[etf, start, end] = window_jump_params(etf, start, end)
+            return jump_estimates[etf, start, end]
+
+        scenario_jumps = [[jump_params(stock.ETF, scenario['start'], scenario['end']) for stock in self.stocks] for scenario in scenarios]
+        with metrics.timed('simulation'):
+            start = time.perf_counter()
+            rng = np.random.default_rng(seed)
+            scenario_paths, scenario_final_values, no_jump_paths = draw_scenario_paths(self.stocks, scenario_jumps, num_simulations, num_days, correlated, rng)
+            record_throughput(num_simulations * len(scenarios), time.perf_counter() - start)
+
+        results = []
+        for scenario, jumps, paths, final_values in zip(scenarios, scenario_jumps, scenario_paths, scenario_final_values):
+            results.append({
+                'name': scenario['name'],
+                'start': scenario['start'],
+                'end': scenario['end'],
+                'portfolio_stats': self.getStatistics(paths),
+                'stock_stats': {stock.ticker: final_value_statistics(values, stock.start_value) for stock, values in zip(self.stocks, final_values)},
+                'jump_params': {stock.ETF: params for stock, params in zip(self.stocks, jumps)},
+            })
+        return {
+            'inital_portfolio_value': self.portfolio_value,
+            'num_simulations': num_simulations,
+            'num_days': num_days,
+            'scenarios': results,
+            'no_jump_stats': self.getStatistics(no_jump_paths),
+            'comparison': {metric: {result['name']: result['portfolio_stats'][metric] for result in results} for metric in COMPARISON_METRICS},
+        }
+
     def generate_monte(self):
         simulations = self.simulations
-        plt.figure(figsize=(14, 7))
-        plt.plot(simulations.T, color='blue', alpha=0.03)
-        plt.title('Monte Carlo Simulations of Portfolio Value')
-        plt.xlabel('Trading Days')
-        
-         # Save the plot to a BytesIO object
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-
-        # Encode the image as base64
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        buf.close()
-        plt.close()
-
-        # Create a JSON object with the base64 image
-        img_json = {'image': img_base64}
-
-        
-        return img_json
+        return cached_render(self.run_id, 'monte', lambda: render_fan_chart(simulations, 'Monte Carlo Simulations of Portfolio Value'))
 
     def generate_returns_annualized(self):
-        num = 500
         days = 252
         simulations = self.simulations
-        annualized_returns = np.zeros(num)
-        for i in range(num):
-            annualized_returns[i] = (simulations[i, -1] / np.sum([s.start_value for s in self.stocks])) ** (1 / (days / 252)) - 1
-        plt.figure(figsize=(14, 7))
-        plt.hist(annualized_returns, bins=50, color='blue', alpha=0.7)
-        plt.title('Distribution of Annualized Returns')
-        plt.xlabel('Annualized Return')
-        plt.ylabel('Frequency')
-        
-         # Save the plot to a BytesIO object
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-
-        # Encode the image as base64
-        img_base64_1 = base64.b64encode(buf.read()).decode('utf-8')
-        buf.close()
-        plt.close()
-
-        # Create a JSON object with the base64 image
-        img_json1 = {'image': img_base64_1}
-
-        return img_json1
+
+        def render():
+            annualized_returns = (simulations[:, -1] / self.portfolio_value) ** (1 / (days / 252)) - 1
+            return render_histogram(annualized_returns, 'Distribution of Annualized Returns', 'Annualized Return')
+
+        return cached_render(self.run_id, 'returns_annualized', render)
 
     def generate_no_jump(self):
-        stocks = []
-        for ticker, (etf_ticker, shares) in self.stock_dict.items():
-            stocks.append(StockStats(ticker, etf_ticker, self.history_start_date, self.history_end_date, shares, False))
-        
-        # Initialize portfolio simulation matrix (num_simulations x num_days)
-        portfolio_simulations = np.zeros((1000, 252))
-
-        # Simulate each stock and add its contribution to the portfolio
-        for stock in stocks:
-            stock_simulations = stock.monteCarlo(1000,252)
-            portfolio_simulations += stock_simulations  # Sum stock values for portfolio aggregation        
-        
-        plt.figure(figsize=(14, 7))
-        plt.plot(portfolio_simulations.T, color='blue', alpha=0.03)
-        plt.title('Monte Carlo Simulations of Portfolio Value (No Black Swan Events)')
-        plt.xlabel('Trading Days')
-        
-         # Save the plot to a BytesIO object
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-
-        # Encode the image as base64
-        img_base64_2 = base64.b64encode(buf.read()).decode('utf-8')
-        buf.close()
-        plt.close()
-
-        # Create a JSON object with the base64 image
-        img_json2 = {'image': img_base64_2}
-
-        return img_json2
+        def render():
+            portfolio_simulations = self.no_jump_simulations
+            if portfolio_simulations is None:
+                # Reuse the calibrated stocks with the jump term switched off instead of recalibrating
+                portfolio_simulations = self.draw_tensor(1000, 252, jumping=False).sum(axis=0)
+            return render_fan_chart(portfolio_simulations, 'Monte Carlo Simulations of Portfolio Value (No Black Swan Events)')
+
+        return cached_render(self.run_id, 'no_jump', render)
 
     def getStatistics(self, simulations):
         """
         Compute portfolio-level risk statistics.
         """
-        final_values = simulations[:, -1]
-        var_95 = np.percentile(final_values, 5)
-        es_95 = np.mean(final_values[final_values < var_95])
-        max_drawdown = np.max(np.maximum.accumulate(final_values) - final_values)
-        mean = np.mean(final_values)
-        std_dev = np.std(final_values)
-        skewness = stats.skew(final_values)
-        kurtosis = stats.kurtosis(final_values)
-        prob_loss = np.mean(final_values < np.sum([s.start_value for s in self.stocks]))  # Compare to initial portfolio value
-
-        # we want to return the following values in a dict with var_name: value
-        return {
-            'var_95': var_95,
-            'es_95': es_95,
-            'max_drawdown': max_drawdown,
-            'mean': mean,
-            'std_dev': std_dev,
-            'skewness': skewness,
-            'kurtosis': kurtosis,
-            'prob_loss': prob_loss,
-            'inital_portfolio_value': self.portfolio_value
-        }
+        statistics = final_value_statistics(simulations[:, -1], self.portfolio_value)  # Compare to initial portfolio value
+        statistics['inital_portfolio_value'] = self.portfolio_value
+        statistics['path_metrics'] = summarize_path_metrics(path_risk_metrics(simulations))
+        return statistics
@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from upstream import Upstream
+
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".price_store"))
+# Tickers whose history is kept in memory; large portfolios calibrate from one aligned matrix of all their holdings
+PRICE_STORE_MAX_TICKERS = int(os.getenv("PRICE_STORE_MAX_TICKERS", 1024))
+# Seconds before a range whose download came back empty is asked for again
+PRICE_STORE_RETRY_SECONDS = int(os.getenv("PRICE_STORE_RETRY_SECONDS", 300))
+
+# Every Yahoo Finance request; empty answers are retried like errors since yfinance reports most failures that way
+yahoo = Upstream(
+    'yahoo',
+    max_concurrency=int(os.getenv("YAHOO_MAX_CONCURRENCY", 4)),
+    timeout=int(os.getenv("YAHOO_TIMEOUT", 30)),
+    retries=int(os.getenv("YAHOO_RETRIES", 2)),
+    retry_if=lambda data: data is None or getattr(data, 'empty', False),
+)
+
+# yf.download collects its results in module-level state, so concurrent calls from worker threads can mix up tickers
+download_lock = threading.Lock()
+
+
+def _download(tickers, **kwargs):
+    def download():
+        with download_lock:
+            return yf.download(tickers, progress=False, timeout=yahoo.timeout, **kwargs)
+    return yahoo.call(download)
+
+
+def _normalize_index(data):
+    data.index = pd.DatetimeIndex(data.index).tz_localize(None).normalize()
+    return data
+
+
+def _close_column(data):
+    """
+    Pull the Close prices out of a yf.download frame as a Series. Newer yfinance versions return
+    (Price, Ticker) MultiIndex columns even for a single ticker.
+    """
+    close = data['Close']
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return close.dropna()
+
+
+class PriceStore:
+    """
+    Daily close history per ticker, served from an in-memory LRU layer backed by one NPZ file per
+    ticker on disk. Each ticker remembers the contiguous date range it has already fetched, so a
+    request only downloads the parts of its range that fall outside of it.
+    """
+
+    def __init__(self, directory=PRICE_STORE_DIR, max_tickers=PRICE_STORE_MAX_TICKERS, quote_ttl=15 * 60, retry_ttl=PRICE_STORE_RETRY_SECONDS):
+        self.directory = directory
+        self.max_tickers = max_tickers
+        self.quote_ttl = quote_ttl
+        self.retry_ttl = retry_ttl
+        # ticker -> (close Series, covered_start, covered_end), most recently used last
+        self.memory = OrderedDict()
+        # ticker -> (timestamp, last close)
+        self.quotes = {}
+        # (ticker, start, end) -> timestamp of a download that came back empty, see _fetch_missing
+        self.failed_fetches = {}
+        self.lock = threading.Lock()
+        self.ticker_locks = {}
+
+    def _ticker_lock(self, ticker):
+        with self.lock:
+            return self.ticker_locks.setdefault(ticker, threading.Lock())
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', ticker) + '.npz')
+
+    def _load(self, ticker):
+        with self.lock:
+            if ticker in self.memory:
+                self.memory.move_to_end(ticker)
+                return self.memory[ticker]
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            close = pd.Series(data['close'], index=pd.DatetimeIndex(data['dates'].astype('datetime64[D]')), name='Close')
+            covered = data['covered'].astype('datetime64[D]')
+        if not len(close):
+            # Written by an older version that stored failed downloads as covered; fetch it again
+            return None
+        entry = (close, pd.Timestamp(covered[0]), pd.Timestamp(covered[1]))
+        self._remember(ticker, entry)
+        return entry
+
+    def _remember(self, ticker, entry):
+        with self.lock:
+            self.memory[ticker] = entry
+            self.memory.move_to_end(ticker)
+            while len(self.memory) > self.max_tickers:
+                self.memory.popitem(last=False)
+
+    def _save(self, ticker, entry):
+        close, covered_start, covered_end = entry
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(ticker)
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            dates=close.index.values.astype('datetime64[D]').astype('int64'),
+            close=close.values.astype(float),
+            covered=np.array([covered_start, covered_end], dtype='datetime64[D]').astype('int64'),
+        )
+        os.replace(tmp_path, path)
+
+    def _fetch(self, ticker, start, end):
+        if end <= start:
+            return pd.Series(dtype=float, name='Close')
+        data = _download(ticker, start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'))
+        if data is None or data.empty:
+            return pd.Series(dtype=float, name='Close')
+        return _normalize_index(_close_column(data)).rename('Close')
+
+    def _fetch_missing(self, ticker, start, end):
+        """
+        _fetch for a range the store does not cover yet. yfinance reports most failures as an empty answer,
+        so an empty range is never marked as covered; it is only remembered for retry_ttl seconds so that
+        repeated requests do not hammer Yahoo, then downloaded again.
+        """
+        key = (ticker, start, end)
+        now = time.time()
+        with self.lock:
+            failed_at = self.failed_fetches.get(key)
+        if failed_at is not None and now - failed_at < self.retry_ttl:
+            return pd.Series(dtype=float, name='Close')
+        close = self._fetch(ticker, start, end)
+        with self.lock:
+            if len(close):
+                self.failed_fetches.pop(key, None)
+            else:
+                self.failed_fetches = {k: t for k, t in self.failed_fetches.items() if now - t < self.retry_ttl}
+                self.failed_fetches[key] = now
+        return close
+
+    def store(self, ticker, close, start, end):
+        """
+        Merge already downloaded close prices for [start, end) into the store (used by bulk prefetches).
+        An empty close marks nothing as covered.
+        """
+        if not len(close):
+            return
+        start, end = pd.Timestamp(start), min(pd.Timestamp(end), pd.Timestamp.today().normalize())
+        with self._ticker_lock(ticker):
+            entry = self._load(ticker)
+            self._merge(ticker, entry, [close], start, end)
+
+    def _merge(self, ticker, entry, pieces, start, end):
+        if entry is not None:
+            close, covered_start, covered_end = entry
+            pieces = [close] + pieces
+            start, end = min(start, covered_start), max(end, covered_end)
+        close = pd.concat([p for p in pieces if len(p)]) if any(len(p) for p in pieces) else pd.Series(dtype=float, name='Close')
+        close = close[~close.index.duplicated(keep='last')].sort_index()
+        entry = (close, start, end)
+        self._remember(ticker, entry)
+        self._save(ticker, entry)
+        return entry
+
+    def get_history(self, ticker, start, end):
+        """
+        Daily close history of ticker for [start, end) as a DataFrame with a 'Close' column, like
+        yf.download. Only the parts of the range that were never fetched before hit the network.
+        """
+        return self.get_closes(ticker, start, end).to_frame('Close')
+
+    def get_closes(self, ticker, start, end):
+        """
+        Daily closes of ticker for [start, end) as a Series, see get_history.
+        """
+        start = pd.Timestamp(start)
+        # Days from today onwards may still change, so they are never marked as covered
+        fetch_end = min(pd.Timestamp(end), pd.Timestamp.today().normalize())
+        with self._ticker_lock(ticker):
+            entry = self._load(ticker)
+            if entry is None:
+                close = self._fetch_missing(ticker, start, fetch_end) if fetch_end > start else pd.Series(dtype=float, name='Close')
+                if not len(close):
+                    return close
+                entry = self._merge(ticker, None, [close], start, fetch_end)
+            else:
+                close, covered_start, covered_end = entry
+                # Only the sides that came back with prices extend the covered range
+                missing = []
+                if start < covered_start:
+                    piece = self._fetch_missing(ticker, start, covered_start)
+                    if len(piece):
+                        missing.append(piece)
+                        covered_start = start
+                if fetch_end > covered_end:
+                    piece = self._fetch_missing(ticker, covered_end, fetch_end)
+                    if len(piece):
+                        missing.append(piece)
+                        covered_end = fetch_end
+                if missing:
+                    entry = self._merge(ticker, entry, missing, covered_start, covered_end)
+        close = entry[0]
+        # The stored closes are sorted by date
+        return close.iloc[close.index.searchsorted(start):close.index.searchsorted(pd.Timestamp(end))]
+
+    def prefetch(self, tickers, start, end):
+        """
+        Bulk-load the [start, end) history of many tickers with multi-ticker downloads instead of one
+        request per ticker. Tickers that are already covered are skipped; tickers that need the same
+        missing range share one download. Tickers the download did not return are left for
+        get_history to retry on their own.
+        """
+        start = pd.Timestamp(start)
+        fetch_end = min(pd.Timestamp(end), pd.Timestamp.today().normalize())
+        if fetch_end <= start:
+            return
+        groups = {}
+        for ticker in dict.fromkeys(tickers):
+            entry = self._load(ticker)
+            if entry is None:
+                groups.setdefault((start, fetch_end), []).append(ticker)
+                continue
+            covered_start, covered_end = entry[1], entry[2]
+            if start >= covered_start and fetch_end <= covered_end:
+                continue
+            # Fetch a range that touches the covered one, so the coverage stays contiguous
+            missing_start = start if start < covered_start else covered_end
+            missing_end = fetch_end if fetch_end > covered_end else covered_start
+            groups.setdefault((missing_start, missing_end), []).append(ticker)
+
+        for (missing_start, missing_end), group in groups.items():
+            data = _download(group, start=missing_start.strftime('%Y-%m-%d'), end=missing_end.strftime('%Y-%m-%d'))
+            if data is None or data.empty:
+                continue
+            close = data['Close']
+            if isinstance(close, pd.Series):
+                close = close.to_frame(group[0])
+            close = _normalize_index(close)
+            for ticker in group:
+                if ticker in close.columns and close[ticker].notna().any():
+                    self.store(ticker, close[ticker].dropna().rename('Close'), missing_start, missing_end)
+
+    def prefetch_last_close(self, tickers):
+        """
+        Fill the last-close cache for many tickers with a single download, skipping fresh quotes.
+        """
+        now = time.time()
+        with self.lock:
+            tickers = [ticker for ticker in dict.fromkeys(tickers)
+                       if ticker not in self.quotes or now - self.quotes[ticker][0] >= self.quote_ttl]
+        if not tickers:
+            return
+        data = _download(tickers, period='5d')
+        if data is None or data.empty:
+            return
+        close = data['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(tickers[0])
+        now = time.time()
+        with self.lock:
+            for ticker in tickers:
+                if ticker in close.columns and close[ticker].notna().any():
+                    self.quotes[ticker] = (now, close[ticker].dropna().iloc[-1])
+
+    def store_last_close(self, ticker, last_close):
+        with self.lock:
+            self.quotes[ticker] = (time.time(), last_close)
+
+    def get_last_close(self, ticker):
+        """
+        Most recent close of ticker, cached in memory for quote_ttl seconds.
+        """
+        with self.lock:
+            quote = self.quotes.get(ticker)
+        if quote is not None and time.time() - quote[0] < self.quote_ttl:
+            return quote[1]
+        last_close = yahoo.call(lambda: yf.Ticker(ticker).history(period='1d', timeout=yahoo.timeout))['Close'].iloc[0]
+        with self.lock:
+            self.quotes[ticker] = (time.time(), last_close)
+        return last_close
+
+
+price_store = PriceStore()
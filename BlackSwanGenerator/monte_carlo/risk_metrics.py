@@ -0,0 +1,156 @@
+import numpy as np
+
+# Per-path metrics summarized by summarize_path_metrics
+PATH_METRICS = ('max_drawdown', 'max_drawdown_pct', 'drawdown_duration', 'time_to_trough', 'recovery_time', 'path_min')
+
+
+def path_risk_metrics(simulations):
+    """
+    Per-path risk metrics of a (num_simulations, num_days) matrix of simulated values, computed with a few
+    axis-wise passes instead of a loop over paths. Returns a dict of arrays with one value per path:
+    max_drawdown: largest drop from a running peak, in value units (max_drawdown_pct: as a fraction of that peak)
+    time_to_trough: days from the peak to the trough of the largest drawdown
+    recovery_time: days from that trough until the path is back at the peak, NaN if it never recovers
+    drawdown_duration: days from the peak until recovery, or until the last day when it never recovers
+    path_min: lowest value of the path
+    """
+    simulations = np.asarray(simulations, dtype=float)
+    num_days = simulations.shape[1]
+    rows = np.arange(len(simulations))
+    days = np.arange(num_days)
+
+    running_peak = np.maximum.accumulate(simulations, axis=1)
+    drawdowns = running_peak - simulations
+    trough_day = drawdowns.argmax(axis=1)
+    max_drawdown = drawdowns[rows, trough_day]
+    peak_value = running_peak[rows, trough_day]
+
+    # Day on which each running peak was set, then the one in force at the trough
+    peak_days = np.maximum.accumulate(np.where(simulations >= running_peak, days, 0), axis=1)
+    peak_day = peak_days[rows, trough_day]
+
+    recovered = (days > trough_day[:, None]) & (simulations >= peak_value[:, None])
+    has_recovered = recovered.any(axis=1) & (max_drawdown > 0)
+    recovery_day = np.where(has_recovered, recovered.argmax(axis=1), num_days - 1)
+
+    return {
+        'max_drawdown': max_drawdown,
+        'max_drawdown_pct': np.divide(max_drawdown, peak_value, out=np.zeros_like(max_drawdown), where=peak_value != 0),
+        'drawdown_duration': np.where(max_drawdown > 0, recovery_day - peak_day, 0),
+        'time_to_trough': trough_day - peak_day,
+        'recovery_time': np.where(has_recovered, recovery_day - trough_day, np.nan),
+        'path_min': simulations.min(axis=1),
+    }
+
+
+def summarize_path_metrics(metrics):
+    """
+    Distribution summary of path_risk_metrics output (mean and 5th/50th/95th percentiles of every metric),
+    plus the 95% VaR/ES of the path minimum and the share of drawn-down paths that recover.
+    """
+    summary = {}
+    for name in PATH_METRICS:
+        values = metrics[name]
+        finite = values[np.isfinite(values)]
+        if len(finite) == 0:
+            summary[name] = {'mean': np.nan, 'p5': np.nan, 'p50': np.nan, 'p95': np.nan}
+            continue
+        p5, p50, p95 = np.percentile(finite, [5, 50, 95])
+        summary[name] = {'mean': np.mean(finite), 'p5': p5, 'p50': p50, 'p95': p95}
+
+    path_min = metrics['path_min']
+    var_min_95 = np.percentile(path_min, 5)
+    summary['path_min_var_95'] = var_min_95
+    summary['path_min_es_95'] = np.mean(path_min[path_min <= var_min_95])
+    drawn_down = metrics['max_drawdown'] > 0
+    summary['recovery_rate'] = np.mean(np.isfinite(metrics['recovery_time'][drawn_down])) if drawn_down.any() else 1.0
+    return summary
+
+
+class PathMetricsAccumulator:
+    """
+    Streaming counterpart of path_risk_metrics: reduces each chunk of complete paths to its per-path
+    metrics as it arrives and only keeps those (a handful of values per path).
+    With sketch_size, memory stays flat in the path count instead: the means and the recovery rate are
+    exact running sums, and the percentiles and path minimum VaR/ES come from a uniform reservoir sample of
+    sketch_size paths (see update_reservoir).
+    """
+
+    def __init__(self, sketch_size=None, rng=None):
+        self.sketch_size = sketch_size
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.chunks = []
+        self.count = 0
+        # Running sum and count of the finite values of every metric, paths drawn down and recovered
+        self.sums = dict.fromkeys(PATH_METRICS, 0.0)
+        self.finite_counts = dict.fromkeys(PATH_METRICS, 0)
+        self.drawn_down = 0
+        self.recovered = 0
+        # (paths, PATH_METRICS) reservoir sample
+        self.sample = np.empty((0, len(PATH_METRICS)))
+
+    def update(self, simulations):
+        self.add(path_risk_metrics(simulations))
+
+    def add(self, metrics):
+        """Add the path_risk_metrics of a chunk reduced elsewhere (e.g. in a simulate_shard worker)."""
+        if self.sketch_size is None:
+            self.chunks.append(metrics)
+            return
+        for name in PATH_METRICS:
+            finite = metrics[name][np.isfinite(metrics[name])]
+            self.sums[name] += finite.sum()
+            self.finite_counts[name] += len(finite)
+        drawn_down = metrics['max_drawdown'] > 0
+        self.drawn_down += int(drawn_down.sum())
+        self.recovered += int(np.isfinite(metrics['recovery_time'][drawn_down]).sum())
+        rows = np.column_stack([metrics[name] for name in PATH_METRICS])
+        self.sample = update_reservoir(self.sample, rows, self.count, self.sketch_size, self.rng)
+        self.count += len(rows)
+
+    def result(self):
+        if self.sketch_size is None:
+            metrics = {name: np.concatenate([chunk[name] for chunk in self.chunks]) for name in PATH_METRICS}
+            return summarize_path_metrics(metrics)
+        summary = summarize_path_metrics({name: self.sample[:, i] for i, name in enumerate(PATH_METRICS)})
+        for name in PATH_METRICS:
+            if self.finite_counts[name]:
+                summary[name]['mean'] = self.sums[name] / self.finite_counts[name]
+        summary['recovery_rate'] = self.recovered / self.drawn_down if self.drawn_down else 1.0
+        return summary
+
+
+def update_reservoir(sample, values, seen, sketch_size, rng):
+    """
+    Reservoir sampling (algorithm R) of one chunk of values (or of rows), vectorized: value number i replaces
+    a random slot when a uniform draw from [0, i] falls inside the reservoir. seen: values offered before this
+    chunk. Returns the updated sample.
+    """
+    free = max(0, sketch_size - len(sample))
+    sample = np.concatenate([sample, values[:free]])
+    rest = values[free:]
+    if len(rest) == 0:
+        return sample
+    positions = rng.integers(0, np.arange(seen + free, seen + free + len(rest)) + 1)
+    keep = positions < sketch_size
+    sample[positions[keep]] = rest[keep]
+    return sample
+
+
+def tail_standard_errors(final_values, var, es, tail=0.05, z=1.96):
+    """
+    Standard errors of the VaR and ES estimates at the tail probability tail, treating the final values as
+    independent draws (usually conservative for antithetic or Sobol paths). VaR: from the distribution-free
+    order-statistic confidence interval of the quantile. ES: from its asymptotic variance
+    (Var(X | X < VaR) + (1 - tail) * (VaR - ES)^2) / (n * tail).
+    """
+    values = np.sort(np.asarray(final_values, dtype=float))
+    n = len(values)
+    half_width = z * np.sqrt(n * tail * (1 - tail))
+    lower = values[max(int(np.floor(n * tail - half_width)), 0)]
+    upper = values[min(int(np.ceil(n * tail + half_width)), n - 1)]
+    tail_values = values[values < var]
+    if len(tail_values) < 2:
+        return (upper - lower) / (2 * z), np.nan
+    es_variance = (np.var(tail_values) + (1 - tail) * (var - es) ** 2) / (n * tail)
+    return (upper - lower) / (2 * z), np.sqrt(es_variance)
@@ -0,0 +1,40 @@
+import warnings
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+
+# How the diffusion shocks are drawn, see standard_normals
+SAMPLING_METHODS = ('pseudo', 'antithetic', 'sobol')
+
+
+def standard_normals(count, num_simulations, num_steps, method='pseudo', rng=None):
+    """
+    (count, num_simulations, num_steps) standard normal shocks, one row of paths per shock source.
+    pseudo: plain draws from rng.
+    antithetic: the second half of the paths are the negated first half, so every path has a mirror image
+    (path i pairs with path i + ceil(num_simulations / 2)).
+    sobol: scrambled Sobol points mapped through the normal inverse CDF, one dimension per (source, step).
+    Dimensions beyond what a Sobol engine supports go to further engines with independent scrambles.
+    Balance is best when num_simulations is a power of two.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if method == 'pseudo':
+        return rng.normal(size=(count, num_simulations, num_steps))
+    if method == 'antithetic':
+        half = rng.normal(size=(count, (num_simulations + 1) // 2, num_steps))
+        return np.concatenate([half, -half], axis=1)[:, :num_simulations]
+    if method != 'sobol':
+        raise ValueError(f"Unknown sampling method {method}, expected one of {SAMPLING_METHODS}")
+
+    dimensions = count * num_steps
+    uniforms = np.empty((num_simulations, dimensions))
+    with warnings.catch_warnings():
+        # Chunks are rarely a power of two; the points are still well spread
+        warnings.simplefilter('ignore', UserWarning)
+        for start in range(0, dimensions, qmc.Sobol.MAXDIM):
+            stop = min(start + qmc.Sobol.MAXDIM, dimensions)
+            uniforms[:, start:stop] = qmc.Sobol(stop - start, scramble=True, seed=rng).random(num_simulations)
+    # Scrambled points are never exactly 0 or 1 in practice, but keep the inverse CDF finite regardless
+    np.clip(uniforms, 1e-12, 1 - 1e-12, out=uniforms)
+    normals = stats.norm.ppf(uniforms)
+    return normals.reshape(num_simulations, count, num_steps).transpose(1, 0, 2)
@@ -1,12 +1,176 @@
 import numpy as np
-import yfinance as yf
-import pandas as pd
-import statsmodels.api as sm
 from scipy import stats
 import matplotlib.pyplot as plt
+from .price_store import price_store
+from .calibration import log_return_matrix, factor_params, jump_params, CALIBRATION_START, CALIBRATION_END
+from .streaming import StreamingStatistics
+from .risk_metrics import path_risk_metrics, summarize_path_metrics, tail_standard_errors, PathMetricsAccumulator
+import metrics
+
+
+def draw_jumps(lambda_jump, mu_J, sigma_J, dt, size, rng=None):
+    """
+    Compound Poisson jumps for every cell of an array of shape size. The jump parameters may be
+    scalars or arrays that broadcast against size (e.g. one row of parameters per stock).
+    The sum of N normal jump magnitudes is itself normal, N(N * mu_J, N * sigma_J^2),
+    so each cell that jumps only needs one extra normal draw instead of N of them.
+    rng: a np.random.Generator, defaults to the global np.random state.
+    """
+    rng = np.random if rng is None else rng
+    N_T = rng.poisson(np.broadcast_to(np.asarray(lambda_jump) * dt, size))
+    jumped = N_T > 0
+    J_T = np.zeros(size)
+    if jumped.any():
+        counts = N_T[jumped]
+        mu_J = np.broadcast_to(mu_J, size)[jumped]
+        sigma_J = np.nan_to_num(np.broadcast_to(sigma_J, size)[jumped])
+        J_T[jumped] = counts * mu_J + np.sqrt(counts) * sigma_J * rng.normal(size=counts.shape)
+    return J_T
+
+
+def draw_tilted_jumps(lambda_jump, mu_J, sigma_J, dt, size, intensity_tilt=2.0, size_shift=0.5, tilted=True, rng=None):
+    """
+    Importance-sampling version of draw_jumps. In the tilted model jumps arrive intensity_tilt times more
+    often and their sizes are shifted by size_shift jump standard deviations towards losses, so that far more
+    paths reach the deep tail. intensity_tilt and size_shift may be arrays that broadcast against size (e.g. one
+    per stock). tilted (broadcast against size, e.g. one flag per path) picks the cells drawn from the tilted
+    model; the others are drawn from the original one.
+    Returns the jumps and, for every cell, the log of the likelihood ratio of the original model to the
+    tilted one at the drawn values (see defensive_log_weights for turning them into path weights).
+    """
+    rng = np.random if rng is None else rng
+    rates = np.broadcast_to(np.nan_to_num(np.asarray(lambda_jump, dtype=float)) * dt, size)
+    tilted = np.broadcast_to(tilted, size)
+    N_T = rng.poisson(np.where(tilted, rates * intensity_tilt, rates))
+    # Poisson counts: P(N) / Q(N) = exp((tilt - 1) * rate) * tilt^-N, 1 for cells that cannot jump
+    log_ratios = rates * (intensity_tilt - 1) - N_T * np.log(intensity_tilt)
+    jumped = N_T > 0
+    J_T = np.zeros(size)
+    if jumped.any():
+        counts = N_T[jumped]
+        mu_J = np.nan_to_num(np.broadcast_to(mu_J, size)[jumped])
+        sigma_J = np.nan_to_num(np.broadcast_to(sigma_J, size)[jumped])
+        shift = np.where(sigma_J > 0, np.broadcast_to(size_shift, size)[jumped], 0.0)
+        drawn_shift = np.where(tilted[jumped], shift, 0.0)
+        z = rng.normal(size=counts.shape)
+        J_T[jumped] = counts * (mu_J - drawn_shift * sigma_J) + np.sqrt(counts) * sigma_J * z
+        # The sum of N jump sizes is N(N mu_J, N sigma_J^2) in the model and has its mean moved by
+        # -N shift sigma_J in the tilt; residual is the standardized sum under the model
+        residual = z - np.sqrt(counts) * drawn_shift
+        log_ratios[jumped] += np.sqrt(counts) * shift * residual + counts * shift ** 2 / 2
+    return J_T, log_ratios
+
+
+def shock_shifts(exposures, num_steps, shift):
+    """
+    Daily mean shifts of independent standard normal shocks that lower a return made of them (exposures: the
+    loading of each shock in one day's return) by shift standard deviations over num_steps days. The shifts
+    point along the exposures, the smallest move that does it, so the likelihood ratio of the shifted shocks
+    has the least variance (its second moment is exp(shift^2)).
+    """
+    exposures = np.asarray(exposures, dtype=float)
+    norm = np.sqrt(num_steps * np.sum(exposures ** 2))
+    return shift * exposures / norm if norm > 0 else np.zeros_like(exposures)
+
+
+def defensive_log_weights(log_ratios, tail_fraction):
+    """
+    Log likelihood-ratio weights of paths drawn from the tilted model with probability tail_fraction and from
+    the original one otherwise (defensive importance sampling): 1 / (tail_fraction * Q/P + 1 - tail_fraction),
+    with log_ratios the per-path log P/Q. The weights never exceed 1 / (1 - tail_fraction), so a strong tilt
+    cannot let a few paths dominate the estimates.
+    """
+    return -np.logaddexp(np.log(tail_fraction) - log_ratios, np.log1p(-tail_fraction))
+
+
+def cumulative_paths(log_returns):
+    """
+    Turns daily log-returns of shape (..., num_days - 1) into growth factors of shape (..., num_days)
+    whose first day is 1.
+    """
+    log_paths = np.zeros(log_returns.shape[:-1] + (log_returns.shape[-1] + 1,))
+    np.cumsum(log_returns, axis=-1, out=log_paths[..., 1:])
+    return np.exp(log_paths)
+
+
+def final_value_statistics(final_values, initial_value):
+    """
+    Risk statistics of the simulated final values: Value at Risk, Expected Shortfall, Maximum Drawdown,
+    Mean and Standard Deviation, Skewness and Kurtosis, and the Probability of ending below initial_value.
+    """
+    var_95 = np.percentile(final_values, 5)
+    es_95 = np.mean(final_values[final_values < var_95])
+    var_95_se, es_95_se = tail_standard_errors(final_values, var_95, es_95)
+    max_drawdown = np.max(np.maximum.accumulate(final_values) - final_values)
+    mean = np.mean(final_values)
+    std_dev = np.std(final_values)
+    skewness = stats.skew(final_values)
+    kurtosis = stats.kurtosis(final_values)
+    prob_loss = np.mean(final_values < initial_value)
+    # we want to return a dictionary of these values with var_name:valeue
+    return {
+        'var_95': var_95,
+        'es_95': es_95,
+        'var_95_se': var_95_se,
+        'es_95_se': es_95_se,
+        'max_drawdown': max_drawdown,
+        'mean': mean,
+        'std_dev': std_dev,
+        'skewness': skewness,
+        'kurtosis': kurtosis,
+        'prob_loss': prob_loss,
+    }
+
+
+def weighted_tail_statistics(final_values, log_weights, initial_value, levels=(99, 99.9)):
+    """
+    VaR and ES of importance-sampled final values at each confidence level (in percent, e.g. var_999 for
+    99.9): the quantiles and tail means of the distribution given by the self-normalized likelihood-ratio
+    weights exp(log_weights). Also the weighted probability of loss and the effective sample size
+    (sum of weights)^2 / sum of squared weights, which falls as the weights get more uneven.
+    """
+    final_values = np.asarray(final_values, dtype=float)
+    weights = np.exp(log_weights - np.max(log_weights))
+    order = np.argsort(final_values)
+    values = final_values[order]
+    probabilities = weights[order] / weights.sum()
+    cumulative = np.cumsum(probabilities)
+    statistics = {}
+    for level in levels:
+        name = str(level).replace('.', '')
+        index = min(int(np.searchsorted(cumulative, 1 - level / 100)), len(values) - 1)
+        statistics[f'var_{name}'] = values[index]
+        statistics[f'es_{name}'] = np.sum(probabilities[:index + 1] * values[:index + 1]) / cumulative[index]
+        statistics[f'tail_paths_{name}'] = index + 1
+    statistics['prob_loss'] = np.sum(probabilities[values < initial_value])
+    statistics['effective_sample_size'] = weights.sum() ** 2 / np.sum(weights ** 2)
+    statistics['num_simulations'] = len(values)
+    return statistics
+
+
+def window_jump_params(etf_ticker, start_date, end_date):
+    """
+    Jump intensity (per year), mean and standard deviation of the jumps of etf_ticker between start_date and
+    end_date: the daily log-returns more than two standard deviations below the mean count as jumps.
+    """
+    returns, price_counts, failed = log_return_matrix([etf_ticker], start_date, end_date)
+    if failed:
+        raise ValueError(failed[etf_ticker])
+    if price_counts[etf_ticker] < 2:
+        raise ValueError(f"No price history for {etf_ticker} between {start_date} and {end_date}")
+    return jump_params(returns, price_counts).loc[etf_ticker].to_dict()
+
+
+# Calibrated model parameters of a StockStats, everything the simulation needs
+PARAM_NAMES = ('start_value', 'beta', 'mu_ETF', 'sig_ETF', 'sig_S', 'sig_idio', 'lambda_jump', 'mu_J', 'sigma_J')
+
 
 class StockStats:
-    def __init__(self, ticker, ETF_ticker, history_start_date, history_end_date, shares, jumping=True):
+    def __init__(self, ticker, ETF_ticker, history_start_date, history_end_date, shares, jumping=True, params=None):
+        """
+        params: optional dict of already calibrated parameters (see PARAM_NAMES, get_params).
+        When given, no data is downloaded and nothing is refitted.
+        """
         self.start_date = history_start_date
         self.end_date = history_end_date
         self.ticker = ticker
@@ -19,64 +183,59 @@ class StockStats:
         self.sig_S = None
         self.sig_idio = None
         self.dt = 1 / 252
-        self.calculate_statistics()
         self.lambda_jump = None
         self.mu_J = None
         self.sigma_J = None
-        self.estimate_jump_params()
+        if params is None:
+            self.calibrate()
+        else:
+            self.set_params(params)
         # We want to store the simulations as a 2d numpy array
         self.simulations = None
+        self.no_jump_simulations = None
         self.jumping = jumping
         self.statistics = {}
+        # Deep-tail statistics of the last monteCarloImportance run
+        self.tail_statistics = {}
 
-    def calculate_statistics(self):
-        # Assign the start value of the stock
-        self.start_value = yf.Ticker(self.ticker).history(period='1d')['Close'][0] * self.shares
-
-        start_date = "2018-01-01"
-        end_date = "2024-01-01"
+    def calibrate(self):
+        with metrics.timed('stock_calibration'):
+            self.calculate_statistics()
+            self.estimate_jump_params()
 
-        stock_hist = yf.download(self.ticker, start=start_date, end=end_date)
-        stock_hist['LogReturn'] = np.log(stock_hist['Close'] / stock_hist['Close'].shift(1))
-        stock_hist = stock_hist.dropna()
-        self.sig_S = np.std(stock_hist['LogReturn']) * (252 ** 0.5)
+    def get_params(self):
+        return {name: getattr(self, name) for name in PARAM_NAMES}
 
-        etf_hist = yf.download(self.ETF, start=start_date, end=end_date)
-        etf_hist['LogReturn'] = np.log(etf_hist['Close'] / etf_hist['Close'].shift(1))
-        etf_hist = etf_hist.dropna()
-        self.mu_ETF = np.mean(etf_hist['LogReturn']) * 252
-        self.sig_ETF = np.std(etf_hist['LogReturn']) * (252 ** 0.5)
+    def set_params(self, params):
+        for name in PARAM_NAMES:
+            setattr(self, name, params[name])
 
-        # Merge
-        merged_df = pd.merge(stock_hist['LogReturn'], etf_hist['LogReturn'], left_index=True, right_index=True, suffixes=('_stock', '_etf'))
-        merged_df = merged_df.dropna()
+    def with_jumping(self, jumping):
+        """
+        A copy of this stock driven by the same calibrated parameters, with jumps switched on or off.
+        """
+        return StockStats(self.ticker, self.ETF, self.start_date, self.end_date, self.shares, jumping, self.get_params())
 
-        merged_df.columns = ['LogReturn_stock', 'LogReturn_etf']
+    def calculate_statistics(self):
+        # Assign the start value of the stock
+        self.start_value = price_store.get_last_close(self.ticker) * self.shares
 
-        X = merged_df['LogReturn_etf']
-        y = merged_df['LogReturn_stock']
-        X = sm.add_constant(X)
-        model = sm.OLS(y, X).fit()
-        
-        self.beta = model.params['LogReturn_etf']
-        self.sig_idio = np.sqrt(self.sig_S ** 2 - self.beta ** 2 * self.sig_ETF ** 2)
+        returns, _, failed = log_return_matrix([self.ticker, self.ETF], CALIBRATION_START, CALIBRATION_END)
+        if failed:
+            raise ValueError(f"Could not load {', '.join(failed)}: {'; '.join(failed.values())}")
+        # Same closed-form fit as a batched calibration of the whole portfolio (see calibrate_portfolio)
+        params = factor_params(returns, returns, {self.ticker: self.ETF}).loc[self.ticker]
+        self.sig_S = params['sig_S']
+        self.mu_ETF = params['mu_ETF']
+        self.sig_ETF = params['sig_ETF']
+        self.beta = params['beta']
+        self.sig_idio = params['sig_idio']
 
     def estimate_jump_params(self):
-        jump_thresholds = 2  # 1% quantile for a normal distribution
-        
-        etf_hist = yf.download(self.ETF, start=self.start_date, end=self.end_date)
-        etf_hist['LogReturn'] = np.log(etf_hist['Close'] / etf_hist["Close"].shift(1)).dropna()
-        mean_ret = etf_hist['LogReturn'].mean()
-        std_ret = etf_hist['LogReturn'].std()
-        jump_cutoff = mean_ret - jump_thresholds * std_ret
-
-        jump_events = etf_hist[etf_hist['LogReturn'] < jump_cutoff]['LogReturn']
-
-        period_years = len(etf_hist) / 200
-
-        self.lambda_jump = len(jump_events) / period_years
-        self.mu_J = jump_events.mean()
-        self.sigma_J = jump_events.std()
+        params = window_jump_params(self.ETF, self.start_date, self.end_date)
+        self.lambda_jump = params['lambda_jump']
+        self.mu_J = params['mu_J']
+        self.sigma_J = params['sigma_J']
 
     def calculateDrift(self):
         return (self.mu_ETF * self.beta - 0.5 * (self.beta ** 2 * self.sig_ETF ** 2 + self.sig_idio ** 2)) * self.dt
@@ -98,16 +257,40 @@ class StockStats:
             J_T = 0
         return J_T
     
+    def calculateJumps(self, size, rng=None):
+        """
+        Vectorized calculateJump: draws the jumps for every path and day at once.
+        """
+        if not self.jumping:
+            return np.zeros(size)
+        return draw_jumps(self.lambda_jump, self.mu_J, self.sigma_J, self.dt, size, rng)
+
+    def simulatePaths(self, num_simulations, num_days, factor_shocks=None, with_no_jump=False, rng=None):
+        """
+        Batched jump-diffusion engine. Draws the full (num_simulations, num_days - 1) matrices of
+        systematic and idiosyncratic shocks and jumps in one go, then builds the prices with a
+        cumulative sum of log-returns. Day 0 of every path is the start value, as in simulate.
+        factor_shocks: optional standard normal ETF shocks of shape (num_simulations, num_days - 1),
+        so that stocks mapped to the same ETF can share them.
+        with_no_jump: also return the no-jump paths built from the same diffusion draws with the
+        jump term left out (common random numbers), as a (paths, no_jump_paths) tuple.
+        rng: a np.random.Generator, defaults to the global np.random state.
+        """
+        rng = np.random if rng is None else rng
+        steps = (num_simulations, num_days - 1)
+        if factor_shocks is None:
+            factor_shocks = rng.normal(size=steps)
+        drift = self.calculateDrift()
+        systematic_volatility = self.beta * self.sig_ETF * (self.dt ** 0.5) * factor_shocks
+        idiosyncratic_volatility = self.sig_idio * (self.dt ** 0.5) * rng.normal(size=steps)
+        diffusion = drift + systematic_volatility + idiosyncratic_volatility
+        paths = self.start_value * cumulative_paths(diffusion + self.calculateJumps(steps, rng))
+        if with_no_jump:
+            return paths, self.start_value * cumulative_paths(diffusion)
+        return paths
+
     def simulate(self, num_days):
-        S = np.zeros(num_days)
-        S[0] = self.start_value
-        for i in range(1, num_days):
-            drift = self.calculateDrift()
-            systematic_volatility = self.calculateSystematicVolatility()
-            idiosyncratic_volatility = self.calculateIdiosyncraticVolatility()
-            jump = self.calculateJump()
-            S[i] = S[i - 1] * np.exp(drift + systematic_volatility + idiosyncratic_volatility + jump)
-        return S
+        return self.simulatePaths(1, num_days)[0]
     
     def getStatistics(self):
         """
@@ -115,35 +298,60 @@ class StockStats:
         simulations is an array of shape (num_simulations, num_days), where each row is a simulation of stock prices over num_days days.
         """
         simulations = self.simulations
-        print(simulations)
-        final_values = simulations[:, -1]
-        var_95 = np.percentile(final_values, 5)
-        es_95 = np.mean(final_values[final_values < var_95])
-        max_drawdown = np.max(np.maximum.accumulate(final_values) - final_values)
-        mean = np.mean(final_values)
-        std_dev = np.std(final_values)
-        skewness = stats.skew(final_values)
-        kurtosis = stats.kurtosis(final_values)
-        prob_loss = np.mean(final_values < self.start_value)
-        # we want to return a dictionary of these values with var_name:valeue
-        return {
-            'var_95': var_95,
-            'es_95': es_95,
-            'max_drawdown': max_drawdown,
-            'mean': mean,
-            'std_dev': std_dev,
-            'skewness': skewness,
-            'kurtosis': kurtosis,
-            'prob_loss': prob_loss,
-            'initial_value': self.start_value
-        }
+        statistics = final_value_statistics(simulations[:, -1], self.start_value)
+        statistics['initial_value'] = self.start_value
+        statistics['path_metrics'] = summarize_path_metrics(path_risk_metrics(simulations))
+        return statistics
 
-    
-    def monteCarlo(self, num_simulations, num_days):
-        simulations = np.zeros((num_simulations, num_days))
-        # Store the first 20 simulations for later plotting
-        for i in range(num_simulations):
-            simulations[i] = self.simulate(num_days)
-        self.simulations = simulations
+    def monteCarlo(self, num_simulations, num_days, with_no_jump=False):
+        if with_no_jump:
+            self.simulations, self.no_jump_simulations = self.simulatePaths(num_simulations, num_days, with_no_jump=True)
+        else:
+            self.simulations = self.simulatePaths(num_simulations, num_days)
         self.statistics = self.getStatistics()
-        return self.simulations
\ No newline at end of file
+        return self.simulations
+
+    def monteCarloStreaming(self, num_simulations, num_days, chunk_size=1000, exact=True, sketch_size=10000, seed=None):
+        """
+        Bounded-memory monteCarlo: simulates chunk_size paths at a time and only keeps what the statistics
+        need (see StreamingStatistics). self.simulations is not kept.
+        """
+        seed_sequence = np.random.SeedSequence(seed)
+        chunk_seeds = seed_sequence.spawn((num_simulations + chunk_size - 1) // chunk_size + 1)
+        statistics = StreamingStatistics(self.start_value, exact, sketch_size, np.random.default_rng(chunk_seeds[-1]))
+        path_metrics = PathMetricsAccumulator()
+        for start, chunk_seed in zip(range(0, num_simulations, chunk_size), chunk_seeds):
+            size = min(chunk_size, num_simulations - start)
+            simulations = self.simulatePaths(size, num_days, rng=np.random.default_rng(chunk_seed))
+            statistics.update(simulations[:, -1])
+            path_metrics.update(simulations)
+        self.simulations = None
+        self.statistics = statistics.result()
+        self.statistics['initial_value'] = self.start_value
+        self.statistics['path_metrics'] = path_metrics.result()
+        return self.statistics
+
+    def monteCarloImportance(self, num_simulations, num_days, intensity_tilt=2.0, size_shift=0.5, diffusion_shift=2.5, tail_fraction=0.5, seed=None):
+        """
+        Deep-tail statistics (VaR/ES at 99% and 99.9%, see weighted_tail_statistics) by importance sampling:
+        a tail_fraction of the paths draw their jumps from a tilted model (see draw_tilted_jumps) and have their
+        diffusion shocks shifted so that the diffusion return drops by diffusion_shift standard deviations
+        (see shock_shifts). Every path is reweighted by its likelihood ratio (see defensive_log_weights).
+        The paths are not kept, since they do not follow the model without their weights.
+        """
+        rng = np.random.default_rng(seed)
+        steps = (num_simulations, num_days - 1)
+        tilted = rng.random((num_simulations, 1)) < tail_fraction
+        systematic = self.beta * self.sig_ETF * (self.dt ** 0.5)
+        idiosyncratic = self.sig_idio * (self.dt ** 0.5)
+        shifts = shock_shifts([systematic, idiosyncratic], num_days - 1, diffusion_shift)
+        shocks = rng.normal(size=(2,) + steps) - shifts[:, None, None] * tilted
+        diffusion = self.calculateDrift() + systematic * shocks[0] + idiosyncratic * shocks[1]
+        jumps, log_ratios = draw_tilted_jumps(self.lambda_jump if self.jumping else 0, self.mu_J, self.sigma_J, self.dt, steps,
+                                              intensity_tilt, size_shift, tilted, rng)
+        final_values = self.start_value * np.exp(np.sum(diffusion + jumps, axis=1))
+        # Normal shocks moved down by a shift: log P/Q = shift * shock + shift^2 / 2 at the shock used
+        shock_log_ratios = (shifts[:, None] * shocks.sum(axis=-1)).sum(axis=0) + (num_days - 1) * np.sum(shifts ** 2) / 2
+        log_weights = defensive_log_weights(log_ratios.sum(axis=1) + shock_log_ratios, tail_fraction)
+        self.tail_statistics = weighted_tail_statistics(final_values, log_weights, self.start_value)
+        return self.tail_statistics
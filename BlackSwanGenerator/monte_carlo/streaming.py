@@ -0,0 +1,144 @@
+import numpy as np
+from .risk_metrics import tail_standard_errors, update_reservoir
+
+
+class StreamingStatistics:
+    """
+    Builds the statistics of final_value_statistics chunk by chunk, without keeping the simulation matrices.
+    Mean, standard deviation, skewness and kurtosis come from online central moments merged per chunk.
+    VaR/ES are exact from the retained final values (exact=True), or approximate from a uniform reservoir
+    sample of sketch_size final values (exact=False), which keeps memory flat in the path count.
+    """
+
+    def __init__(self, initial_value, exact=True, sketch_size=10000, rng=None):
+        self.initial_value = initial_value
+        self.exact = exact
+        self.sketch_size = sketch_size
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.count = 0
+        self.mean = 0.0
+        # Sums of the 2nd, 3rd and 4th powers of the deviations from the mean
+        self.M2 = 0.0
+        self.M3 = 0.0
+        self.M4 = 0.0
+        self.losses = 0
+        # Running peak and worst drop over the final values, in simulation order
+        self.peak = -np.inf
+        self.max_drawdown = 0.0
+        self.final_values = []
+        self.sample = np.empty(0)
+
+    def update(self, final_values):
+        final_values = np.asarray(final_values, dtype=float)
+        n_b = len(final_values)
+        if n_b == 0:
+            return
+        mean_b = final_values.mean()
+        deviations = final_values - mean_b
+        M2_b = np.sum(deviations ** 2)
+        M3_b = np.sum(deviations ** 3)
+        M4_b = np.sum(deviations ** 4)
+
+        # Pairwise merge of central moments (Chan et al., Pebay)
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        M2_a, M3_a, M4_a = self.M2, self.M3, self.M4
+        self.mean += delta * n_b / n
+        self.M2 = M2_a + M2_b + delta ** 2 * n_a * n_b / n
+        self.M3 = (M3_a + M3_b + delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2
+                   + 3 * delta * (n_a * M2_b - n_b * M2_a) / n)
+        self.M4 = (M4_a + M4_b + delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 3
+                   + 6 * delta ** 2 * (n_a ** 2 * M2_b + n_b ** 2 * M2_a) / n ** 2
+                   + 4 * delta * (n_a * M3_b - n_b * M3_a) / n)
+        self.count = n
+        self.losses += int(np.sum(final_values < self.initial_value))
+
+        running_peak = np.maximum.accumulate(np.maximum(final_values, self.peak))
+        self.max_drawdown = max(self.max_drawdown, np.max(running_peak - final_values))
+        self.peak = running_peak[-1]
+
+        if self.exact:
+            self.final_values.append(final_values)
+        else:
+            self.update_sample(final_values, n_a)
+
+    def update_sample(self, final_values, seen):
+        self.sample = update_reservoir(self.sample, final_values, seen, self.sketch_size, self.rng)
+
+    def result(self):
+        values = np.concatenate(self.final_values) if self.exact else self.sample
+        var_95 = np.percentile(values, 5)
+        es_95 = np.mean(values[values < var_95])
+        # From the reservoir sample when exact=False, so they overstate the error of the full run
+        var_95_se, es_95_se = tail_standard_errors(values, var_95, es_95)
+        std_dev = np.sqrt(self.M2 / self.count)
+        if self.M2 > 0:
+            skewness = np.sqrt(self.count) * self.M3 / self.M2 ** 1.5
+            kurtosis = self.count * self.M4 / self.M2 ** 2 - 3
+        else:
+            skewness = kurtosis = np.nan
+        return {
+            'var_95': var_95,
+            'es_95': es_95,
+            'var_95_se': var_95_se,
+            'es_95_se': es_95_se,
+            'max_drawdown': self.max_drawdown,
+            'mean': self.mean,
+            'std_dev': std_dev,
+            'skewness': skewness,
+            'kurtosis': kurtosis,
+            'prob_loss': self.losses / self.count,
+        }
+
+
+class ControlVariateStatistics:
+    """
+    Control variate estimates of the mean final value and of the probability of loss, built chunk by chunk.
+    The control is a quantity simulated from the same draws whose expectation is known exactly (the no-jump
+    portfolio, a GBM whose expected final value is analytic): each estimate is corrected by c times the error
+    of the control's sample mean, with c the regression coefficient of the target on the control.
+    """
+
+    def __init__(self, initial_value, expected_control):
+        self.initial_value = initial_value
+        self.expected_control = expected_control
+        self.count = 0
+        # Running sums of the control y, the targets (final value x, loss indicator l) and their products
+        self.sums = dict.fromkeys(('y', 'yy', 'x', 'xx', 'xy', 'l', 'ly'), 0.0)
+
+    def update(self, final_values, control_values):
+        x = np.asarray(final_values, dtype=float)
+        y = np.asarray(control_values, dtype=float)
+        loss = (x < self.initial_value).astype(float)
+        self.count += len(x)
+        for name, values in (('y', y), ('yy', y * y), ('x', x), ('xx', x * x), ('xy', x * y), ('l', loss), ('ly', loss * y)):
+            self.sums[name] += values.sum()
+
+    def estimate(self, target, target_squares, cross):
+        """
+        Controlled mean of a target from its sums, with its standard error and the plain one.
+        """
+        n = self.count
+        mean_y = self.sums['y'] / n
+        var_y = self.sums['yy'] / n - mean_y ** 2
+        mean_t = self.sums[target] / n
+        var_t = max(self.sums[target_squares] / n - mean_t ** 2, 0.0)
+        cov = self.sums[cross] / n - mean_t * mean_y
+        c = cov / var_y if var_y > 0 else 0.0
+        correlation_squared = min(cov ** 2 / (var_t * var_y), 1.0) if var_t > 0 and var_y > 0 else 0.0
+        return mean_t - c * (mean_y - self.expected_control), np.sqrt(var_t * (1 - correlation_squared) / n), np.sqrt(var_t / n)
+
+    def result(self):
+        mean, mean_se, plain_mean_se = self.estimate('x', 'xx', 'xy')
+        # The indicator is its own square
+        prob_loss, prob_loss_se, plain_prob_loss_se = self.estimate('l', 'l', 'ly')
+        return {
+            'mean': mean,
+            'mean_se': mean_se,
+            'mean_variance_reduction': (plain_mean_se / mean_se) ** 2 if mean_se > 0 else np.nan,
+            'prob_loss': prob_loss,
+            'prob_loss_se': prob_loss_se,
+            'prob_loss_variance_reduction': (plain_prob_loss_se / prob_loss_se) ** 2 if prob_loss_se > 0 else np.nan,
+            'expected_control': self.expected_control,
+        }
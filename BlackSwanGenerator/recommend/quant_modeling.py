@@ -1,12 +1,14 @@
-from openai import OpenAI
+import llm
 import os
+import metrics
 from dotenv import load_dotenv
 
 load_dotenv()
 
 api_key = os.getenv("API_KEY")
 
-def analyze_portfolio(data):
+@metrics.timed('recommendations')
+def recommend_actions(data):
     """
     Analyze the portfolio data and suggest actions based on the risk factors.
     """
@@ -53,13 +55,20 @@ def analyze_portfolio(data):
         stock_actions = analyze_stock(stock, data)
         actions.extend(stock_actions)
 
-    client = OpenAI(api_key=api_key)
+    return actions
+
 
+@metrics.timed('summary')
+def summarize_actions(actions):
+    """
+    Five-sentence narrative summary of the recommended actions.
+    """
     system_message = "You are a financial risk analysis assistant specializing in portfolio optimization and risk mitigation. Given a set of recommended actions based on statistical risk metrics, generate a concise, five-sentence summary outlining the key concerns of the portfolio and the general adjustments that should be made. Your response should be professional, structured, and focused on high-level takeaways rather than an exhaustive list of actions."
 
     message = f"Here is a list of recommended actions based on a portfolio stress test and risk analysis--- {actions} ---Summarize the portfolio's overall risk profile and the key adjustments that should be made in five sentences. Focus on the most critical risks and the broad strategies for addressing them."
 
-    response = client.chat.completions.create(
+    return llm.chat(
+        'portfolio_summary',
         model="gpt-4-turbo",
         messages=[
             {"role": "system", "content": system_message},
@@ -68,9 +77,13 @@ def analyze_portfolio(data):
         temperature=0.5
     )
 
-    summary = response.choices[0].message.content
 
-    return actions, summary
+def analyze_portfolio(data):
+    """
+    Rule-based actions for the portfolio and their narrative summary.
+    """
+    actions = recommend_actions(data)
+    return actions, summarize_actions(actions)
 
 
 def analyze_stock(ticker, data):
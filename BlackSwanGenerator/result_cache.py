@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, CancelledError
+import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): computations are only shared within a process
+    fcntl = None
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_cache"))
+
+# Bump when the content of cached results changes, so that older files are ignored
+RESULT_VERSION = 2
+
+
+class SimulationResult:
+    """
+    What a stress test run produces, without the simulated paths: the /get_jack answer, the recommendations,
+    the compact chart summary (see monte_carlo.charts.chart_data) and, once rendered, the charts (in the
+    /get_jack_images format).
+    """
+
+    def __init__(self, key, answer_dict, recommendations, chart_data):
+        self.key = key
+        self.answer_dict = answer_dict
+        self.recommendations = recommendations
+        self.chart_data = chart_data
+        self.images = None
+        self.created = time.time()
+
+
+def result_key(portfolio_dict, start, end, **params):
+    """
+    Content hash of a simulation request: holdings with their ETF mapping, event window and the simulation
+    parameters (path count, horizon, seed, model flags...).
+    """
+    payload = json.dumps({
+        'version': RESULT_VERSION,
+        'holdings': sorted([ticker, etf, shares] for ticker, (etf, shares) in portfolio_dict.items()),
+        'start': start,
+        'end': end,
+        'params': params,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Simulation results keyed by result_key, kept in memory (LRU, max_entries) and pickled into directory,
+    valid for ttl seconds. get_or_compute runs one computation per key at a time: identical requests arriving
+    while it runs wait for its result instead of simulating again, in this process through an in-flight future
+    and across the worker processes sharing directory through a lock file per key (see key_lock).
+    Result files stay on disk for keep seconds (at least ttl), so that sessions and jobs can still read their
+    runs with a longer ttl; older files are deleted by purge, which store runs every purge_interval seconds.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, ttl=15 * 60, max_entries=32, keep=60 * 60, purge_interval=5 * 60):
+        self.directory = directory
+        self.ttl = ttl
+        self.keep = max(keep, ttl)
+        self.purge_interval = purge_interval
+        self.last_purge = 0
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key, ttl=None):
+        """
+        Result stored under key if it is at most ttl seconds old (default: the cache's ttl; a longer one reads
+        results kept for sessions, see service.get_run), else None.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                if now - result.created <= ttl:
+                    self.memory.move_to_end(key)
+                    return result
+                del self.memory[key]
+        try:
+            with open(self.path(key), 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Could not read cached result {key}: {e}")
+            return None
+        if now - result.created > ttl:
+            return None
+        self.remember(result)
+        return result
+
+    def remember(self, result):
+        with self.lock:
+            self.memory[result.key] = result
+            self.memory.move_to_end(result.key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def store(self, result):
+        self.remember(result)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.path(result.key) + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(result.key))
+        except OSError as e:
+            print(f"Could not write cached result {result.key}: {e}")
+        now = time.time()
+        with self.lock:
+            due = now - self.last_purge >= self.purge_interval
+            if due:
+                self.last_purge = now
+        if due:
+            self.purge()
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached result for key, or compute() (which must return a SimulationResult for key) run once however
+        many callers ask for key concurrently, in this process or in any worker sharing directory. When compute
+        is cancelled (raises CancelledError), a waiting caller runs it instead.
+        """
+        while True:
+            result = self.get(key)
+            if result is not None:
+                self.count('hits')
+                return result
+
+            with self.lock:
+                future = self.in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = self.in_flight[key] = Future()
+            if owner:
+                break
+            self.count('waits')
+            try:
+                return future.result()
+            except CancelledError:
+                # The computation was abandoned by its caller, take it over
+                continue
+
+        try:
+            with self.key_lock(key):
+                # Another worker may have stored it while this one waited for the lock
+                result = self.get(key)
+                if result is None:
+                    self.count('misses')
+                    result = compute()
+                    self.store(result)
+                else:
+                    self.count('waits')
+            future.set_result(result)
+        except CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return result
+
+    @contextmanager
+    def key_lock(self, key):
+        """
+        Exclusive lock on key shared by every process using directory (a no-op without fcntl). The lock file is
+        touched on every use, so purge only deletes the lock files of keys unused for keep seconds.
+        """
+        if fcntl is None:
+            yield
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_file = open(self.path(key) + '.lock', 'a')
+        except OSError as e:
+            print(f"Could not open the lock file of {key}: {e}")
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                os.utime(lock_file.name)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'waits': self.waits,
+                    'in_flight': len(self.in_flight), 'memory_entries': len(self.memory)}
+
+    def purge(self):
+        """
+        Delete result files (and leftover temporary and lock files) older than keep seconds.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.keep:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+result_cache = ResultCache(
+    ttl=int(os.getenv("RESULT_CACHE_TTL", 15 * 60)),
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", 32)),
+    keep=int(os.getenv("RESULT_CACHE_KEEP", 60 * 60)),
+)
+
+
+def cache_samples():
+    stats = result_cache.stats()
+    samples = [('blackswan_result_cache_requests_total', 'counter', 'Simulation result cache lookups by result', {'result': result}, stats[result])
+               for result in ('hits', 'misses', 'waits')]
+    samples.append(('blackswan_result_cache_in_flight', 'gauge', 'Simulations currently running for the result cache', {}, stats['in_flight']))
+    return samples
+
+
+metrics.register_collector(cache_samples)
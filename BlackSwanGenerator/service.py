@@ -0,0 +1,446 @@
+import json, re, os, threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, Future
+from dotenv import load_dotenv
+import llm
+import metrics
+from mongolib import read_mongo_database, getWeights, prefetch_portfolio
+from monte_carlo.monte_carlo_portfolio import PortfolioMonteCarlo, ENGINES
+from monte_carlo.charts import chart_data, cached_render, render_chart_data
+from recommend.quant_modeling import recommend_actions, summarize_actions
+from state_store import StateStore
+from result_cache import result_cache, result_key, SimulationResult
+
+load_dotenv()
+
+# MongoDB connection details
+MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = os.getenv("DB_NAME")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME")
+
+# Size of the stress-test simulation; a fixed SIMULATION_SEED makes runs reproducible
+NUM_SIMULATIONS = 1000
+NUM_DAYS = 252
+# Paths per chunk, i.e. per interim VaR/ES update
+SIMULATION_CHUNK = 100
+SIMULATION_SEED = int(os.environ["SIMULATION_SEED"]) if os.getenv("SIMULATION_SEED") else None
+# Variance reduction of the jump-diffusion engine: 'pseudo', 'antithetic' or 'sobol' shocks, and the
+# adaptive mode, which adds chunks until the VaR_95/ES_95 standard errors are within SIMULATION_TOLERANCE
+# of the portfolio value (e.g. 0.005), up to SIMULATION_MAX_PATHS paths
+SIMULATION_SAMPLING = os.getenv("SIMULATION_SAMPLING", "pseudo")
+SIMULATION_TOLERANCE = float(os.environ["SIMULATION_TOLERANCE"]) if os.getenv("SIMULATION_TOLERANCE") else None
+SIMULATION_MAX_PATHS = int(os.getenv("SIMULATION_MAX_PATHS", 20 * NUM_SIMULATIONS))
+# Importance-sampled paths behind the 99% and 99.9% VaR/ES of the jump-diffusion engine, e.g. 2000. The tail
+# run costs about as much as the main simulation, so it is off (0) unless deep-tail statistics are wanted
+TAIL_SIMULATIONS = int(os.getenv("TAIL_SIMULATIONS", 0))
+# Block bootstrap settings of the 'bootstrap' engine (see monte_carlo.bootstrap)
+BOOTSTRAP_BLOCK_SIZE = int(os.getenv("BOOTSTRAP_BLOCK_SIZE", 10))
+BOOTSTRAP_METHOD = os.getenv("BOOTSTRAP_METHOD", "stationary")
+
+# Independent I/O-bound steps of the pipeline (LLM prompts, holdings lookup, deferred summaries) run here;
+# per-service concurrency, timeouts and retries are enforced by the upstreams (see upstream.py)
+io_pool = ThreadPoolExecutor(max_workers=int(os.getenv("PIPELINE_IO_WORKERS", 8)), thread_name_prefix='io')
+
+# SimulationResult key -> Future of the summary being written for it
+pending_summaries = {}
+summaries_lock = threading.Lock()
+
+# Per-session state of the API: selected portfolio ID, selected card and the last stress-test run
+state = StateStore(
+    max_sessions=int(os.getenv("STATE_MAX_SESSIONS", 256)),
+    ttl=int(os.getenv("STATE_TTL", 60 * 60)),
+    max_bytes=int(os.getenv("STATE_MAX_MB", 512)) * 1024 * 1024,
+    shared_path=os.getenv("STATE_DB_PATH"),
+)
+
+
+class MissingState(LookupError):
+    """
+    Raised when a session has not stored what an operation needs yet (portfolio ID, card, stress-test run).
+    """
+
+
+def set_portfolio(session, portfolio_id):
+    state.set(session, 'portfolio_id', portfolio_id)
+
+
+def clear_portfolio(session):
+    state.delete(session, 'portfolio_id')
+
+
+def get_portfolio_id(session):
+    portfolio_id = state.get(session, 'portfolio_id')
+    if not portfolio_id:
+        raise MissingState("No portfolio ID found")
+    return portfolio_id
+
+
+def set_card(session, card):
+    state.set(session, 'card', card)
+
+
+def get_card(session):
+    card = state.get(session, 'card')
+    if card is None:
+        raise MissingState("No string found")
+    return card
+
+
+def black_swans(session):
+    """
+    Three historical black swan events relevant to the session's portfolio (the /post_swans response).
+    """
+    industry_weights = getWeights(MONGO_URI, DB_NAME, COLLECTION_NAME, get_portfolio_id(session))
+    swans = getMessage(industry_weights)
+    # Kept for scenario_test, which compares them all by default
+    state.set(session, 'swans', swans.get('events', []))
+    return swans
+
+
+def stress_test(session, card=None, portfolio_id=None, defer_summary=False, engine='jump_diffusion', job=None):
+    """
+    Run the stress test for the session (or the given card and portfolio) and keep the run in the session,
+    for the images, actions and fake event endpoints. Returns what run_stress_test returns.
+    """
+    card = card or get_card(session)
+    portfolio_id = portfolio_id or get_portfolio_id(session)
+    result = run_stress_test(card, portfolio_id, defer_summary, job=job, engine=engine)
+    # The run itself lives in result_cache, which every worker process can read
+    state.set(session, 'run', result[1].key)
+    state.set(session, 'fake_event', result[2])
+    return result
+
+
+def get_run(session):
+    """
+    SimulationResult of the session's last stress test, loaded from result_cache (which keeps it for
+    RESULT_CACHE_KEEP seconds).
+    """
+    key = state.get(session, 'run')
+    if key is None:
+        raise MissingState("No stress test run found")
+    result = result_cache.get(key, ttl=result_cache.keep)
+    if result is None:
+        raise MissingState("Stress test run expired")
+    return result
+
+
+def get_fake_event(session):
+    fake_event = state.get(session, 'fake_event')
+    if fake_event is None:
+        raise MissingState("No fake event found")
+    return fake_event
+
+
+def run_stress_test(string_data, portfolio_id, defer_summary=False, job=None, engine='jump_diffusion'):
+    """
+    The whole stress-test pipeline for one black swan card and portfolio.
+    Returns the /get_jack answer, the SimulationResult (recommendations and charts) and the fake event.
+    The date range, the fake event and the holdings (with their ETF lookups) are fetched concurrently.
+    Simulation results are shared through result_cache by every request for the same holdings and window.
+    defer_summary: return as soon as the numbers and actions are ready; the narrative summary is written into
+    the result in the background (recommendations['summary'] stays None until then).
+    job: optional Job whose stage is updated as the pipeline advances and which receives its progress events
+    (dates, fake_event, etf_mapped, calibrated, simulated, statistics, actions, recommendations).
+    engine: 'jump_diffusion' (calibrated model) or 'bootstrap' (block bootstrap of the event window's history).
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+
+    def stage(name):
+        if job is not None:
+            job.set_stage(name)
+
+    def emit(event, **data):
+        if job is not None:
+            job.emit(event, **data)
+
+    dates_future = submit('dates', get_dates, string_data)
+    fake_event_future = submit('fake_event', generate_fake_event, string_data)
+    holdings_future = submit('holdings', prefetch_portfolio, MONGO_URI, DB_NAME, COLLECTION_NAME, portfolio_id)
+
+    stage('resolving dates')
+    start, end = dates_future.result()
+    emit('dates', start=start, end=end)
+
+    stage('generating fake event')
+    fake_event = str(fake_event_future.result())
+    emit('fake_event', fake_event=fake_event)
+
+    stage('mapping ETFs')
+    try:
+        holdings_future.result()
+    except Exception as e:
+        # read_mongo_database tries again and reports the error
+        print(f"Could not prefetch portfolio {portfolio_id}: {e}")
+    with metrics.timed('etf_mapping'):
+        portfolio_dict = read_mongo_database(MONGO_URI, DB_NAME, COLLECTION_NAME, portfolio_id, start)
+    if not portfolio_dict:
+        raise ValueError("No holdings found for portfolio")
+    for ticker, (etf, shares) in portfolio_dict.items():
+        emit('etf_mapped', ticker=ticker, etf=etf, shares=shares)
+
+    if engine == 'bootstrap':
+        key = result_key(portfolio_dict, start, end, engine=engine, num_simulations=NUM_SIMULATIONS, num_days=NUM_DAYS,
+                         seed=SIMULATION_SEED, block_size=BOOTSTRAP_BLOCK_SIZE, method=BOOTSTRAP_METHOD, with_no_jump=True)
+    else:
+        key = result_key(portfolio_dict, start, end, num_simulations=NUM_SIMULATIONS, num_days=NUM_DAYS,
+                         chunk_size=SIMULATION_CHUNK, seed=SIMULATION_SEED, with_no_jump=True, correlated=True, sampling=SIMULATION_SAMPLING,
+                         control_variate=True, tolerance=SIMULATION_TOLERANCE, max_simulations=SIMULATION_MAX_PATHS, tail_simulations=TAIL_SIMULATIONS)
+    result = result_cache.get_or_compute(key, lambda: simulate_portfolio(key, portfolio_dict, start, end, stage, emit, engine))
+
+    stage('summarizing')
+    summary = request_summary(result)
+    if not defer_summary:
+        summary.result()
+        emit('recommendations', **result.recommendations)
+    return result.answer_dict, result, fake_event
+
+
+def scenario_test(session, scenarios=None, portfolio_id=None, seed=None, job=None):
+    """
+    Stress test one portfolio against several black swan events side by side (see
+    PortfolioMonteCarlo.monteCarloScenarios). scenarios: list of {'name', 'start', 'end'}; entries without
+    dates are resolved from their name (or 'string') with get_dates. Defaults to the events last returned by
+    /post_swans for the session.
+    The holdings are mapped to the ETFs that existed at the earliest event, so that every scenario shares one
+    calibration.
+    """
+    def stage(name):
+        if job is not None:
+            job.set_stage(name)
+
+    scenarios = scenarios or state.get(session, 'swans')
+    if not scenarios:
+        raise MissingState("No scenarios given and no black swans found")
+    portfolio_id = portfolio_id or get_portfolio_id(session)
+
+    stage('resolving dates')
+    holdings_future = submit('holdings', prefetch_portfolio, MONGO_URI, DB_NAME, COLLECTION_NAME, portfolio_id)
+    names = [scenario.get('name') or scenario.get('string') or f"Scenario {i + 1}" for i, scenario in enumerate(scenarios)]
+    date_futures = [None if scenario.get('start') and scenario.get('end') else submit('dates', get_dates, scenario.get('string') or name)
+                    for scenario, name in zip(scenarios, names)]
+    windows = []
+    for scenario, name, future in zip(scenarios, names, date_futures):
+        start, end = future.result() if future is not None else (scenario['start'], scenario['end'])
+        windows.append({'name': name, 'start': start.strip(), 'end': end.strip()})
+    if len({window['name'] for window in windows}) < len(windows):
+        raise ValueError("Scenario names must be unique")
+
+    stage('mapping ETFs')
+    try:
+        holdings_future.result()
+    except Exception as e:
+        print(f"Could not prefetch portfolio {portfolio_id}: {e}")
+    earliest = min(windows, key=lambda window: window['start'])
+    with metrics.timed('etf_mapping'):
+        portfolio_dict = read_mongo_database(MONGO_URI, DB_NAME, COLLECTION_NAME, portfolio_id, earliest['start'])
+    if not portfolio_dict:
+        raise ValueError("No holdings found for portfolio")
+
+    stage('calibrating')
+    with metrics.timed('calibration'):
+        portfolio = PortfolioMonteCarlo(portfolio_dict, earliest['start'], earliest['end'])
+
+    stage('simulating')
+    result = portfolio.monteCarloScenarios(windows, NUM_SIMULATIONS, NUM_DAYS, seed=SIMULATION_SEED if seed is None else seed)
+    result['failed_tickers'] = portfolio.failed_tickers
+    return result
+
+
+def submit(stage, fn, *args):
+    """
+    Run fn(*args) on io_pool, timed as stage and counted towards the current request's timings.
+    """
+    def run():
+        with metrics.timed(stage):
+            return fn(*args)
+    return io_pool.submit(metrics.copy_context(run))
+
+
+def simulate_portfolio(key, portfolio_dict, start, end, stage, emit, engine='jump_diffusion'):
+    """
+    Calibrate, simulate and analyze a portfolio, as a SimulationResult stored under key (without its summary,
+    see request_summary, and with its charts as chart_data, rendered on demand by result_images).
+    The jump-diffusion paths are simulated SIMULATION_CHUNK at a time so that interim VaR/ES can be reported;
+    the bootstrap engine resamples the event window in one pass.
+    """
+    stage('calibrating')
+    with metrics.timed('calibration'):
+        portfolio = PortfolioMonteCarlo(portfolio_dict, start, end, progress=emit, engine=engine)
+
+    stage('simulating')
+    answer_dict = {}
+    if engine == 'bootstrap':
+        answer_dict['portfolio_stats'] = portfolio.monteCarloBootstrap(NUM_SIMULATIONS, NUM_DAYS, BOOTSTRAP_BLOCK_SIZE, BOOTSTRAP_METHOD,
+                                                                       seed=SIMULATION_SEED, with_no_jump=True, progress=emit)
+    else:
+        answer_dict['portfolio_stats'] = portfolio.monteCarloStreaming(NUM_SIMULATIONS, NUM_DAYS, chunk_size=SIMULATION_CHUNK, seed=SIMULATION_SEED,
+                                                                       keep_paths=NUM_SIMULATIONS, with_no_jump=True, progress=emit,
+                                                                       sampling=SIMULATION_SAMPLING, control_variate=True,
+                                                                       tolerance=SIMULATION_TOLERANCE, max_simulations=SIMULATION_MAX_PATHS)
+        if TAIL_SIMULATIONS:
+            tail = portfolio.monteCarloImportance(TAIL_SIMULATIONS, NUM_DAYS, seed=SIMULATION_SEED)
+            tail.pop('stocks')
+            answer_dict['portfolio_stats']['tail'] = tail
+            for stock in portfolio.stocks:
+                stock.statistics['tail'] = stock.tail_statistics
+
+    for stock in portfolio.stocks:
+        answer_dict[stock.ticker] = {
+            "beta": stock.beta, 
+            "sig_s": stock.sig_S, 
+            "sig_etf": stock.sig_ETF, 
+            "sig_idio": stock.sig_idio, 
+            "lambda_jump": stock.lambda_jump,
+            "start_value": stock.start_value,
+            "stock_stats": stock.statistics
+        }
+    emit('statistics', **answer_dict)
+
+    stage('recommending')
+    actions = recommend_actions(answer_dict)
+    emit('actions', actions=actions)
+    recommendations = {'actions': actions, 'summary': None}
+    with metrics.timed('chart_data'):
+        charts = chart_data(portfolio.simulations, portfolio.no_jump_simulations, portfolio.portfolio_value)
+    return SimulationResult(key, answer_dict, recommendations, charts)
+
+
+def request_summary(result):
+    """
+    Future of the narrative summary of result's actions. The summary is written once per result, on io_pool,
+    into result.recommendations, and the result is stored again in result_cache.
+    """
+    with summaries_lock:
+        future = pending_summaries.get(result.key)
+        if future is None:
+            if result.recommendations['summary'] is not None:
+                future = Future()
+                future.set_result(result.recommendations['summary'])
+                return future
+            future = pending_summaries[result.key] = io_pool.submit(metrics.copy_context(write_summary), result)
+    return future
+
+
+def write_summary(result):
+    try:
+        if result.recommendations['summary'] is None:
+            result.recommendations['summary'] = summarize_actions(result.recommendations['actions'])
+            result_cache.store(result)
+    finally:
+        with summaries_lock:
+            pending_summaries.pop(result.key, None)
+    return result.recommendations['summary']
+
+
+def result_images(result):
+    """
+    The three charts of a stress-test result, in the /get_jack_images format. They are drawn from its chart_data
+    the first time they are asked for and kept with the result.
+    """
+    if result.images is None:
+        result.images = [
+            {"name": f"{name}_image", "data": cached_render(result.key, name, lambda name=name: render_chart_data(result.chart_data, name))}
+            for name in ('monte', 'returns_annualized', 'no_jump')
+        ]
+        result_cache.store(result)
+    return result.images
+
+
+def parse_date_range(content):
+    """
+    (start, end) of a YYYY-MM-DD,YYYY-MM-DD answer; raises ValueError on anything else.
+    """
+    dates = [part.strip() for part in content.split(',')]
+    if len(dates) != 2:
+        raise ValueError(f"Invalid date range received from OpenAI: {content!r}")
+    for date in dates:
+        datetime.strptime(date, '%Y-%m-%d')
+    return dates[0], dates[1]
+
+
+def parse_events(ugly):
+    try:
+        pretty = re.sub(r'(\w+):', r'"\1":', ugly)
+        return json.loads(pretty)
+    except (json.JSONDecodeError, AttributeError):
+        raise ValueError("Invalid JSON response received from OpenAI")
+
+
+def get_dates(string_data):
+    sys_prompt = "You are an expert in historical financial analysis and risk modeling. Given the name of a past black swan event, determine the most relevant start date when its effects began to impact financial markets or economic data. The end date should always be exactly two years after the start date. **Format your response strictly as YYYY-MM-DD,YYYY-MM-DD without any explanations or additional text.**"
+
+    prompt = f"Given the past black swan event '{string_data},' provide a date range in the format YYYY-MM-DD,YYYY-MM-DD. The start date should reflect when the event first impacted financial markets, and the end date should be exactly two years later. Output only the date range with no additional text."
+    
+    return llm.chat(
+        'get_dates',
+        model="gpt-4-turbo",
+        response_format={'type': 'text'},
+        messages=[
+            {'role': 'system', 'content': sys_prompt},
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature = 0,
+        parse=parse_date_range
+    )
+
+
+def generate_fake_event(string_data):
+    prompt = "Given the name of a real black swan event from the past, generate a fictional black swan event that could plausibly occur in the future. The fictional event should be inspired by the themes or consequences of the original but should be unique and not simply a repeat. Provide a 3-4 sentence description of this new event, detailing what happens, its unexpected nature, and its broad impact. Here is the past black swan event: " + string_data
+    sys_prompt = "You are an expert in risk analysis and scenario generation. Your task is to create plausible but entirely fictional future black swan events inspired by past real-world black swan events. Given the name of a real historical black swan event, generate a unique future event that shares similar unexpected consequences but occurs under different circumstances. The event should be realistic yet unpredictable, with a clear description of what happens, why it is unforeseen, and its global impact. Avoid direct repetition of historical events and focus on novel disruptions that could emerge in the future."
+    
+    return llm.chat(
+        'generate_fake_event',
+        model="gpt-4",
+        response_format={'type': 'text'},
+        messages=[
+            {'role': 'system', 'content': sys_prompt},
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature = 0.6
+    )
+        
+    
+
+def getMessage(user_industries):
+    prompt = "Generate 3 historical categorized Black Swan events that occurred between 1975 and the present, which would have impacted the following portfolio of (industry, weight) pairs:" + str(user_industries) + """
+    ### Categorization of Events by Rarity:
+    1. **Very Uncommon**: Extremely rare (once in 25+ years), highly unpredictable, such as major financial collapses or unprecedented geopolitical conflicts.
+    2. **Uncommon**: Rare (once in 15-25 years), but with historical precedent, such as major recessions or global financial crises.
+    3. **Common**: Recurring (every 1-15 years), systemic risks with predictable cycles, such as interest rate hikes, tariffs, or regional market shocks.
+
+    ### For Each Event, Provide:
+    - **Name** (e.g., "Global Financial Crisis")
+    - **Start Date** (e.g., "2008-09-15")
+    - **Description** (A concise description with key triggers and scale of disruption)
+    - **Rarity** (very_uncommon, uncommon, common)
+
+    Format your response as a JSON object:
+    {
+        "events": [
+            {
+                "name": "Event Name",
+                "start_date": "YYYY-MM",
+                "description": "Brief explanation of what happened and market impact",
+                "rarity": "very_uncommon/uncommon/common"
+            },
+            ...
+        ]
+    }
+
+    """
+    
+    system_prompt = "You are a financial crisis expert. Ensure that the response follows the format described above, with each event clearly separated. Make sure you have **one event of each rarity** category (very uncommon, uncommon, common)."
+
+    return llm.chat(
+        'getMessage',
+        model="gpt-4-turbo",
+        response_format={'type': 'json_object'},
+        messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature = 0.75,
+        parse=parse_events
+    )
@@ -0,0 +1,179 @@
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def estimate_size(value, depth=4):
+    """
+    Rough memory footprint of value in bytes, counting numpy arrays by their buffers and walking
+    containers and object attributes a few levels deep.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if depth == 0:
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, depth - 1) + estimate_size(v, depth - 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(estimate_size(v, depth - 1) for v in value)
+    if hasattr(value, '__dict__'):
+        return size + estimate_size(vars(value), depth - 1)
+    return size
+
+
+class StateStore:
+    """
+    Per-session state (selected portfolio, card, last stress-test run...) shared by all request threads.
+    Sessions are evicted least recently used first once there are more than max_sessions of them or their
+    estimated size exceeds max_bytes, and expire ttl seconds after their last use.
+    With shared_path, JSON-serializable fields are also written to a SQLite file, so that other worker
+    processes see them; anything else stays in the memory of the process that set it, so fields that must be
+    seen by every worker have to be JSON (e.g. the result_cache key of a run rather than the result).
+    """
+
+    def __init__(self, max_sessions=256, ttl=60 * 60, max_bytes=512 * 1024 * 1024, shared_path=None, table='state'):
+        """
+        table: SQLite table of the shared fields, so that stores with different ttls can share one file.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.shared_path = shared_path
+        self.table = table
+        # session -> {'fields': {...}, 'stamps': {field: (updated, shared)}, 'accessed': timestamp, 'size': bytes},
+        # most recently used last
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+    def get_db(self):
+        # Called with self.lock held
+        if self.db is None and self.shared_path:
+            self.db = sqlite3.connect(self.shared_path, check_same_thread=False, timeout=10)
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (session TEXT, field TEXT, value TEXT, updated REAL, PRIMARY KEY (session, field))")
+            self.db.commit()
+        return self.db
+
+    def get(self, session, field, default=None, cached=True):
+        """
+        A field kept in this process's memory is only returned as long as no other process has changed it in
+        the SQLite file since (checked from its updated stamp). cached=False reads a shared field from the
+        SQLite file, ignoring (and not filling) this process's memory, for values that other processes keep
+        changing.
+        """
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            db = self.get_db()
+            entry = self.sessions.get(session)
+            if cached and entry is not None and field in entry['fields']:
+                entry['accessed'] = now
+                self.sessions.move_to_end(session)
+                updated, shared = entry['stamps'][field]
+                if db is None:
+                    return entry['fields'][field]
+                row = db.execute(f"SELECT updated FROM {self.table} WHERE session = ? AND field = ?", (session, field)).fetchone()
+                if row is None and shared:
+                    # Deleted or expired by another process
+                    self.forget(session, field)
+                    return default
+                if row is None or row[0] <= updated:
+                    return entry['fields'][field]
+            if db is None:
+                return default
+            row = db.execute(f"SELECT value, updated FROM {self.table} WHERE session = ? AND field = ? AND updated >= ?",
+                             (session, field, now - self.ttl)).fetchone()
+            if row is None:
+                return default
+            value = json.loads(row[0])
+            if cached:
+                self.remember(session, field, value, now, row[1])
+        return value
+
+    def set(self, session, field, value, share=True):
+        now = time.time()
+        with self.lock:
+            db = self.get_db()
+            serialized = None
+            if share and db is not None:
+                try:
+                    serialized = json.dumps(value)
+                except TypeError:
+                    pass
+            self.remember(session, field, value, now, now if serialized is not None else None)
+            if serialized is not None:
+                db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)", (session, field, serialized, now))
+                db.execute(f"DELETE FROM {self.table} WHERE updated < ?", (now - self.ttl,))
+                db.commit()
+
+    def remember(self, session, field, value, now, shared_stamp=None):
+        """
+        Keep field in this process's memory. shared_stamp: updated stamp of its row in the SQLite file, None
+        for a field that only lives in this process (whose set time is kept instead).
+        Called with self.lock held.
+        """
+        entry = self.sessions.setdefault(session, {'fields': {}, 'stamps': {}, 'accessed': now, 'size': 0})
+        entry['fields'][field] = value
+        entry['stamps'][field] = (now, False) if shared_stamp is None else (shared_stamp, True)
+        entry['accessed'] = now
+        self.total_bytes -= entry['size']
+        entry['size'] = estimate_size(entry['fields'])
+        self.total_bytes += entry['size']
+        self.sessions.move_to_end(session)
+        self.evict(keep=session)
+
+    def delete(self, session, field=None):
+        """
+        Forget one field of session, or the whole session when field is None.
+        """
+        with self.lock:
+            entry = self.sessions.get(session)
+            if entry is not None:
+                if field is None:
+                    self.drop(session)
+                else:
+                    self.forget(session, field)
+            db = self.get_db()
+            if db is not None:
+                if field is None:
+                    db.execute(f"DELETE FROM {self.table} WHERE session = ?", (session,))
+                else:
+                    db.execute(f"DELETE FROM {self.table} WHERE session = ? AND field = ?", (session, field))
+                db.commit()
+
+    def forget(self, session, field):
+        # Called with self.lock held
+        entry = self.sessions[session]
+        entry['fields'].pop(field, None)
+        entry['stamps'].pop(field, None)
+        self.total_bytes -= entry['size']
+        entry['size'] = estimate_size(entry['fields'])
+        self.total_bytes += entry['size']
+
+    def drop(self, session):
+        # Called with self.lock held
+        entry = self.sessions.pop(session)
+        self.total_bytes -= entry['size']
+
+    def expire(self, now):
+        # Called with self.lock held; sessions are ordered by last use, so expired ones come first
+        while self.sessions:
+            session, entry = next(iter(self.sessions.items()))
+            if now - entry['accessed'] <= self.ttl:
+                break
+            self.drop(session)
+
+    def evict(self, keep):
+        # Called with self.lock held
+        self.expire(time.time())
+        while len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            session = next(iter(self.sessions))
+            if session == keep:
+                break
+            self.drop(session)
@@ -0,0 +1,73 @@
+import time
+import random
+import threading
+import metrics
+
+
+class UpstreamBusy(Exception):
+    """
+    Raised when no concurrency slot of an upstream frees up within its timeout.
+    """
+
+
+class Upstream:
+    """
+    Guards the calls made to one external service (OpenAI, Yahoo Finance...): at most max_concurrency calls
+    run at once, and failed calls are retried up to retries times with jittered exponential backoff.
+    timeout bounds the wait for a free slot; callers pass it on to the client as its request timeout.
+    retry_if: optional predicate on a result that should be retried as well (e.g. an empty download).
+    """
+
+    def __init__(self, name, max_concurrency=4, timeout=30, retries=2, backoff=0.5, retry_if=None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_if = retry_if
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'retries': 0, 'failures': 0, 'busy': 0}
+        metrics.register_collector(self.samples)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) within the concurrency bound, retried on exceptions and on results matching retry_if.
+        The result of the last attempt is returned as is.
+        """
+        self.count('calls')
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count('retries')
+                time.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+            if not self.slots.acquire(timeout=self.timeout):
+                self.count('busy')
+                raise UpstreamBusy(f"{self.name}: no free slot within {self.timeout}s")
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.retries:
+                    self.count('failures')
+                    raise
+                print(f"{self.name} call failed ({e}), retrying")
+                continue
+            finally:
+                self.slots.release()
+                elapsed = time.perf_counter() - start
+                metrics.observe('blackswan_upstream_seconds', elapsed, 'Duration of calls to external services', upstream=self.name)
+                metrics.record_timing(self.name, elapsed)
+            if self.retry_if is None or attempt == self.retries or not self.retry_if(result):
+                return result
+        return result
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def samples(self):
+        return [('blackswan_upstream_calls_total', 'counter', 'Calls to external services by outcome', {'upstream': self.name, 'outcome': outcome}, count)
+                for outcome, count in self.stats().items()]
@@ -7,6 +7,7 @@ import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { toast } from "@/hooks/use-toast"
 import { EventCard } from "@/components/ui/EventCard"
+import { flaskFetch } from "@/lib/flask-api"
 
 type Portfolio = {
   _id: string
@@ -20,8 +21,6 @@ type Event = {
   rarity: string
 }
 
-const FLASK_API_URL = process.env.NEXT_PUBLIC_FLASK_API_URL || "http://127.0.0.1:5000"
-
 export default function StressTestPage() {
   const [starredPortfolio, setStarredPortfolio] = useState<Portfolio | null>(null)
   const [isLoading, setIsLoading] = useState(true)
@@ -64,7 +63,7 @@ export default function StressTestPage() {
 
   const getCurrentTestPortfolio = async () => {
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/get_portfolio`)
+      const response = await flaskFetch("/get_portfolio")
       if (response.ok) {
         const data = await response.json()
         setCurrentTestPortfolio(data.portfolio_id)
@@ -88,7 +87,7 @@ export default function StressTestPage() {
     setIsFetchingEvents(true)
     try {
       // First, add the portfolio
-      const addResponse = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/add_portfolio`, {
+      const addResponse = await flaskFetch("/add_portfolio", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -104,7 +103,7 @@ export default function StressTestPage() {
       setCurrentTestPortfolio(addResult.id)
 
       // Then, fetch the swan events using GET method
-      const swansResponse = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/post_swans`, {
+      const swansResponse = await flaskFetch("/post_swans", {
         method: "GET",
       })
 
@@ -150,7 +149,7 @@ export default function StressTestPage() {
 
   const handleClearTest = async () => {
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/clear_portfolio`, {
+      const response = await flaskFetch("/clear_portfolio", {
         method: "DELETE",
       })
 
@@ -191,7 +190,7 @@ export default function StressTestPage() {
 
     try {
       const concatenatedString = `${selectedEvent.name} ${selectedEvent.start_date}`
-      const response = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/post_string`, {
+      const response = await flaskFetch("/post_string", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -10,6 +10,7 @@ import { AlertCircle } from "lucide-react"
 import StressTestAnalysis from "@/components/ui/StressTestAnalysis"
 import { ChevronDown, ChevronUp } from "lucide-react"
 import PdfExportButton from "@/components/ui/PdfExportButton"
+import { flaskFetch } from "@/lib/flask-api"
 
 type FakeEvent = {
   fake_event: string
@@ -46,7 +47,7 @@ export default function StressTestResult() {
         setHasError(errorParam === "true")
 
         // Fetch fake event data
-        const fakeEventResponse = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/get_fake_event`)
+        const fakeEventResponse = await flaskFetch("/get_fake_event")
         if (!fakeEventResponse.ok) {
           throw new Error("Failed to fetch fake event data")
         }
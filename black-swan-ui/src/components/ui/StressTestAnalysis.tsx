@@ -10,6 +10,7 @@ import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "@/comp
 // Remove the import for StressTestRecommendations
 // import { StressTestRecommendations } from "./StressTestRecommendations"
 import { Button } from "@/components/ui/button"
+import { flaskFetch } from "@/lib/flask-api"
 // Add these imports
 import { AlertTriangle, Loader2, AlertCircle, TrendingDown, BarChart2, RefreshCcw } from "lucide-react"
 
@@ -64,8 +65,8 @@ export default function StressTestAnalysis() {
     const fetchData = async () => {
       try {
         const [analysisResponse, imagesResponse] = await Promise.all([
-          fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/get_jack`),
-          fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/get_jack_images`),
+          flaskFetch("/get_jack"),
+          flaskFetch("/get_jack_images"),
         ])
 
         if (!analysisResponse.ok || !imagesResponse.ok) {
@@ -113,7 +114,7 @@ export default function StressTestAnalysis() {
     setLoadingRecommendations(true)
     setRecommendationError(null)
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_FLASK_API_URL}/get_actions`)
+      const response = await flaskFetch("/get_actions")
       if (!response.ok) {
         throw new Error("Failed to fetch recommendations")
       }
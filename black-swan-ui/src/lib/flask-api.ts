@@ -0,0 +1,19 @@
+const FLASK_API_URL = process.env.NEXT_PUBLIC_FLASK_API_URL || "http://127.0.0.1:5000"
+const SESSION_STORAGE_KEY = "blackswan_session"
+
+// The Flask backend keeps the selected portfolio, event and last stress test per session, so every call
+// from this browser has to carry the same session id
+function getSessionId() {
+  let sessionId = window.localStorage.getItem(SESSION_STORAGE_KEY)
+  if (!sessionId) {
+    sessionId = Array.from(crypto.getRandomValues(new Uint8Array(16)), (byte) => byte.toString(16).padStart(2, "0")).join("")
+    window.localStorage.setItem(SESSION_STORAGE_KEY, sessionId)
+  }
+  return sessionId
+}
+
+export function flaskFetch(path: string, init: RequestInit = {}) {
+  const headers = new Headers(init.headers)
+  headers.set("X-Session-Id", getSessionId())
+  return fetch(`${FLASK_API_URL}${path}`, { ...init, headers })
+}